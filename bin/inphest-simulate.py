@@ -11,8 +11,10 @@ import inphest
 # from inphest import simulate
 # from inphest import model
 from inphest import utility
+from inphest import communityecology
 from inphest import simulate
 from inphest import model
+from inphest import summarize
 
 def get_example_model():
     model_definition = {}
@@ -26,11 +28,45 @@ def main():
     host_options.add_argument("-H", "--host-biogeographic-history",
             metavar="HOST-EVENT-FILE",
             default=None,
-            help="Path to file providing the host biogeographic events.")
+            help="Path to file providing the host biogeographic events (which may be compressed by gzip, bz2 or xz).")
     host_options.add_argument("-F", "--host-biogeographic-history-format",
             choices=["revbayes", "archipelago"],
             default="revbayes",
             help="Format of the host biogeographic history.")
+    host_options.add_argument("--burnin",
+            type=int,
+            default=0,
+            metavar="N",
+            help="Discard the first N host biogeographic history samples (default: %(default)s).")
+    host_options.add_argument("--thinning",
+            type=int,
+            default=1,
+            metavar="K",
+            help="Use only every K-th host biogeographic history sample after burn-in (default: %(default)s).")
+    host_options.add_argument("--host-history-indexes",
+            type=int,
+            nargs="+",
+            default=None,
+            metavar="IDX",
+            help="Use only the host biogeographic history samples with these (0-based) indexes in the source.")
+    host_options.add_argument("--host-history-random-subsample",
+            type=int,
+            default=None,
+            metavar="N",
+            help="Use N host biogeographic history samples drawn at random (after burn-in, thinning and index selection).")
+    host_options.add_argument("--host-history-random-subsample-seed",
+            type=int,
+            default=None,
+            metavar="SEED",
+            help="Seed for random subsampling of host biogeographic history samples.")
+    host_options.add_argument("--host-history-cache-dir",
+            metavar="DIRECTORY",
+            default=None,
+            help="Directory in which to store compiled host histories (default: same directory as host biogeographic history file).")
+    host_options.add_argument("--no-host-history-cache",
+            action="store_true",
+            default=False,
+            help="Do not read or write compiled host histories: always parse the host biogeographic history from scratch.")
 
     model_options = parser.add_argument_group("Simulation Model")
     model_options.add_argument("model_file",
@@ -50,6 +86,46 @@ def main():
             action="store_true",
             help="Run analysis under an example model.")
 
+    summary_stats_options = parser.add_argument_group("Summary Statistics Options")
+    summary_stats_options.add_argument("--summary-statistics",
+            nargs="+",
+            default=None,
+            choices=list(summarize.SummaryStatsCalculator.STATISTIC_GROUPS),
+            metavar="GROUP",
+            help="Groups of summary statistics to calculate, overriding those given in the model definition: one or more of {} (default: those given in the model definition or, if not given, {}).".format(
+                ", ".join("'{}'".format(g) for g in summarize.SummaryStatsCalculator.STATISTIC_GROUPS),
+                ", ".join("'{}'".format(g) for g in summarize.SummaryStatsCalculator.DEFAULT_STATISTIC_GROUPS)))
+    summary_stats_options.add_argument("--summary-statistics-workers",
+            type=int,
+            default=0,
+            metavar="N",
+            help="Calculate summary statistics asynchronously, using N worker processes, while the simulation proceeds (default: calculate summary statistics as each replicate completes).")
+    summary_stats_options.add_argument("--summary-statistics-queue-size",
+            type=int,
+            default=None,
+            metavar="N",
+            help="With '--summary-statistics-workers', the maximum number of replicates awaiting calculation of summary statistics before the simulation waits (default: twice the number of workers).")
+    summary_stats_options.add_argument("--num-randomization-replicates",
+            type=int,
+            default=100,
+            metavar="N",
+            help="Number of randomization replicates used to calculate standardized effect sizes (or, with '--randomization-tolerance', the number drawn at a time unless '--randomization-block-size' is given; default: %(default)s).")
+    summary_stats_options.add_argument("--randomization-tolerance",
+            type=float,
+            default=None,
+            metavar="TOL",
+            help="Draw randomization replicates adaptively, in blocks, until the standardized effect size z-score and p-value estimates change by no more than TOL.")
+    summary_stats_options.add_argument("--max-randomization-replicates",
+            type=int,
+            default=None,
+            metavar="N",
+            help="Maximum number of randomization replicates drawn with '--randomization-tolerance' (default: 10 times the number of randomization replicates).")
+    summary_stats_options.add_argument("--randomization-block-size",
+            type=int,
+            default=None,
+            metavar="N",
+            help="Number of randomization replicates drawn at a time with '--randomization-tolerance'.")
+
     output_options = parser.add_argument_group("Output Options")
     output_options.add_argument('-o', '--output-prefix',
         action='store',
@@ -58,6 +134,46 @@ def main():
         default='inphest',
         metavar='OUTPUT-FILE-PREFIX',
         help="Prefix for output files (default: '%(default)s').")
+    output_options.add_argument("--output-buffer-size",
+            type=int,
+            default=1,
+            metavar="N",
+            help=("Number of replicates whose trees and summary statistics are held in memory before being written out together (default: %(default)s)."
+                  " Each batch is written to all the (uncompressed) output files or, if writing fails or the run is interrupted (e.g., by Ctrl-C), to none."
+                  " If the process is killed outright or the system crashes while a batch is being written out, however, or if the output is compressed,"
+                  " the last tree or row of summary statistics may be left incomplete, or present in some files but not others: uncompressed output can"
+                  " be repaired by rerunning with '--resume' (which truncates the files to the last batch recorded in the run manifest); compressed"
+                  " output cannot."))
+    output_options.add_argument("--output-buffer-time",
+            type=float,
+            default=None,
+            metavar="SECONDS",
+            help="Also write out the trees and summary statistics held in memory once this number of seconds have passed since they were last written out.")
+    output_options.add_argument("--sync-output",
+            action="store_true",
+            default=False,
+            help="Synchronize the output files to disk (fsync) whenever they are written out, before the run manifest records them, so that a run can be resumed (see '--resume') even after a system crash; slower.")
+    output_options.add_argument("--summary-statistics-format",
+            choices=["csv", "columns"],
+            default="csv",
+            help="Write the summary statistics as a CSV file ('csv'), or as a binary columnar store ('columns': a directory of NumPy array files, one per statistic, which can be loaded selectively and memory-mapped, with a JSON header; default: %(default)s).")
+    output_options.add_argument("--no-trees-index",
+            action="store_true",
+            default=False,
+            help="Do not write an index of the byte offset, replicate, host history and random seed of each tree alongside the trees file.")
+    output_options.add_argument("--output-compression",
+            choices=["none"] + list(utility.COMPRESSION_EXTENSIONS),
+            default="none",
+            help="Compress the trees, summary statistics and log files as they are written, appending the corresponding extension ('.gz', '.bz2' or '.xz') to their paths (default: %(default)s).")
+    output_options.add_argument("--resume",
+            action="store_true",
+            default=False,
+            help="Resume an interrupted run with the same output prefix and settings from its run manifest, keeping the replicates already written out and simulating only the remaining ones (requires uncompressed output).")
+    output_options.add_argument("--checkpoint-interval",
+            type=float,
+            default=None,
+            metavar="SECONDS",
+            help="Checkpoint the state of each replicate in progress every this number of seconds, so that, when resumed (see '--resume'), interrupted replicates are continued from their last checkpoint rather than simulated again.")
 
     run_options = parser.add_argument_group("Run Options")
     run_options.add_argument("-n", "--nreps",
@@ -135,7 +251,33 @@ def main():
                 sys.exit("Model definition format cannot be diagnosed from extension. Need to specify '--model-format'.")
         interpolate_missing_model_values = False
 
+    try:
+        host_history_sample_selection = model.HostHistorySampleSelection(
+                burnin=args.burnin,
+                thinning=args.thinning,
+                sample_indexes=args.host_history_indexes,
+                num_random_samples=args.host_history_random_subsample,
+                random_seed=args.host_history_random_subsample_seed)
+    except ValueError as e:
+        sys.exit(str(e))
+    try:
+        communityecology.compose_randomization_schedule(
+                num_randomization_replicates=args.num_randomization_replicates,
+                randomization_tolerance=args.randomization_tolerance,
+                max_randomization_replicates=args.max_randomization_replicates,
+                randomization_block_size=args.randomization_block_size)
+    except ValueError as e:
+        sys.exit(str(e))
+
     # rb_data = os.path.join(utility.TEST_DATA_PATH, "revbayes", "bg_large.events.txt")
+    summary_stats_config_d = {
+            "num_randomization_replicates": args.num_randomization_replicates,
+            "randomization_tolerance": args.randomization_tolerance,
+            "max_randomization_replicates": args.max_randomization_replicates,
+            "randomization_block_size": args.randomization_block_size,
+            "statistic_groups": args.summary_statistics,
+            }
+
     simulate.repeat_run(
             output_prefix=args.output_prefix,
             nreps=args.nreps,
@@ -148,6 +290,20 @@ def main():
             random_seed=args.random_seed,
             stderr_logging_level=args.stderr_logging_level,
             file_logging_level=args.file_logging_level,
+            host_history_sample_selection=host_history_sample_selection,
+            is_use_host_history_cache=not args.no_host_history_cache,
+            host_history_cache_dir=args.host_history_cache_dir,
+            summary_stats_config_d=summary_stats_config_d,
+            num_summary_stats_workers=args.summary_statistics_workers,
+            summary_stats_queue_size=args.summary_statistics_queue_size,
+            output_buffer_size=args.output_buffer_size,
+            output_buffer_time=args.output_buffer_time,
+            is_sync_output=args.sync_output,
+            output_compression=None if args.output_compression == "none" else args.output_compression,
+            summary_stats_format=args.summary_statistics_format,
+            is_index_trees=not args.no_trees_index,
+            is_resume=args.resume,
+            checkpoint_interval=args.checkpoint_interval,
             debug_mode=args.debug_mode)
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import random
+import argparse
+import collections
+import inphest
+from inphest import utility
+from inphest import communityecology
+from inphest import hostcache
+from inphest import summarize
+from inphest import pipeline
+from inphest import columnar
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="{} Summary Statistics Calculator".format(inphest.description())
+            )
+    source_options = parser.add_argument_group("Source Options")
+    source_options.add_argument("trees_files",
+            nargs="+",
+            metavar="TREES-FILE",
+            help="Path to trees file(s) produced by the simulator (which may be compressed by gzip, bz2 or xz).")
+    host_options = parser.add_argument_group("Host Biogeography Options")
+    host_options.add_argument("-H", "--host-biogeographic-history",
+            metavar="HOST-EVENT-FILE",
+            default=None,
+            help="Path to file providing the host biogeographic events on which the trees were simulated.")
+    host_options.add_argument("-F", "--host-biogeographic-history-format",
+            choices=["revbayes", "archipelago"],
+            default="revbayes",
+            help="Format of the host biogeographic history.")
+    host_options.add_argument("--host-history-cache-dir",
+            metavar="DIRECTORY",
+            default=None,
+            help="Directory in which to store compiled host histories and host reference structures (default: same directory as host biogeographic history file).")
+    host_options.add_argument("--no-host-history-cache",
+            action="store_true",
+            default=False,
+            help="Do not read or write compiled host histories or host reference structures: always parse the host biogeographic history, and compute the host trees and profiles against which the symbiont trees are compared, from scratch.")
+
+    summary_stats_options = parser.add_argument_group("Summary Statistics Options")
+    summary_stats_options.add_argument("--summary-statistics",
+            nargs="+",
+            default=None,
+            choices=list(summarize.SummaryStatsCalculator.STATISTIC_GROUPS),
+            metavar="GROUP",
+            help="Groups of summary statistics to calculate: one or more of {} (default: {}).".format(
+                ", ".join("'{}'".format(g) for g in summarize.SummaryStatsCalculator.STATISTIC_GROUPS),
+                ", ".join("'{}'".format(g) for g in summarize.SummaryStatsCalculator.DEFAULT_STATISTIC_GROUPS)))
+    summary_stats_options.add_argument("--num-randomization-replicates",
+            type=int,
+            default=100,
+            metavar="N",
+            help="Number of randomization replicates used to calculate standardized effect sizes (or, with '--randomization-tolerance', the number drawn at a time unless '--randomization-block-size' is given; default: %(default)s).")
+    summary_stats_options.add_argument("--randomization-tolerance",
+            type=float,
+            default=None,
+            metavar="TOL",
+            help="Draw randomization replicates adaptively, in blocks, until the standardized effect size z-score and p-value estimates change by no more than TOL.")
+    summary_stats_options.add_argument("--max-randomization-replicates",
+            type=int,
+            default=None,
+            metavar="N",
+            help="Maximum number of randomization replicates drawn with '--randomization-tolerance' (default: 10 times the number of randomization replicates).")
+    summary_stats_options.add_argument("--randomization-block-size",
+            type=int,
+            default=None,
+            metavar="N",
+            help="Number of randomization replicates drawn at a time with '--randomization-tolerance'.")
+
+    output_options = parser.add_argument_group("Output Options")
+    output_options.add_argument('-o', '--output-prefix',
+        action='store',
+        dest='output_prefix',
+        type=str,
+        default=None,
+        metavar='OUTPUT-FILE-PREFIX',
+        help="Prefix for output files (default: path of first trees file, without the '.trees' extension and any compression extension, with '.resummarized' appended).")
+    output_options.add_argument("--summary-statistics-format",
+            choices=["csv", "columns"],
+            default="csv",
+            help="Write the summary statistics as a CSV file ('csv'), or as a binary columnar store ('columns': a directory of NumPy array files, one per statistic, which can be loaded selectively and memory-mapped, with a JSON header; default: %(default)s).")
+    output_options.add_argument("--output-compression",
+            choices=["none"] + list(utility.COMPRESSION_EXTENSIONS),
+            default="none",
+            help="Compress the output files as they are written, appending the corresponding extension ('.gz', '.bz2' or '.xz') to their paths (default: %(default)s).")
+    output_options.add_argument("--store-failed-trees",
+            action="store_true",
+            default=False,
+            help="Write trees for which summary statistics could not be calculated to a separate file.")
+
+    run_options = parser.add_argument_group("Run Options")
+    run_options.add_argument("-j", "--num-processes",
+            type=int,
+            default=1,
+            metavar="N",
+            help="Number of worker processes calculating summary statistics (default: %(default)s).")
+    run_options.add_argument("--queue-size",
+            type=int,
+            default=None,
+            metavar="N",
+            help="Maximum number of trees read ahead of the worker processes (default: twice the number of worker processes).")
+    run_options.add_argument("-z", "--random-seed",
+            default=None,
+            help="Seed for the randomizations of the standardized effect sizes: each tree is given its own seed, derived from this and its position, so that the results do not depend on the number of worker processes (default: random).")
+    run_options.add_argument("--stderr-logging-level",
+            default="info",
+            help="Message level threshold for screen logs.")
+
+    args = parser.parse_args()
+    if args.host_biogeographic_history is None:
+        sys.exit("Require path to host biogeographic history events to be specified.")
+    if args.num_processes < 1:
+        sys.exit("Require at least one worker process.")
+    try:
+        communityecology.compose_randomization_schedule(
+                num_randomization_replicates=args.num_randomization_replicates,
+                randomization_tolerance=args.randomization_tolerance,
+                max_randomization_replicates=args.max_randomization_replicates,
+                randomization_block_size=args.randomization_block_size)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    run_logger = utility.RunLogger(
+            name="inphest-summarize",
+            stderr_logging_level=args.stderr_logging_level,
+            log_to_file=False,
+            )
+    run_logger.info("-inphest- Starting: {}".format(inphest.description()))
+    if args.random_seed is None:
+        random_seed = random.randint(0, sys.maxsize)
+    else:
+        random_seed = args.random_seed
+    run_logger.info("-inphest- Initializing with random seed: {}".format(random_seed))
+
+    host_history_samples_path = os.path.normpath(args.host_biogeographic_history)
+    hrs = hostcache.load_host_history_samples(
+            source_path=host_history_samples_path,
+            schema=args.host_biogeographic_history_format,
+            is_use_cache=not args.no_host_history_cache,
+            cache_dir=args.host_history_cache_dir,
+            run_logger=run_logger,
+            )
+    host_histories_by_sample_idx = {}
+    for host_history_idx, host_history in enumerate(hrs.host_histories):
+        if host_history.sample_idx is None:
+            host_histories_by_sample_idx[host_history_idx] = host_history
+        else:
+            host_histories_by_sample_idx[host_history.sample_idx] = host_history
+    run_logger.info("-inphest- {} host biogeographical regime samples found in source".format(len(hrs.host_histories)))
+    if args.summary_statistics is None:
+        summary_statistic_groups = summarize.SummaryStatsCalculator.DEFAULT_STATISTIC_GROUPS
+    else:
+        summary_statistic_groups = summarize.SummaryStatsCalculator.validate_statistic_groups(args.summary_statistics)
+    if args.no_host_history_cache:
+        host_reference_cache_filepath = None
+    else:
+        host_reference_cache_filepath = hostcache.compose_host_reference_cache_filepath(
+                source_path=host_history_samples_path,
+                schema=args.host_biogeographic_history_format,
+                cache_dir=args.host_history_cache_dir)
+    host_references = hostcache.load_host_references(
+            host_histories=hrs.host_histories,
+            statistic_groups=summary_statistic_groups,
+            cache_filepath=host_reference_cache_filepath,
+            run_logger=run_logger)
+
+    if args.output_prefix is None:
+        output_prefix = args.trees_files[0]
+        compression = utility.diagnose_compression(output_prefix)
+        if compression is not None:
+            output_prefix = output_prefix[:-len(utility.COMPRESSION_EXTENSIONS[compression])]
+        if output_prefix.endswith(".trees"):
+            output_prefix = output_prefix[:-len(".trees")]
+        output_prefix = output_prefix + ".resummarized"
+    else:
+        output_prefix = args.output_prefix
+    output_compression = None if args.output_compression == "none" else args.output_compression
+    if args.summary_statistics_format == "columns":
+        summary_stats_file = columnar.SummaryStatsColumnWriter(output_prefix + "." + columnar.SUMMARY_STATS_COLUMNS_EXTENSION)
+    else:
+        summary_stats_file = utility.open_output_file(utility.compose_compressed_filepath(output_prefix + ".summary-stats.csv", output_compression))
+    run_logger.info("-inphest- Summary statistics filepath: {}".format(summary_stats_file.name))
+    if args.store_failed_trees:
+        failed_trees_file = utility.open_output_file(utility.compose_compressed_filepath(output_prefix + ".failed.trees", output_compression))
+        run_logger.info("-inphest- Failed trees filepath: {}".format(failed_trees_file.name))
+    else:
+        failed_trees_file = None
+
+    summary_stats_config_d = {
+            "num_randomization_replicates": args.num_randomization_replicates,
+            "randomization_tolerance": args.randomization_tolerance,
+            "max_randomization_replicates": args.max_randomization_replicates,
+            "randomization_block_size": args.randomization_block_size,
+            "statistic_groups": args.summary_statistics,
+            }
+    summary_stats_pipeline = pipeline.SummaryStatsPipeline(
+            host_histories=hrs.host_histories,
+            num_workers=args.num_processes,
+            trees_file=None,
+            summary_stats_file=summary_stats_file,
+            failed_trees_file=failed_trees_file,
+            max_queue_size=args.queue_size,
+            summary_stats_config_d=summary_stats_config_d,
+            host_references=host_references)
+
+    counts = collections.Counter()
+    def log_outcomes(outcomes):
+        completed_task_keys, failures = outcomes
+        counts["completed"] += len(completed_task_keys)
+        for task_key, e in failures:
+            counts["failed"] += 1
+            run_logger.info("-inphest- {}: Summary statistics calculation failure: {}".format(task_key, e))
+
+    for trees_file_idx, trees_filepath in enumerate(args.trees_files):
+        run_logger.info("-inphest- Summarizing trees in: {}".format(trees_filepath))
+        with utility.open_input_file(trees_filepath) as src:
+            for tree_idx, tree_str in enumerate(summarize.EncodedSymbiontPhylogenySample.iterate_tree_strings(src)):
+                task_key = "{}: tree {}".format(trees_filepath, tree_idx+1)
+                sample = summarize.EncodedSymbiontPhylogenySample(tree_str)
+                if "host_history_sample_idx" in sample.metadata:
+                    host_history = host_histories_by_sample_idx.get(int(sample.metadata["host_history_sample_idx"]), None)
+                    if host_history is None:
+                        sys.exit("{}: host history sample {} not found in '{}'".format(task_key, sample.metadata["host_history_sample_idx"], host_history_samples_path))
+                elif len(hrs.host_histories) == 1:
+                    host_history = hrs.host_histories[0]
+                else:
+                    sys.exit("{}: host history sample not identified on tree, and more than one host history sample in '{}'".format(task_key, host_history_samples_path))
+                summary_stats_pipeline.submit(
+                        task_key=task_key,
+                        host_history=host_history,
+                        symbiont_phylogeny_sample=sample,
+                        statistic_groups=None,
+                        model_id=sample.metadata.get("model_id", "NA"),
+                        tree_str=tree_str,
+                        random_seed=random.Random("{}.{}.{}".format(random_seed, trees_file_idx, tree_idx)).randint(0, sys.maxsize))
+                log_outcomes(summary_stats_pipeline.collect(timeout=0))
+    log_outcomes(summary_stats_pipeline.close())
+    summary_stats_file.close()
+    if failed_trees_file is not None:
+        failed_trees_file.close()
+    for description in summarize.SummaryStatsCalculator.statistic_group_cost_report(summary_stats_pipeline.statistic_group_costs):
+        run_logger.info("-inphest- Summary statistic group {}".format(description))
+    run_logger.info("-inphest- {} trees summarized, {} failed".format(counts["completed"], counts["failed"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Checkpoints of the state of a simulation in progress, from which it can be
+restored to continue exactly as it would have without interruption.
+
+A checkpoint is a (compressed) NumPy archive (``<output prefix>.checkpoint.npz``)
+of arrays:
+
+    - ``header`` : a JSON string giving the format and version, and
+      identifying the simulation (replicate and host history indexes, host
+      history sample index, random seed and model identifier) and host system
+      (numbers of areas, host lineages and host events) it was taken from.
+    - the state of the random number generator and the elapsed time.
+    - the position in the host events: the number of events taken off the
+      queue, and whether the last one is still pending.
+    - for each host lineage (in the order of the host system): its extancy
+      and whether it has gained an area, and its current areas.
+    - for each area: its host and symbiont lineages.
+    - the symbiont phylogeny: the index, parent, edge length and extancy of
+      each node (in preorder), the next lineage index, the current lineages,
+      and, for each current lineage, its host and area associations.
+
+Collections that the simulation iterates over are stored in their order of
+iteration (see |utility.OrderedSet|), as this determines the order in which
+events are scheduled and hence the random numbers drawn. Variable-length
+lists are stored as flat arrays of values with an array of the length of
+each list.
+
+Checkpoints are written to a temporary file which then (atomically) replaces
+the previous checkpoint, so that an interruption while writing leaves the
+previous checkpoint intact.
+"""
+
+import os
+import json
+import collections
+import numpy
+
+from inphest import utility
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_FORMAT = "inphest-checkpoint"
+CHECKPOINT_EXTENSION = "checkpoint.npz"
+_EXTANCY_CODES = {"pre": 0, "current": 1, "post": 2}
+_EXTANCY_STATES = dict((code, extancy) for extancy, code in _EXTANCY_CODES.items())
+
+def compose_checkpoint_filepath(output_prefix):
+    return output_prefix + "." + CHECKPOINT_EXTENSION
+
+def _pack_lists(lists, dtype="<i8"):
+    values = []
+    lengths = []
+    for values_list in lists:
+        values.extend(values_list)
+        lengths.append(len(values_list))
+    return numpy.array(values, dtype=dtype), numpy.array(lengths, dtype="<i8")
+
+def _unpack_lists(values, lengths):
+    lists = []
+    start = 0
+    for length in lengths.tolist():
+        lists.append(values[start:start+length])
+        start += length
+    return lists
+
+def _compose_header(simulator):
+    host_system = simulator.host_system
+    header = collections.OrderedDict()
+    header["format"] = CHECKPOINT_FORMAT
+    header["version"] = CHECKPOINT_VERSION
+    header["replicate_idx"] = simulator.replicate_idx
+    header["host_history_idx"] = simulator.host_history_idx
+    header["host_history_sample_idx"] = simulator.host_history.sample_idx
+    header["random_seed"] = simulator.random_seed
+    header["model_id"] = simulator.model.model_id
+    header["num_areas"] = len(host_system.areas)
+    header["num_host_lineages"] = len(host_system.host_lineages)
+    header["num_host_events"] = len(host_system.host_history.events)
+    return header
+
+def read_checkpoint_header(filepath):
+    """
+    Returns the header (see module documentation) of the checkpoint at
+    ``filepath``.
+    """
+    with numpy.load(filepath) as arrays:
+        header = json.loads(str(arrays["header"]))
+    if header.get("format") != CHECKPOINT_FORMAT or header.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("Not a checkpoint (or unsupported version): '{}'".format(filepath))
+    return header
+
+def write_checkpoint(simulator, filepath):
+    """
+    Writes the state of ``simulator`` (an |simulate.InphestSimulator| between
+    events) to a checkpoint at ``filepath``.
+    """
+    host_system = simulator.host_system
+    phylogeny = simulator.phylogeny
+    host_lineage_positions = dict((host_lineage, idx) for idx, host_lineage in enumerate(host_system.host_lineages))
+    arrays = collections.OrderedDict()
+    arrays["header"] = numpy.array(json.dumps(_compose_header(simulator)))
+
+    rng_version, rng_internal_state, rng_gauss_next = simulator.rng.getstate()
+    arrays["rng_version"] = numpy.array(rng_version, dtype="<i8")
+    arrays["rng_internal_state"] = numpy.array(rng_internal_state, dtype="<u8")
+    arrays["rng_gauss_next"] = numpy.array([] if rng_gauss_next is None else [rng_gauss_next], dtype="<f8")
+    arrays["elapsed_time"] = numpy.array(simulator.elapsed_time, dtype="<f8")
+
+    arrays["num_host_events_taken"] = numpy.array(len(host_system.host_history.events) - len(host_system.host_events), dtype="<i8")
+    arrays["is_host_event_pending"] = numpy.array(simulator.next_host_event is not None)
+
+    arrays["host_lineage_ids"] = numpy.array([host_lineage.lineage_id for host_lineage in host_system.host_lineages], dtype="<i8")
+    arrays["host_lineage_extancies"] = numpy.array([_EXTANCY_CODES[host_lineage.extancy] for host_lineage in host_system.host_lineages], dtype="<i1")
+    arrays["host_lineage_post_area_gains"] = numpy.array([int(getattr(host_lineage, "is_post_area_gain", -1)) for host_lineage in host_system.host_lineages], dtype="<i1")
+    arrays["host_lineage_areas"], arrays["host_lineage_areas_lengths"] = _pack_lists(
+            [[area.area_idx for area in host_lineage.current_area_iter()] for host_lineage in host_system.host_lineages])
+    arrays["area_host_lineages"], arrays["area_host_lineages_lengths"] = _pack_lists(
+            [[host_lineage_positions[host_lineage] for host_lineage in area.host_lineages] for area in host_system.areas])
+    # lineages that went extinct are left associated with their areas, but
+    # are no longer on the phylogeny (nor looked up)
+    arrays["area_symbiont_lineages"], arrays["area_symbiont_lineages_lengths"] = _pack_lists(
+            [[lineage.index for lineage in area.symbiont_lineages if lineage.is_extant] for area in host_system.areas])
+
+    nodes = list(phylogeny.preorder_node_iter())
+    node_positions = dict((id(node), idx) for idx, node in enumerate(nodes))
+    arrays["node_indexes"] = numpy.array([node.index for node in nodes], dtype="<i8")
+    arrays["node_parents"] = numpy.array([-1 if node.parent_node is None else node_positions[id(node.parent_node)] for node in nodes], dtype="<i8")
+    arrays["node_edge_lengths"] = numpy.array([numpy.nan if node.edge.length is None else node.edge.length for node in nodes], dtype="<f8")
+    arrays["node_extancies"] = numpy.array([node.is_extant for node in nodes], dtype=bool)
+    arrays["next_lineage_index"] = numpy.array(phylogeny.lineage_indexer.index, dtype="<i8")
+    arrays["current_lineages"] = numpy.array([lineage.index for lineage in phylogeny.current_lineage_iter()], dtype="<i8")
+    current_lineages = list(phylogeny.current_lineage_iter())
+    arrays["lineage_hosts"], arrays["lineage_hosts_lengths"] = _pack_lists(
+            [[host_lineage_positions[host_lineage] for host_lineage in lineage.host_iter()] for lineage in current_lineages])
+    arrays["lineage_areas"], arrays["lineage_areas_lengths"] = _pack_lists(
+            [[area.area_idx for area in lineage.area_iter()] for lineage in current_lineages])
+    occurrences = []
+    for lineage in current_lineages:
+        lineage_occurrences = []
+        for host_lineage, host_area_distribution in lineage._host_area_distribution.items():
+            for area, presence in host_area_distribution.items():
+                if presence:
+                    lineage_occurrences.append(host_lineage_positions[host_lineage] * len(host_system.areas) + area.area_idx)
+        occurrences.append(lineage_occurrences)
+    arrays["lineage_occurrences"], arrays["lineage_occurrences_lengths"] = _pack_lists(occurrences)
+
+    temp_filepath = filepath + ".tmp.npz"
+    numpy.savez_compressed(temp_filepath, **arrays)
+    os.replace(temp_filepath, filepath)
+
+def restore_checkpoint(simulator, filepath):
+    """
+    Restores the state of ``simulator`` (a newly-created
+    |simulate.InphestSimulator|, set up with the same model, host history
+    and random seed, that has not yet been run) from the checkpoint at
+    ``filepath``.
+    """
+    header = read_checkpoint_header(filepath)
+    expected_header = _compose_header(simulator)
+    mismatched = [key for key in expected_header if header.get(key) != expected_header[key]]
+    if mismatched:
+        raise ValueError("Checkpoint '{}' was not taken from this simulation: {}".format(
+            filepath,
+            ", ".join("{} ({} != {})".format(key, header.get(key), expected_header[key]) for key in mismatched)))
+    host_system = simulator.host_system
+    phylogeny = simulator.phylogeny
+    host_lineages = list(host_system.host_lineages)
+    with numpy.load(filepath) as arrays:
+        arrays = dict(arrays.items())
+    if arrays["host_lineage_ids"].tolist() != [host_lineage.lineage_id for host_lineage in host_lineages]:
+        raise ValueError("Checkpoint '{}' was not taken from this host system".format(filepath))
+
+    rng_gauss_next = arrays["rng_gauss_next"].tolist()
+    simulator.rng.setstate((
+        int(arrays["rng_version"]),
+        tuple(arrays["rng_internal_state"].tolist()),
+        rng_gauss_next[0] if rng_gauss_next else None))
+    simulator.elapsed_time = float(arrays["elapsed_time"])
+
+    for idx in range(int(arrays["num_host_events_taken"])):
+        host_event = host_system.host_events.pop(0)
+        simulator.processed_host_events.add(host_event)
+    if bool(arrays["is_host_event_pending"]):
+        simulator.processed_host_events.remove(host_event)
+        simulator.next_host_event = host_event
+
+    area_lists = _unpack_lists(arrays["host_lineage_areas"].tolist(), arrays["host_lineage_areas_lengths"])
+    for host_lineage, extancy_code, post_area_gain, area_idxs in zip(
+            host_lineages,
+            arrays["host_lineage_extancies"].tolist(),
+            arrays["host_lineage_post_area_gains"].tolist(),
+            area_lists):
+        host_lineage.extancy = _EXTANCY_STATES[extancy_code]
+        if host_lineage.extancy == "pre":
+            continue
+        host_lineage.debug_mode = simulator.debug_mode
+        host_lineage.is_post_area_gain = bool(post_area_gain)
+        host_lineage._current_areas.update(host_system.areas[area_idx] for area_idx in area_idxs)
+        if simulator.debug_mode and host_lineage.extancy == "current":
+            host_lineage._current_distribution_check_bitlist = ["1" if host_lineage.has_area(area) else "0" for area in host_system.areas]
+        else:
+            host_lineage._current_distribution_check_bitlist = None
+        if host_lineage.extancy == "current":
+            simulator.activated_host_lineages.add(host_lineage)
+        else:
+            simulator.deactivated_host_lineages.add(host_lineage)
+    for area, host_lineage_positions in zip(host_system.areas, _unpack_lists(arrays["area_host_lineages"].tolist(), arrays["area_host_lineages_lengths"])):
+        area.host_lineages.update(host_lineages[position] for position in host_lineage_positions)
+
+    nodes = []
+    for node_index, parent_position, edge_length, is_extant in zip(
+            arrays["node_indexes"].tolist(),
+            arrays["node_parents"].tolist(),
+            arrays["node_edge_lengths"].tolist(),
+            arrays["node_extancies"].tolist()):
+        node = phylogeny.node_factory(index=node_index, host_system=host_system)
+        node.edge.length = None if numpy.isnan(edge_length) else edge_length
+        node.is_extant = is_extant
+        if parent_position >= 0:
+            nodes[parent_position].add_child(node)
+        nodes.append(node)
+    phylogeny.seed_node = nodes[0]
+    phylogeny.lineage_indexer.index = int(arrays["next_lineage_index"])
+    lineages_by_index = dict((node.index, node) for node in nodes)
+    current_lineages = [lineages_by_index[lineage_index] for lineage_index in arrays["current_lineages"].tolist()]
+    phylogeny.current_lineages = utility.OrderedSet(current_lineages)
+    num_areas = len(host_system.areas)
+    for lineage, host_positions, area_idxs, occurrences in zip(
+            current_lineages,
+            _unpack_lists(arrays["lineage_hosts"].tolist(), arrays["lineage_hosts_lengths"]),
+            _unpack_lists(arrays["lineage_areas"].tolist(), arrays["lineage_areas_lengths"]),
+            _unpack_lists(arrays["lineage_occurrences"].tolist(), arrays["lineage_occurrences_lengths"])):
+        for occurrence in occurrences:
+            host_position, area_idx = divmod(occurrence, num_areas)
+            lineage._host_area_distribution[host_lineages[host_position]][host_system.areas[area_idx]] = 1
+        lineage._infected_hosts.update(host_lineages[position] for position in host_positions)
+        lineage._infected_areas.update(host_system.areas[area_idx] for area_idx in area_idxs)
+    for area, lineage_indexes in zip(host_system.areas, _unpack_lists(arrays["area_symbiont_lineages"].tolist(), arrays["area_symbiont_lineages_lengths"])):
+        area.symbiont_lineages.update(lineages_by_index[lineage_index] for lineage_index in lineage_indexes)
@@ -0,0 +1,457 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Binary columnar storage of summary statistics, and random-access indexes of
+trees files.
+
+A summary statistics store is a directory holding:
+
+    - ``header.json`` : format and version, the number of rows, and, in
+      order, the name and file of each column, as well as the model
+      identifiers indexed by the 'model.id' column.
+    - ``c<idx>.npy`` : one NumPy array file per column, with the model
+      identifier of each row as an index into the model identifiers in the
+      header ('<i4'), and each summary statistic as a double precision float
+      ('<f8'; with `None` stored as NaN and booleans as 0 or 1).
+
+Rows are appended in batches: the data of each batch are appended to the
+column files, whose array headers are then updated in place, and finally the
+header is (atomically) replaced, so that a store interrupted while writing
+only ever exposes complete rows (any data beyond the number of rows given in
+the header are ignored). The column files can be loaded individually and
+memory-mapped (see :func:`load_summary_stats`), so that a subset of the
+statistics can be analyzed without reading (or parsing) the rest.
+
+A trees index is a NumPy array file alongside a trees file (at the path of
+the trees file with ``.index.npy`` appended), with one record for each tree
+in the trees file, in order, giving the byte offset and length of the tree
+statement in the (uncompressed) trees file, and the replicate index, host
+history index, host history sample index and random seed (-1 where unknown)
+of the simulation that produced it. It is written by
+:class:`TreesIndexWriter` together with the trees file, so that it only ever
+covers complete trees, and read by :func:`load_trees_index` and
+:func:`read_indexed_tree_strings`.
+"""
+
+import os
+import mmap
+import json
+import collections
+import numpy
+
+from inphest import utility
+
+SUMMARY_STATS_COLUMNS_VERSION = 1
+SUMMARY_STATS_COLUMNS_FORMAT = "inphest-summary-stats-columns"
+SUMMARY_STATS_COLUMNS_EXTENSION = "summary-stats.columns"
+MODEL_ID_COLUMN = "model.id"
+_MODEL_ID_DTYPE = numpy.dtype("<i4")
+_STATISTIC_DTYPE = numpy.dtype("<f8")
+TREES_INDEX_EXTENSION = "index.npy"
+TREES_INDEX_DTYPE = numpy.dtype([
+    ("offset", "<i8"),
+    ("length", "<i8"),
+    ("replicate_idx", "<i4"),
+    ("host_history_idx", "<i4"),
+    ("host_history_sample_idx", "<i4"),
+    ("random_seed", "<i8"),
+    ])
+
+def _read_header(path):
+    with open(os.path.join(path, "header.json"), "r") as src:
+        header = json.load(src)
+    if (header.get("format") != SUMMARY_STATS_COLUMNS_FORMAT
+            or header.get("version") != SUMMARY_STATS_COLUMNS_VERSION):
+        raise ValueError("Not a summary statistics store (or unsupported version): '{}'".format(path))
+    return header
+
+class AppendableArrayFile(object):
+    """
+    A one-dimensional NumPy array file (``.npy``) at ``path``, created empty
+    (replacing any existing file), to which values (of ``dtype``) are
+    appended: the data are written after the existing ones and the array
+    header is then updated in place (its size not depending on the number of
+    values, for any practical number), so that the file can be loaded (and
+    memory-mapped) by ``numpy.load`` at any time. Data beyond the number of
+    values given in the array header (left by an interrupted append) are
+    overwritten by the next append.
+
+    If ``num_values`` is given, the existing file at ``path`` is instead
+    reopened, truncated to its first ``num_values`` values, to be appended
+    to.
+    """
+
+    def __init__(self, path, dtype, num_values=None):
+        self.path = path
+        self.dtype = numpy.dtype(dtype)
+        if num_values is None:
+            self.num_values = 0
+            with open(self.path, "wb") as dest:
+                self._write_array_header(dest, 0)
+                self._array_header_size = dest.tell()
+            return
+        with open(self.path, "rb") as src:
+            numpy.lib.format.read_magic(src)
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(src)
+            self._array_header_size = src.tell()
+        if dtype != self.dtype or len(shape) != 1 or shape[0] < num_values:
+            raise ValueError("Cannot reopen array file with {} values of type '{}': '{}'".format(num_values, self.dtype, path))
+        self.num_values = shape[0]
+        self.truncate(num_values)
+
+    def append(self, values):
+        values = numpy.asarray(values, dtype=self.dtype)
+        num_values = self.num_values + len(values)
+        with open(self.path, "r+b") as dest:
+            dest.seek(self._array_header_size + self.num_values * self.dtype.itemsize)
+            dest.write(values.tobytes())
+            dest.truncate()
+            self._write_array_header(dest, num_values)
+            if dest.tell() != self._array_header_size:
+                raise ValueError("Number of values exceeds capacity of array header: {}".format(num_values))
+        self.num_values = num_values
+
+    def truncate(self, num_values):
+        """
+        Truncates the file to its first ``num_values`` values (also removing
+        any data beyond the values given in the array header).
+        """
+        if num_values > self.num_values:
+            raise ValueError("Cannot truncate array file with {} values to {} values: '{}'".format(self.num_values, num_values, self.path))
+        with open(self.path, "r+b") as dest:
+            dest.truncate(self._array_header_size + num_values * self.dtype.itemsize)
+            self._write_array_header(dest, num_values)
+        self.num_values = num_values
+
+    def sync(self):
+        """
+        Synchronizes the file to disk (see ``os.fsync``).
+        """
+        with open(self.path, "rb") as src:
+            os.fsync(src.fileno())
+
+    def _write_array_header(self, dest, num_values):
+        dest.seek(0)
+        numpy.lib.format.write_array_header_1_0(dest, {
+            "descr": numpy.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": (num_values,),
+            })
+
+class SummaryStatsColumnWriter(object):
+    """
+    Writes summary statistics to a new store at ``path`` (see module
+    documentation), replacing any existing store, as rows of the model
+    identifier and the (ordered) dictionary of summary statistics calculated
+    for a simulated symbiont phylogeny.
+
+    Rows are written as batches by :meth:`write_batch`, so that it can be
+    used as a destination of |utility.BufferedOutputSink|, with each row
+    written to the sink as a single ``(model_id, summary_stats)`` item.
+
+    If ``num_rows`` is given, the existing store at ``path`` is instead
+    reopened, truncated to its first ``num_rows`` rows, to be appended to.
+    """
+
+    # destinations of |utility.BufferedOutputSink| given the buffered items
+    # as a list rather than joined as text
+    is_batch_destination = True
+
+    def __init__(self, path, num_rows=None):
+        self.name = path
+        self.num_rows = 0
+        self.columns = None
+        self.model_ids = []
+        self._model_id_indexes = {}
+        self._column_files = None
+        if num_rows is not None:
+            header = _read_header(path)
+            if header["num_rows"] < num_rows:
+                raise ValueError("Summary statistics store has fewer than {} rows: '{}'".format(num_rows, path))
+            self.num_rows = num_rows
+            self.model_ids = header["model_ids"]
+            self._model_id_indexes = dict((model_id, idx) for idx, model_id in enumerate(self.model_ids))
+            if header["columns"]:
+                self.columns = [column["name"] for column in header["columns"]]
+                self._column_files = [AppendableArrayFile(self._column_filepath(column_idx), self._column_dtype(column_idx), num_values=num_rows)
+                        for column_idx in range(len(self.columns))]
+            self._write_header()
+            return
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for filename in os.listdir(path):
+            if filename == "header.json" or (filename.startswith("c") and filename.endswith(".npy")):
+                os.remove(os.path.join(path, filename))
+        self._write_header()
+
+    def write_batch(self, rows):
+        """
+        Appends ``rows``, a list of tuples of model identifier and summary
+        statistics (with the same statistics, in the same order, in each
+        row).
+        """
+        if not rows:
+            return
+        if self.columns is None:
+            self.columns = [MODEL_ID_COLUMN] + list(rows[0][1].keys())
+            self._column_files = [AppendableArrayFile(self._column_filepath(column_idx), self._column_dtype(column_idx))
+                    for column_idx in range(len(self.columns))]
+        statistic_names = self.columns[1:]
+        model_id_codes = numpy.empty(len(rows), dtype=_MODEL_ID_DTYPE)
+        values = numpy.empty((len(statistic_names), len(rows)), dtype=_STATISTIC_DTYPE)
+        for row_idx, (model_id, summary_stats) in enumerate(rows):
+            if len(summary_stats) != len(statistic_names):
+                raise ValueError("Summary statistics do not match columns of store: {}".format(list(summary_stats.keys())))
+            try:
+                model_id_codes[row_idx] = self._model_id_indexes[model_id]
+            except KeyError:
+                model_id_codes[row_idx] = self._model_id_indexes[model_id] = len(self.model_ids)
+                self.model_ids.append(model_id)
+            for statistic_idx, statistic_name in enumerate(statistic_names):
+                try:
+                    value = summary_stats[statistic_name]
+                except KeyError:
+                    raise ValueError("Summary statistic not in columns of store: '{}'".format(statistic_name))
+                values[statistic_idx, row_idx] = numpy.nan if value is None else value
+        # data beyond the rows recorded in the header (left by an interrupted
+        # write) are ignored when loading and overwritten here
+        self._column_files[0].append(model_id_codes)
+        for column_file, column_values in zip(self._column_files[1:], values):
+            column_file.append(column_values)
+        self.num_rows += len(rows)
+        self._write_header()
+
+    @property
+    def num_records(self):
+        return self.num_rows
+
+    def truncate(self, num_rows):
+        """
+        Truncates the store to its first ``num_rows`` rows (e.g., to undo a
+        batch of rows that could not be written out to all the files of a
+        run; see |utility.BufferedOutputSink|).
+        """
+        if num_rows > self.num_rows:
+            raise ValueError("Cannot truncate summary statistics store with {} rows to {} rows: '{}'".format(self.num_rows, num_rows, self.name))
+        if self._column_files is not None:
+            for column_file in self._column_files:
+                column_file.truncate(num_rows)
+        self.num_rows = num_rows
+        self._write_header()
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        """
+        Synchronizes the column files and the header to disk (see
+        ``os.fsync``).
+        """
+        if self._column_files is not None:
+            for column_file in self._column_files:
+                column_file.sync()
+        with open(os.path.join(self.name, "header.json"), "rb") as src:
+            os.fsync(src.fileno())
+
+    def close(self):
+        pass
+
+    def _column_filepath(self, column_idx):
+        return os.path.join(self.name, "c{:04d}.npy".format(column_idx))
+
+    def _column_dtype(self, column_idx):
+        return _MODEL_ID_DTYPE if column_idx == 0 else _STATISTIC_DTYPE
+
+    def _write_header(self):
+        header = {
+            "format": SUMMARY_STATS_COLUMNS_FORMAT,
+            "version": SUMMARY_STATS_COLUMNS_VERSION,
+            "num_rows": self.num_rows,
+            "columns": [],
+            "model_ids": self.model_ids,
+            }
+        if self.columns is not None:
+            for column_idx, column_name in enumerate(self.columns):
+                header["columns"].append({
+                    "name": column_name,
+                    "file": os.path.basename(self._column_filepath(column_idx)),
+                    "dtype": numpy.lib.format.dtype_to_descr(self._column_dtype(column_idx)),
+                    })
+        header_path = os.path.join(self.name, "header.json")
+        with open(header_path + ".tmp", "w") as dest:
+            json.dump(header, dest)
+        os.replace(header_path + ".tmp", header_path)
+
+def read_summary_stats_columns(path):
+    """
+    Returns the names of the columns of the summary statistics store at
+    ``path``, in order.
+    """
+    return [column["name"] for column in _read_header(path)["columns"]]
+
+def load_summary_stats(path, columns=None, is_memory_mapped=True):
+    """
+    Returns an ordered dictionary of the columns (all, or those named in
+    ``columns``) of the summary statistics store at ``path``, each as a NumPy
+    array (memory-mapped, unless ``is_memory_mapped`` is `False`), with only
+    the files of the requested columns read. The 'model.id' column, if
+    requested, is returned as an array of the model identifiers themselves.
+    """
+    header = _read_header(path)
+    column_entries = collections.OrderedDict((column["name"], column) for column in header["columns"])
+    if columns is None:
+        columns = list(column_entries.keys())
+    data = collections.OrderedDict()
+    for column_name in columns:
+        try:
+            column_entry = column_entries[column_name]
+        except KeyError:
+            raise KeyError("Column not in summary statistics store '{}': '{}'".format(path, column_name))
+        values = numpy.load(
+                os.path.join(path, column_entry["file"]),
+                mmap_mode="r" if is_memory_mapped else None)[:header["num_rows"]]
+        if column_name == MODEL_ID_COLUMN:
+            values = numpy.array(header["model_ids"], dtype=object)[values]
+        data[column_name] = values
+    return data
+
+def compose_trees_index_filepath(trees_filepath):
+    return trees_filepath + "." + TREES_INDEX_EXTENSION
+
+class TreesIndexWriter(object):
+    """
+    Writes the index (see module documentation) of the trees file at
+    ``trees_filepath``, replacing any existing index, as the trees are
+    written to it (starting at byte ``offset``).
+
+    Entries are written as batches by :meth:`write_batch`, so that it can be
+    used as a destination of |utility.BufferedOutputSink|, with each tree
+    written to the sink in the same record as the tree itself, as a single
+    ``(tree_str, replicate_idx, host_history_idx, host_history_sample_idx,
+    random_seed)`` item (with `None` for values not known). As the sink
+    writes records to all their destinations in the order in which they
+    were first written to, the trees file should be written to first.
+
+    If ``num_records`` is given, the existing index is instead reopened,
+    truncated to its first ``num_records`` entries, to be appended to (with
+    ``offset`` then being the size of the trees file, as truncated to the
+    same trees).
+    """
+
+    is_batch_destination = True
+
+    def __init__(self, trees_filepath, offset=0, num_records=None):
+        self.name = compose_trees_index_filepath(trees_filepath)
+        self.offset = offset
+        self._index_file = AppendableArrayFile(self.name, TREES_INDEX_DTYPE, num_values=num_records)
+        self._num_initial_records = self._index_file.num_values
+        self._initial_offset = offset
+
+    def write_batch(self, entries):
+        """
+        Appends the index entries of ``entries``, a list of tuples of the tree
+        statement (as written to the trees file) and the replicate index, host
+        history index, host history sample index and random seed of the
+        simulation that produced it.
+        """
+        records = numpy.empty(len(entries), dtype=TREES_INDEX_DTYPE)
+        for entry_idx, (tree_str, replicate_idx, host_history_idx, host_history_sample_idx, random_seed) in enumerate(entries):
+            length = len(tree_str.encode("utf-8"))
+            records[entry_idx] = (
+                    self.offset,
+                    length,
+                    -1 if replicate_idx is None else replicate_idx,
+                    -1 if host_history_idx is None else host_history_idx,
+                    -1 if host_history_sample_idx is None else host_history_sample_idx,
+                    -1 if random_seed is None else random_seed,
+                    )
+            self.offset += length
+        self._index_file.append(records)
+
+    @property
+    def num_records(self):
+        return self._index_file.num_values
+
+    def truncate(self, num_records):
+        """
+        Truncates the index to its first ``num_records`` entries (e.g., to
+        undo a batch of entries that could not be written out to all the
+        files of a run; see |utility.BufferedOutputSink|), with the trees
+        file (to be truncated to the same trees) then ending at the end of
+        the last tree left in the index.
+        """
+        if num_records < self._num_initial_records:
+            raise ValueError("Cannot truncate trees index to fewer entries than it was opened with: {} < {}".format(num_records, self._num_initial_records))
+        self._index_file.truncate(num_records)
+        if num_records == self._num_initial_records:
+            self.offset = self._initial_offset
+        else:
+            record = numpy.load(self.name, mmap_mode="r")[num_records - 1]
+            self.offset = int(record["offset"] + record["length"])
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        """
+        Synchronizes the index file to disk (see ``os.fsync``).
+        """
+        self._index_file.sync()
+
+    def close(self):
+        pass
+
+def load_trees_index(trees_filepath, is_memory_mapped=True):
+    """
+    Returns the index of the trees file at ``trees_filepath`` as a NumPy
+    structured array (memory-mapped, unless ``is_memory_mapped`` is `False`)
+    with fields 'offset', 'length', 'replicate_idx', 'host_history_idx',
+    'host_history_sample_idx' and 'random_seed', and one record per tree.
+    """
+    trees_index = numpy.load(
+            compose_trees_index_filepath(trees_filepath),
+            mmap_mode="r" if is_memory_mapped else None)
+    if trees_index.dtype != TREES_INDEX_DTYPE:
+        raise ValueError("Not a trees index: '{}'".format(compose_trees_index_filepath(trees_filepath)))
+    return trees_index
+
+def read_indexed_tree_strings(trees_filepath, tree_idxs, trees_index=None):
+    """
+    Iterates over the tree statements with indexes ``tree_idxs`` (i.e.,
+    positions in the trees file, as in the trees index) in the trees file at
+    ``trees_filepath``, in the order given, reading each directly from its
+    offset as given by ``trees_index`` (loaded if not given). Uncompressed
+    trees files are memory-mapped; compressed ones are decompressed up to
+    each tree as needed.
+    """
+    if trees_index is None:
+        trees_index = load_trees_index(trees_filepath)
+    if utility.diagnose_compression(trees_filepath) is None:
+        with open(trees_filepath, "rb") as src:
+            if os.fstat(src.fileno()).st_size == 0:
+                data = b""
+            else:
+                data = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for tree_idx in tree_idxs:
+                    record = trees_index[tree_idx]
+                    yield data[record["offset"]:record["offset"] + record["length"]].decode("utf-8")
+            finally:
+                if data:
+                    data.close()
+    else:
+        with utility.open_input_file(trees_filepath, is_binary=True) as src:
+            for tree_idx in tree_idxs:
+                record = trees_index[tree_idx]
+                src.seek(record["offset"])
+                yield src.read(record["length"]).decode("utf-8")
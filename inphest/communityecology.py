@@ -0,0 +1,454 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Phylogenetic community ecology statistics (standardized effect sizes of the
+mean pairwise distance, MPD, and mean nearest taxon distance, MNTD) calculated
+on dense NumPy leaf-to-leaf distance matrices.
+
+The calculations reproduce those of the corresponding
+|dendropy.PhylogeneticDistanceMatrix| methods (including the "taxa.label" null
+model, i.e., shuffling of the leaf labels across the tree, with a single
+shuffle applied to all assemblages in each randomization replicate), but are
+carried out for all randomization replicates of an assemblage as batched array
+operations, and the same randomization replicates can be shared by all the
+statistics and edge weighting schemes.
+"""
+
+import collections
+import math
+import numpy
+
+from inphest import error
+
+StandardizedEffectSizeResult = collections.namedtuple("StandardizedEffectSizeResult",
+        ["obs", "null_model_mean", "null_model_sd", "z", "rank", "p",])
+
+# Upper limit on the number of elements in the (replicates x assemblage size x
+# assemblage size) blocks of distances gathered at a time.
+MAX_BATCH_SIZE = 1 << 22
+
+def get_numpy_rng(rng=None):
+    """
+    Returns a NumPy random number generator: ``rng`` itself if it is
+    already one, one seeded from ``rng`` if it is a |random.Random| instance,
+    one seeded with ``rng`` if it is an integer, or a freshly-seeded one if
+    ``rng`` is |None|.
+    """
+    if rng is None:
+        return numpy.random.default_rng()
+    if isinstance(rng, numpy.random.Generator):
+        return rng
+    if isinstance(rng, int):
+        return numpy.random.default_rng(rng)
+    return numpy.random.default_rng(rng.getrandbits(64))
+
+def compose_randomization_schedule(
+        num_randomization_replicates,
+        randomization_tolerance=None,
+        max_randomization_replicates=None,
+        randomization_block_size=None):
+    """
+    Returns the block size and the maximum number of randomization replicates
+    drawn by |LeafDistanceMatrix.standardized_effect_sizes()|, as a tuple,
+    after filling in defaults. Raises |ValueError| if the combination is
+    invalid, so that callers can check their settings before any
+    calculation starts.
+    """
+    if num_randomization_replicates is None or num_randomization_replicates < 2:
+        raise ValueError("Require at least 2 randomization replicates: {}".format(num_randomization_replicates))
+    if randomization_tolerance is None:
+        randomization_block_size = num_randomization_replicates
+        max_randomization_replicates = num_randomization_replicates
+    else:
+        if randomization_tolerance < 0:
+            raise ValueError("Randomization tolerance cannot be negative: {}".format(randomization_tolerance))
+        if randomization_block_size is None:
+            randomization_block_size = num_randomization_replicates
+        if max_randomization_replicates is None:
+            max_randomization_replicates = 10 * num_randomization_replicates
+    if randomization_block_size < 2 or max_randomization_replicates < randomization_block_size:
+        raise ValueError("Invalid randomization replicate block size ({}) or maximum ({})".format(randomization_block_size, max_randomization_replicates))
+    return randomization_block_size, max_randomization_replicates
+
+class LeafDistanceMatrix(object):
+    """
+    Weighted (edge length) and unweighted (edge count, or "steps") distances
+    between all pairs of leaves of a tree, as dense NumPy arrays, with leaves
+    identified by their index in ``leaves``.
+    """
+
+    @classmethod
+    def from_tree(cls, tree):
+        """
+        Creates a |LeafDistanceMatrix| for ``tree``, with leaves identified by
+        their nodes, in a single postorder pass over the tree. Edges without
+        lengths contribute zero length to the weighted distances.
+
+        Since the leaves are indexed in postorder, the leaves descending from
+        any node occupy a contiguous range of indexes, so the distances
+        between the leaves descending from each pair of children of a node
+        can be filled in as a block.
+        """
+        leaves = list(tree.leaf_node_iter())
+        num_leaves = len(leaves)
+        weighted_distances = numpy.zeros((num_leaves, num_leaves), dtype=numpy.float64)
+        step_distances = numpy.zeros((num_leaves, num_leaves), dtype=numpy.float64)
+        # distances from each leaf to the node currently being processed
+        weighted_depths = numpy.zeros(num_leaves, dtype=numpy.float64)
+        step_depths = numpy.zeros(num_leaves, dtype=numpy.float64)
+        leaf_ranges = {}
+        next_leaf_idx = 0
+        tree_length = 0.0
+        num_edges = 0
+        for nd in tree.postorder_node_iter():
+            if nd.edge.length is not None:
+                tree_length += nd.edge.length
+            num_edges += 1
+            if nd.is_leaf():
+                assert leaves[next_leaf_idx] is nd
+                leaf_ranges[nd] = (next_leaf_idx, next_leaf_idx + 1)
+                next_leaf_idx += 1
+                continue
+            child_ranges = []
+            for ch in nd.child_node_iter():
+                start, end = leaf_ranges.pop(ch)
+                if ch.edge.length is not None:
+                    weighted_depths[start:end] += ch.edge.length
+                step_depths[start:end] += 1
+                child_ranges.append((start, end))
+            for ch_idx, (start1, end1) in enumerate(child_ranges):
+                for start2, end2 in child_ranges[ch_idx+1:]:
+                    block = weighted_depths[start1:end1, None] + weighted_depths[None, start2:end2]
+                    weighted_distances[start1:end1, start2:end2] = block
+                    weighted_distances[start2:end2, start1:end1] = block.T
+                    block = step_depths[start1:end1, None] + step_depths[None, start2:end2]
+                    step_distances[start1:end1, start2:end2] = block
+                    step_distances[start2:end2, start1:end1] = block.T
+            assert child_ranges[-1][1] - child_ranges[0][0] == sum(end - start for start, end in child_ranges)
+            leaf_ranges[nd] = (child_ranges[0][0], child_ranges[-1][1])
+        return cls(
+                leaves=leaves,
+                weighted_distances=weighted_distances,
+                step_distances=step_distances,
+                tree_length=tree_length,
+                num_edges=num_edges)
+
+    @classmethod
+    def from_phylogenetic_distance_matrix(cls, phylogenetic_distance_matrix, tree):
+        """
+        Creates a |LeafDistanceMatrix| from a |dendropy.PhylogeneticDistanceMatrix|
+        calculated on ``tree``, with leaves identified by their taxa.
+        """
+        leaves = list(phylogenetic_distance_matrix.taxon_iter())
+        num_leaves = len(leaves)
+        weighted_distances = numpy.zeros((num_leaves, num_leaves), dtype=numpy.float64)
+        step_distances = numpy.zeros((num_leaves, num_leaves), dtype=numpy.float64)
+        for idx1, taxon1 in enumerate(leaves):
+            for idx2 in range(idx1+1, num_leaves):
+                taxon2 = leaves[idx2]
+                d = phylogenetic_distance_matrix.distance(taxon1, taxon2, is_weighted_edge_distances=True)
+                weighted_distances[idx1, idx2] = d
+                weighted_distances[idx2, idx1] = d
+                d = phylogenetic_distance_matrix.distance(taxon1, taxon2, is_weighted_edge_distances=False)
+                step_distances[idx1, idx2] = d
+                step_distances[idx2, idx1] = d
+        tree_length = 0.0
+        num_edges = 0
+        for nd in tree.postorder_node_iter():
+            if nd.edge.length is not None:
+                tree_length += nd.edge.length
+            num_edges += 1
+        return cls(
+                leaves=leaves,
+                weighted_distances=weighted_distances,
+                step_distances=step_distances,
+                tree_length=tree_length,
+                num_edges=num_edges)
+
+    def __init__(self, leaves, weighted_distances, step_distances, tree_length, num_edges):
+        self.leaves = leaves
+        self.leaf_indexes = dict((leaf, idx) for idx, leaf in enumerate(leaves))
+        self.weighted_distances = weighted_distances
+        self.step_distances = step_distances
+        self.tree_length = tree_length
+        self.num_edges = num_edges
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def get_distances_and_normalization_factor(self,
+            is_weighted_edge_distances,
+            is_normalize_by_tree_size):
+        if is_weighted_edge_distances:
+            distances = self.weighted_distances
+            normalization_factor = self.tree_length if is_normalize_by_tree_size else 1.0
+        else:
+            distances = self.step_distances
+            normalization_factor = float(self.num_edges) if is_normalize_by_tree_size else 1.0
+        return distances, normalization_factor
+
+    def assemblage_leaf_indexes(self, assemblage_memberships):
+        """
+        Returns a list of sorted index arrays, one for each collection of
+        leaves in ``assemblage_memberships``.
+        """
+        assemblage_leaf_indexes = []
+        for assemblage_idx, assemblage_membership in enumerate(assemblage_memberships):
+            if len(assemblage_membership) == 0:
+                raise error.IncompleteStateSpaceOccupancyException("Null assemblage: {}".format(assemblage_idx))
+            if len(assemblage_membership) == 1:
+                raise error.SingleTaxonAssemblageException("{}: {}".format(assemblage_idx, assemblage_membership))
+            indexes = numpy.array(sorted(self.leaf_indexes[leaf] for leaf in assemblage_membership), dtype=numpy.intp)
+            assemblage_leaf_indexes.append(indexes)
+        return assemblage_leaf_indexes
+
+    def standardized_effect_size_mean_pairwise_distance(self,
+            assemblage_memberships,
+            num_randomization_replicates=1000,
+            is_weighted_edge_distances=True,
+            is_normalize_by_tree_size=False,
+            rng=None):
+        """
+        Returns a list of |StandardizedEffectSizeResult| objects, one for each
+        collection of leaves in ``assemblage_memberships``, for the MPD
+        statistic.
+        """
+        variant = (is_weighted_edge_distances, "mpd")
+        return self.standardized_effect_sizes(
+                assemblage_memberships=assemblage_memberships,
+                num_randomization_replicates=num_randomization_replicates,
+                is_normalize_by_tree_size=is_normalize_by_tree_size,
+                variants=[variant],
+                rng=rng)[variant]
+
+    def standardized_effect_size_mean_nearest_taxon_distance(self,
+            assemblage_memberships,
+            num_randomization_replicates=1000,
+            is_weighted_edge_distances=True,
+            is_normalize_by_tree_size=False,
+            rng=None):
+        """
+        Returns a list of |StandardizedEffectSizeResult| objects, one for each
+        collection of leaves in ``assemblage_memberships``, for the MNTD
+        statistic.
+        """
+        variant = (is_weighted_edge_distances, "mntd")
+        return self.standardized_effect_sizes(
+                assemblage_memberships=assemblage_memberships,
+                num_randomization_replicates=num_randomization_replicates,
+                is_normalize_by_tree_size=is_normalize_by_tree_size,
+                variants=[variant],
+                rng=rng)[variant]
+
+    def standardized_effect_sizes(self,
+            assemblage_memberships,
+            num_randomization_replicates=1000,
+            is_normalize_by_tree_size=False,
+            variants=None,
+            randomization_tolerance=None,
+            max_randomization_replicates=None,
+            randomization_block_size=None,
+            rng=None):
+        """
+        Calculates the standardized effect sizes of several statistics at
+        once, with all of them evaluated on the same set of randomization
+        replicates (so that the leaf permutations are drawn, and the
+        distances of each assemblage under them gathered, only once).
+
+        If ``randomization_tolerance`` is given, randomization is adaptive:
+        replicates are drawn in blocks of ``randomization_block_size``, and
+        drawing stops for each statistic of each assemblage as soon as both
+        its z-score and p-value estimates change by no more than
+        ``randomization_tolerance`` (the z-score relative to its magnitude, if
+        greater than 1) on adding a block, or when
+        ``max_randomization_replicates`` have been drawn. Otherwise, exactly
+        ``num_randomization_replicates`` replicates are drawn.
+
+        Parameters
+        ----------
+        assemblage_memberships : iterable of collections of leaves
+            Each collection specifies the composition of an assemblage.
+        num_randomization_replicates : int
+            Number of randomization replicates (if not adaptive).
+        is_normalize_by_tree_size : bool
+            If |True|, distances are normalized by the tree length (weighted)
+            or number of edges (unweighted).
+        variants : iterable of tuples
+            The statistics to calculate, as ``(is_weighted_edge_distances,
+            statistic_name)`` tuples, where ``statistic_name`` is a key of
+            ``STATISTIC_FUNCTIONS``. Defaults to all combinations.
+        randomization_tolerance : float
+            If not |None|, stopping tolerance for adaptive randomization.
+        max_randomization_replicates : int
+            Maximum number of randomization replicates (if adaptive; defaults
+            to 10 times ``num_randomization_replicates``).
+        randomization_block_size : int
+            Number of randomization replicates drawn at a time (if adaptive;
+            defaults to ``num_randomization_replicates``).
+        rng : |random.Random| or |numpy.random.Generator|
+            Source of randomness.
+
+        Returns
+        -------
+        results : dict
+            Keys are the variants and values are lists of
+            |StandardizedEffectSizeResult| objects, one for each assemblage.
+        """
+        if variants is None:
+            variants = [(is_weighted_edge_distances, statistic_name)
+                    for is_weighted_edge_distances in (False, True)
+                    for statistic_name in STATISTIC_FUNCTIONS]
+        randomization_block_size, max_randomization_replicates = compose_randomization_schedule(
+                num_randomization_replicates=num_randomization_replicates,
+                randomization_tolerance=randomization_tolerance,
+                max_randomization_replicates=max_randomization_replicates,
+                randomization_block_size=randomization_block_size)
+        assemblage_leaf_indexes = self.assemblage_leaf_indexes(assemblage_memberships)
+        rng = get_numpy_rng(rng)
+        weightings = []
+        distances = {}
+        normalization_factors = {}
+        for is_weighted_edge_distances, statistic_name in variants:
+            if is_weighted_edge_distances not in distances:
+                weightings.append(is_weighted_edge_distances)
+                distances[is_weighted_edge_distances], normalization_factors[is_weighted_edge_distances] = self.get_distances_and_normalization_factor(
+                        is_weighted_edge_distances=is_weighted_edge_distances,
+                        is_normalize_by_tree_size=is_normalize_by_tree_size)
+        # keys are (is_weighted_edge_distances, assemblage index, statistic_name)
+        obs_values = {}
+        null_values = collections.defaultdict(list)
+        current_results = {}
+        for is_weighted_edge_distances in weightings:
+            statistic_names = [statistic_name for (w, statistic_name) in variants if w == is_weighted_edge_distances]
+            for assemblage_idx, indexes in enumerate(assemblage_leaf_indexes):
+                values = calc_statistics(distances[is_weighted_edge_distances], indexes.reshape(1, -1), statistic_names)
+                for statistic_name in statistic_names:
+                    obs_values[(is_weighted_edge_distances, assemblage_idx, statistic_name)] = values[statistic_name][0] / normalization_factors[is_weighted_edge_distances]
+        active_keys = set(obs_values)
+        num_replicates_drawn = 0
+        while active_keys and num_replicates_drawn < max_randomization_replicates:
+            num_block_replicates = min(randomization_block_size, max_randomization_replicates - num_replicates_drawn)
+            # one permutation of the leaves per replicate, shared by all
+            # assemblages and all variants
+            permutations = numpy.argsort(rng.random((num_block_replicates, len(self))), axis=1)
+            num_replicates_drawn += num_block_replicates
+            for is_weighted_edge_distances in weightings:
+                for assemblage_idx, indexes in enumerate(assemblage_leaf_indexes):
+                    statistic_names = [statistic_name for (w, a, statistic_name) in active_keys if w == is_weighted_edge_distances and a == assemblage_idx]
+                    if not statistic_names:
+                        continue
+                    values = calc_statistics(distances[is_weighted_edge_distances], numpy.sort(permutations[:, indexes], axis=1), statistic_names)
+                    for statistic_name in statistic_names:
+                        null_values[(is_weighted_edge_distances, assemblage_idx, statistic_name)].append(values[statistic_name] / normalization_factors[is_weighted_edge_distances])
+            if randomization_tolerance is None:
+                break
+            for key in list(active_keys):
+                result = summarize_null_distribution(obs_values[key], numpy.concatenate(null_values[key]))
+                previous_result = current_results.get(key, None)
+                current_results[key] = result
+                if previous_result is not None and is_converged(previous_result, result, randomization_tolerance):
+                    active_keys.remove(key)
+        results = collections.OrderedDict((variant, []) for variant in variants)
+        for is_weighted_edge_distances, statistic_name in variants:
+            for assemblage_idx in range(len(assemblage_leaf_indexes)):
+                key = (is_weighted_edge_distances, assemblage_idx, statistic_name)
+                if key not in current_results:
+                    current_results[key] = summarize_null_distribution(obs_values[key], numpy.concatenate(null_values[key]))
+                results[(is_weighted_edge_distances, statistic_name)].append(current_results[key])
+        return results
+
+def is_converged(previous_result, result, tolerance):
+    """
+    Returns |True| if the z-score and p-value estimates of ``result`` are
+    both within ``tolerance`` of those of ``previous_result`` (with the
+    z-score difference taken relative to its magnitude, if greater than 1).
+    """
+    if abs(result.p - previous_result.p) > tolerance:
+        return False
+    if result.z is None or previous_result.z is None:
+        return result.z is None and previous_result.z is None
+    return abs(result.z - previous_result.z) <= tolerance * max(1.0, abs(result.z))
+
+def summarize_null_distribution(obs_value, null_values):
+    """
+    Returns a |StandardizedEffectSizeResult| for the observed statistic value
+    ``obs_value`` given the array of statistic values under the null model,
+    ``null_values``.
+    """
+    obs_value = float(obs_value)
+    num_null_values = len(null_values)
+    null_model_mean = float(null_values.mean())
+    if num_null_values > 1:
+        null_model_var = float(null_values.var(ddof=1))
+    else:
+        null_model_var = float("inf")
+    rank = int(numpy.count_nonzero(null_values < obs_value))
+    if null_model_var > 0:
+        null_model_sd = math.sqrt(null_model_var)
+        z = (obs_value - null_model_mean) / null_model_sd
+    else:
+        null_model_sd = 0.0
+        z = None
+    p = float(rank) / num_null_values
+    return StandardizedEffectSizeResult(
+            obs=obs_value,
+            null_model_mean=null_model_mean,
+            null_model_sd=null_model_sd,
+            z=z,
+            rank=rank,
+            p=p)
+
+def calc_mean_pairwise_distances(block):
+    """
+    Returns the mean pairwise distance for each of the (number of
+    assemblages x assemblage size x assemblage size) distances in ``block``.
+    """
+    assemblage_size = block.shape[1]
+    num_pairs = assemblage_size * (assemblage_size - 1) / 2.0
+    # each pair is counted twice in the (symmetric) full block
+    return (block.sum(axis=2).sum(axis=1) / 2.0) / num_pairs
+
+def calc_mean_nearest_taxon_distances(block):
+    """
+    Returns the mean nearest taxon distance for each of the (number of
+    assemblages x assemblage size x assemblage size) distances in ``block``.
+    """
+    assemblage_size = block.shape[1]
+    diagonal = numpy.arange(assemblage_size)
+    block = block.copy()
+    block[:, diagonal, diagonal] = numpy.inf
+    return block.min(axis=2).sum(axis=1) / assemblage_size
+
+STATISTIC_FUNCTIONS = collections.OrderedDict([
+    ("mpd", calc_mean_pairwise_distances),
+    ("mntd", calc_mean_nearest_taxon_distances),
+    ])
+
+def calc_statistics(distances, assemblage_leaf_indexes, statistic_names):
+    """
+    Returns a dictionary with, for each statistic in ``statistic_names``, an
+    array of its values for each row of ``assemblage_leaf_indexes``, a (number
+    of assemblages x assemblage size) array of (sorted) leaf indexes into
+    ``distances``. Assemblages are processed in blocks of bounded size, so
+    that memory use is independent of the number of assemblages, with the
+    distances of each block gathered once for all the statistics.
+    """
+    num_assemblages, assemblage_size = assemblage_leaf_indexes.shape
+    values = dict((statistic_name, numpy.empty(num_assemblages, dtype=numpy.float64)) for statistic_name in statistic_names)
+    batch_size = max(1, MAX_BATCH_SIZE // (assemblage_size * assemblage_size))
+    for start in range(0, num_assemblages, batch_size):
+        indexes = assemblage_leaf_indexes[start:start+batch_size]
+        block = distances[indexes[:, :, None], indexes[:, None, :]]
+        for statistic_name in statistic_names:
+            values[statistic_name][start:start+len(indexes)] = STATISTIC_FUNCTIONS[statistic_name](block)
+    return values
@@ -33,3 +33,6 @@ class IncompleteAreaOccupancyException(IncompleteStateSpaceOccupancyException):
 class IncompleteHostOccupancyException(IncompleteStateSpaceOccupancyException):
     pass
 
+
+class SingleTaxonAssemblageException(SummaryStatisticsCalculationFailure):
+    pass
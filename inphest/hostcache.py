@@ -0,0 +1,515 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+On-disk cache of compiled host histories.
+
+A cache entry consists of two files sharing a common stem:
+
+    - ``<stem>.json`` : header, with the cache key (source content hash,
+      source schema, parser version) and, for each host history, the host
+      tree, lineage definitions and events.
+    - ``<stem>.npy`` : all distinct host lineage distance matrices (each
+      stored once, however many host histories share its host tree
+      topology), concatenated as a single flat array, so that it can be
+      memory-mapped on loading.
+
+The stem is derived from the source file name, the cache key and the host
+history sample selection, so changing the source file contents or the parser
+version automatically results in a cache miss; stale entries for the same
+source file (i.e., those with a different cache key, whatever their sample
+selection) are removed when a new entry is written.
+
+Each file is written to a uniquely-named temporary file in the cache
+directory that then replaces it, so that worker processes compiling the same
+source concurrently never write to each other's files, and the data file is
+put in place before the header, so that a header is only ever found with the
+data it describes. Entries that cannot be read (e.g., truncated by a full
+disk) are treated as cache misses, and replaced.
+
+The host-side reference structures against which simulated symbiont
+phylogenies are compared (|summarize.HostReferenceStructures|) are cached
+alongside, in ``<stem>.refs``, as JSON (see
+|summarize.HostReferenceStructures.as_definition|) keyed to the content of
+each host history (its host tree and area assemblages), so that they are only
+computed once, however many replicates, runs or worker processes use them.
+Like the host history cache, it is plain data, so reading it never executes
+code.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy
+import dendropy
+
+from inphest import model
+from inphest import utility
+from inphest import summarize
+
+HOST_HISTORY_CACHE_VERSION = 2
+HOST_HISTORY_CACHE_FORMAT = "inphest-host-history-cache"
+HOST_HISTORY_CACHE_EXTENSION = "hhcache"
+HOST_REFERENCE_CACHE_VERSION = 2
+HOST_REFERENCE_CACHE_FORMAT = "inphest-host-reference-cache"
+HOST_REFERENCE_CACHE_EXTENSION = "refs"
+
+def compute_source_hash(filepath, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(filepath, "rb") as src:
+        while True:
+            block = src.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def compose_cache_key(source_hash, schema):
+    h = hashlib.sha1()
+    h.update("{}:{}:{}:{}".format(
+        source_hash,
+        schema,
+        model.HostHistorySamples.PARSER_VERSION,
+        HOST_HISTORY_CACHE_VERSION).encode("utf-8"))
+    return h.hexdigest()
+
+def compose_selection_key(sample_selection):
+    if sample_selection is None or sample_selection.is_trivial:
+        return "all"
+    h = hashlib.sha1()
+    h.update(json.dumps(sample_selection.as_definition()).encode("utf-8"))
+    return h.hexdigest()[:8]
+
+def compose_cache_stem(source_path, cache_key, sample_selection=None, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(source_path))
+    return os.path.join(cache_dir, "{}.{}.{}.{}".format(
+        os.path.basename(source_path),
+        cache_key[:16],
+        compose_selection_key(sample_selection),
+        HOST_HISTORY_CACHE_EXTENSION))
+
+def _stale_cache_filepaths(source_path, cache_key, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(source_path))
+    prefix = os.path.basename(source_path) + "."
+    stale = []
+    for filename in os.listdir(cache_dir):
+        if not filename.startswith(prefix):
+            continue
+        parts = filename[len(prefix):].split(".")
+        if (len(parts) == 4
+                and parts[0] != cache_key[:16]
+                and parts[2] == HOST_HISTORY_CACHE_EXTENSION
+                and parts[3] in ("json", "npy", HOST_REFERENCE_CACHE_EXTENSION)):
+            stale.append(os.path.join(cache_dir, filename))
+    return stale
+
+def _replace_file(filepath, write_f, mode="w"):
+    """
+    Writes ``filepath`` by calling ``write_f`` with a file object (open in
+    ``mode``) for a new, uniquely-named, temporary file in the same
+    directory, which then (atomically) replaces ``filepath``.
+    """
+    dirname, basename = os.path.split(filepath)
+    fd, temp_filepath = tempfile.mkstemp(dir=dirname or ".", prefix=basename + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as dest:
+            write_f(dest)
+        os.replace(temp_filepath, filepath)
+    except:
+        try:
+            os.remove(temp_filepath)
+        except OSError:
+            pass
+        raise
+
+def _selection_definition(sample_selection):
+    if sample_selection is None or sample_selection.is_trivial:
+        return None
+    return sample_selection.as_definition()
+
+def write_host_history_cache(
+        host_history_samples,
+        source_path,
+        schema,
+        is_validated,
+        sample_selection=None,
+        cache_dir=None,
+        source_hash=None):
+    """
+    Writes the compiled host histories in ``host_history_samples``, parsed
+    from ``source_path`` under ``sample_selection``, to the cache, with the
+    data file put in place before the header. Returns the stem of the cache
+    files written.
+    """
+    if source_hash is None:
+        source_hash = compute_source_hash(source_path)
+    cache_key = compose_cache_key(source_hash=source_hash, schema=schema)
+    stem = compose_cache_stem(
+            source_path=source_path,
+            cache_key=cache_key,
+            sample_selection=sample_selection,
+            cache_dir=cache_dir)
+    taxon_namespaces = []
+    taxon_namespace_indexes = {}
+    host_history_entries = []
+    distance_arrays = []
+    distances_offsets = {}
+    offset = 0
+    for host_history in host_history_samples.host_histories:
+        tns = host_history.taxon_namespace
+        if id(tns) not in taxon_namespace_indexes:
+            taxon_namespace_indexes[id(tns)] = len(taxon_namespaces)
+            taxon_namespaces.append([taxon.label for taxon in tns])
+        ldm = host_history.lineage_distance_matrix
+        if id(ldm) not in distances_offsets:
+            # matrices shared by host histories with the same host tree
+            # topology are only written once
+            distances_offsets[id(ldm)] = offset
+            distance_arrays.append(numpy.asarray(ldm.distances, dtype=numpy.float64).ravel())
+            offset += len(ldm.lineage_ids) * len(ldm.lineage_ids)
+        host_history_entries.append({
+            "sample_idx": host_history.sample_idx,
+            "taxon_namespace_idx": taxon_namespace_indexes[id(tns)],
+            "tree": host_history.tree.as_string(
+                schema="newick",
+                suppress_rooting=True,
+                suppress_annotations=True,
+                suppress_internal_node_labels=True,
+                ).strip(),
+            "start_time": host_history.start_time,
+            "end_time": host_history.end_time,
+            "lineages": [list(lineage) for lineage in host_history.lineages.values()],
+            "events": [list(event) for event in host_history.events],
+            "lineage_ids": ldm.lineage_ids,
+            "distances_offset": distances_offsets[id(ldm)],
+            })
+    header = {
+        "format": HOST_HISTORY_CACHE_FORMAT,
+        "cache_version": HOST_HISTORY_CACHE_VERSION,
+        "parser_version": model.HostHistorySamples.PARSER_VERSION,
+        "source_hash": source_hash,
+        "schema": schema,
+        "is_validated": is_validated,
+        "sample_selection": _selection_definition(sample_selection),
+        "lineage_fields": list(model.HostHistory.HostLineageDefinition._fields),
+        "event_fields": list(model.HostHistory.HostEvent._fields),
+        "taxon_namespaces": taxon_namespaces,
+        "host_histories": host_history_entries,
+        }
+    if distance_arrays:
+        distances = numpy.concatenate(distance_arrays)
+    else:
+        distances = numpy.zeros(0, dtype=numpy.float64)
+    # the header is replaced last, so that an interrupted write never leaves
+    # behind a header without its data
+    _replace_file(stem + ".npy", lambda dest: numpy.save(dest, distances), mode="wb")
+    _replace_file(stem + ".json", lambda dest: json.dump(header, dest))
+    for stale_path in _stale_cache_filepaths(source_path=source_path, cache_key=cache_key, cache_dir=cache_dir):
+        try:
+            os.remove(stale_path)
+        except OSError:
+            pass
+    return stem
+
+def read_host_history_cache(
+        source_path,
+        schema,
+        validate=True,
+        sample_selection=None,
+        cache_dir=None,
+        source_hash=None,
+        is_memory_mapped=True):
+    """
+    Returns a |HostHistorySamples| object populated from the cache if an
+    entry matching the current contents of ``source_path``, ``schema``,
+    ``sample_selection`` and the parser version exists (and, if ``validate``
+    is |True|, was validated when written) and can be read, or |None|
+    otherwise.
+    """
+    if source_hash is None:
+        source_hash = compute_source_hash(source_path)
+    cache_key = compose_cache_key(source_hash=source_hash, schema=schema)
+    stem = compose_cache_stem(
+            source_path=source_path,
+            cache_key=cache_key,
+            sample_selection=sample_selection,
+            cache_dir=cache_dir)
+    header_path = stem + ".json"
+    data_path = stem + ".npy"
+    if not os.path.exists(header_path) or not os.path.exists(data_path):
+        return None
+    try:
+        with open(header_path, "r") as src:
+            header = json.load(src)
+    except (OSError, IOError, ValueError):
+        return None
+    if (not isinstance(header, dict)
+            or header.get("format") != HOST_HISTORY_CACHE_FORMAT
+            or header.get("cache_version") != HOST_HISTORY_CACHE_VERSION
+            or header.get("parser_version") != model.HostHistorySamples.PARSER_VERSION
+            or header.get("source_hash") != source_hash
+            or header.get("schema") != schema
+            or header.get("sample_selection") != _selection_definition(sample_selection)
+            or header.get("lineage_fields") != list(model.HostHistory.HostLineageDefinition._fields)
+            or header.get("event_fields") != list(model.HostHistory.HostEvent._fields)
+            or (validate and not header.get("is_validated"))):
+        return None
+    try:
+        distances = numpy.load(data_path, mmap_mode="r" if is_memory_mapped else None)
+    except (OSError, IOError, ValueError):
+        return None
+    if distances.ndim != 1 or any(
+            entry["distances_offset"] + len(entry["lineage_ids"]) ** 2 > len(distances)
+            for entry in header["host_histories"]):
+        return None
+    taxon_namespaces = [dendropy.TaxonNamespace(labels) for labels in header["taxon_namespaces"]]
+    host_history_samples = model.HostHistorySamples()
+    lineage_distance_matrices = {}
+    for entry in header["host_histories"]:
+        taxon_namespace = taxon_namespaces[entry["taxon_namespace_idx"]]
+        host_history = model.HostHistory(taxon_namespace=taxon_namespace)
+        host_history.sample_idx = entry["sample_idx"]
+        for lineage_values in entry["lineages"]:
+            lineage = model.HostHistory.HostLineageDefinition(*lineage_values)
+            host_history.lineages[lineage.lineage_id] = lineage
+        for event_values in entry["events"]:
+            host_history.events.append(model.HostHistory.HostEvent(*event_values))
+        host_tree = dendropy.Tree.get(
+                data=entry["tree"],
+                schema="newick",
+                rooting="force-rooted",
+                taxon_namespace=taxon_namespace,
+                )
+        host_tree.encode_bipartitions()
+        num_lineages = len(entry["lineage_ids"])
+        offset = entry["distances_offset"]
+        if offset not in lineage_distance_matrices:
+            lineage_distance_matrices[offset] = model.LineageDistanceMatrix(
+                    lineage_ids=entry["lineage_ids"],
+                    distances=distances[offset:offset + num_lineages * num_lineages].reshape((num_lineages, num_lineages)),
+                    )
+        lineage_distance_matrix = lineage_distance_matrices[offset]
+        host_history.compile(
+                tree=host_tree,
+                start_time=entry["start_time"],
+                end_time=entry["end_time"],
+                lineage_distance_matrix=lineage_distance_matrix,
+                )
+        host_history_samples.host_histories.append(host_history)
+    return host_history_samples
+
+def load_host_history_samples(
+        source_path,
+        schema,
+        validate=True,
+        sample_selection=None,
+        is_use_cache=True,
+        cache_dir=None,
+        run_logger=None):
+    """
+    Returns a |HostHistorySamples| object with the host histories in
+    ``source_path`` (restricted to those selected by ``sample_selection``, if
+    given), served from the compiled host history cache if possible and
+    parsed (and then cached) otherwise.
+    """
+    if is_use_cache and sample_selection is not None and not sample_selection.is_reproducible:
+        if run_logger is not None:
+            run_logger.info("-inphest- Random host history sample selection without a seed: not using compiled host history cache")
+        is_use_cache = False
+    if not is_use_cache:
+        host_history_samples = model.HostHistorySamples()
+        with utility.open_input_file(source_path) as src:
+            host_history_samples.parse_host_biogeography(
+                    src=src,
+                    schema=schema,
+                    validate=validate,
+                    sample_selection=sample_selection)
+        return host_history_samples
+    source_hash = compute_source_hash(source_path)
+    host_history_samples = read_host_history_cache(
+            source_path=source_path,
+            schema=schema,
+            validate=validate,
+            sample_selection=sample_selection,
+            cache_dir=cache_dir,
+            source_hash=source_hash)
+    if host_history_samples is not None:
+        if run_logger is not None:
+            run_logger.info("-inphest- Using compiled host history cache for: {}".format(source_path))
+        return host_history_samples
+    host_history_samples = model.HostHistorySamples()
+    with utility.open_input_file(source_path) as src:
+        host_history_samples.parse_host_biogeography(
+                src=src,
+                schema=schema,
+                validate=validate,
+                sample_selection=sample_selection)
+    try:
+        stem = write_host_history_cache(
+                host_history_samples=host_history_samples,
+                source_path=source_path,
+                schema=schema,
+                is_validated=validate,
+                sample_selection=sample_selection,
+                cache_dir=cache_dir,
+                source_hash=source_hash)
+    except (OSError, IOError) as e:
+        if run_logger is not None:
+            run_logger.warning("-inphest- Failed to write compiled host history cache: {}".format(e))
+    else:
+        if run_logger is not None:
+            run_logger.info("-inphest- Compiled host history cache written to: {}.*".format(stem))
+    return host_history_samples
+
+def compose_host_reference_cache_filepath(
+        source_path,
+        schema,
+        sample_selection=None,
+        cache_dir=None,
+        source_hash=None):
+    """
+    Returns the path of the host reference structures cache for the host
+    histories in ``source_path`` (restricted to those selected by
+    ``sample_selection``, if given).
+    """
+    if source_hash is None:
+        source_hash = compute_source_hash(source_path)
+    cache_key = compose_cache_key(source_hash=source_hash, schema=schema)
+    stem = compose_cache_stem(
+            source_path=source_path,
+            cache_key=cache_key,
+            sample_selection=sample_selection,
+            cache_dir=cache_dir)
+    return stem + "." + HOST_REFERENCE_CACHE_EXTENSION
+
+def compose_host_reference_key(host_history):
+    """
+    Returns a key identifying the host-side reference structures of
+    ``host_history``, derived from its host tree (with edge lengths) and the
+    memberships of its area assemblages.
+    """
+    h = hashlib.sha1()
+    h.update("{}:{}:".format(HOST_REFERENCE_CACHE_VERSION, dendropy.__version__).encode("utf-8"))
+    h.update(host_history.tree.as_string(
+        schema="newick",
+        suppress_rooting=True,
+        suppress_annotations=True,
+        suppress_internal_node_labels=True,
+        ).strip().encode("utf-8"))
+    for leaf_set in host_history.area_assemblage_leaf_sets:
+        h.update(("|" + ",".join(sorted(nd.taxon.label for nd in leaf_set))).encode("utf-8"))
+    return h.hexdigest()
+
+def write_host_reference_cache(host_reference_definitions_by_key, filepath):
+    """
+    Writes the definitions of |summarize.HostReferenceStructures| objects
+    (as given by their ``as_definition()`` method) in
+    ``host_reference_definitions_by_key`` (a dictionary mapping the keys
+    given by :func:`compose_host_reference_key` to the definitions) to
+    ``filepath``.
+    """
+    payload = {
+        "format": HOST_REFERENCE_CACHE_FORMAT,
+        "cache_version": HOST_REFERENCE_CACHE_VERSION,
+        "host_references": host_reference_definitions_by_key,
+        }
+    _replace_file(filepath, lambda dest: json.dump(payload, dest))
+
+def read_host_reference_cache(filepath):
+    """
+    Returns the dictionary of |summarize.HostReferenceStructures| definitions
+    (keyed as given by :func:`compose_host_reference_key`) stored in
+    ``filepath``, or an empty dictionary if it does not exist or cannot be
+    read.
+    """
+    if not os.path.exists(filepath):
+        return {}
+    try:
+        with open(filepath, "r") as src:
+            payload = json.load(src)
+    except (OSError, IOError, ValueError):
+        return {}
+    if (not isinstance(payload, dict)
+            or payload.get("format") != HOST_REFERENCE_CACHE_FORMAT
+            or payload.get("cache_version") != HOST_REFERENCE_CACHE_VERSION
+            or not isinstance(payload.get("host_references"), dict)):
+        return {}
+    return payload["host_references"]
+
+def load_host_references(
+        host_histories,
+        statistic_groups,
+        cache_filepath=None,
+        run_logger=None):
+    """
+    Returns a list of |summarize.HostReferenceStructures| objects, one for
+    each of ``host_histories``, with the structures required by
+    ``statistic_groups`` computed. If ``cache_filepath`` is given, the
+    structures are served from that cache if possible, and computed (and the
+    cache rewritten) otherwise.
+    """
+    is_required = any(summarize.HostReferenceStructures.STATISTIC_GROUP_REQUIREMENTS[group_name] for group_name in statistic_groups)
+    if not is_required:
+        cache_filepath = None
+    if cache_filepath is not None:
+        host_reference_definitions_by_key = read_host_reference_cache(cache_filepath)
+    else:
+        host_reference_definitions_by_key = {}
+    host_references_list = []
+    host_references_by_key = {}
+    num_computed = 0
+    for host_history in host_histories:
+        if cache_filepath is not None:
+            key = compose_host_reference_key(host_history)
+        else:
+            key = None
+        host_references = host_references_by_key.get(key, None)
+        if host_references is None and key in host_reference_definitions_by_key:
+            try:
+                host_references = summarize.HostReferenceStructures.from_definition(
+                        definition=host_reference_definitions_by_key[key],
+                        host_history=host_history)
+            except (KeyError, TypeError, ValueError, dendropy.utility.error.DataParseError):
+                host_references = None
+        if host_references is not None and host_references.is_computed_for(statistic_groups):
+            if host_references.host_history is not host_history:
+                host_references.bind_to_host_history(host_history)
+            host_references.compute_for(statistic_groups)
+        else:
+            host_references = summarize.HostReferenceStructures(host_history)
+            host_references.compute_for(statistic_groups)
+            num_computed += 1
+            if key is not None:
+                host_reference_definitions_by_key[key] = host_references.as_definition()
+        if key is not None:
+            host_references_by_key[key] = host_references
+        host_references_list.append(host_references)
+    if cache_filepath is None:
+        return host_references_list
+    if not num_computed:
+        if run_logger is not None:
+            run_logger.info("-inphest- Using host reference structures cache: {}".format(cache_filepath))
+        return host_references_list
+    try:
+        write_host_reference_cache(
+                host_reference_definitions_by_key=host_reference_definitions_by_key,
+                filepath=cache_filepath)
+    except (OSError, IOError) as e:
+        if run_logger is not None:
+            run_logger.warning("-inphest- Failed to write host reference structures cache: {}".format(e))
+    else:
+        if run_logger is not None:
+            run_logger.info("-inphest- Host reference structures for {} host histories written to cache: {}".format(num_computed, cache_filepath))
+    return host_references_list
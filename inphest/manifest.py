@@ -0,0 +1,194 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Run manifests, from which interrupted runs can be resumed.
+
+A run manifest is a journal (``<output prefix>.manifest.jsonl``) of JSON
+objects, one per line:
+
+    - the first gives the format and version, and the settings of the run
+      that determine its output (random seed, number of replicates, host
+      history samples and selection, summary statistics configuration,
+      output files);
+    - each subsequent one is written once a batch of records has been
+      written out to the output files, and gives the replicates completed in
+      the batch (as ``[replicate index, host history index, random seed]``
+      lists; the random seed of a replicate seeds both its simulation and
+      the randomizations of its standardized effect sizes) and the size of
+      each output file (in bytes, or, for binary outputs, in records) once
+      the batch was written.
+
+As each line is only written after the output it describes, the last
+(complete) line gives the sizes to which the output files can be truncated
+to remove any partial records, and the lines up to it the replicates that do
+not need to be simulated again. A partial last line (left by an interruption
+while it was being written) is ignored.
+"""
+
+import os
+import json
+import collections
+
+RUN_MANIFEST_VERSION = 2
+RUN_MANIFEST_FORMAT = "inphest-run-manifest"
+RUN_MANIFEST_EXTENSION = "manifest.jsonl"
+
+def compose_run_manifest_filepath(output_prefix):
+    return output_prefix + "." + RUN_MANIFEST_EXTENSION
+
+def compose_output_size(dest):
+    """
+    Returns the size of the output written to ``dest``: the number of
+    records for binary (batch) destinations and the position in the file
+    (i.e., the number of bytes, as the file is only appended to) for others.
+    """
+    if getattr(dest, "is_batch_destination", False):
+        return dest.num_records
+    return dest.tell()
+
+class RunManifestWriter(object):
+    """
+    Writes the run manifest (see module documentation) at ``path``: a new one
+    starting with ``settings``, or, if ``is_append`` is `True`, appending to
+    an existing one (whose settings should already have been checked),
+    truncated to its last complete line. The
+    size of each of ``outputs`` (a dictionary of output file or writer by
+    name) is recorded with each batch of completed replicates.
+
+    Completed replicates are written as batches by :meth:`write_batch`, so
+    that it can be used as a destination of |utility.BufferedOutputSink|,
+    with each replicate written to the sink in the same record as its tree,
+    as a single ``(replicate_idx, host_history_idx, random_seed)`` item. The
+    manifest should be the last destination of the sink (see
+    |utility.BufferedOutputSink.add_destination|), so that the output
+    recorded has been written by the time it is recorded.
+    """
+
+    is_batch_destination = True
+
+    def __init__(self, path, settings, outputs, is_append=False):
+        self.name = path
+        self.outputs = outputs
+        if is_append:
+            # a partial last line (see |RunManifest|) would otherwise be
+            # joined to the next one
+            with open(path, "rb") as src:
+                data = src.read()
+            truncate_output_file(path, data.rfind(b"\n") + 1)
+            self._dest = open(path, "a")
+        else:
+            self._dest = open(path, "w")
+            header = collections.OrderedDict()
+            header["format"] = RUN_MANIFEST_FORMAT
+            header["version"] = RUN_MANIFEST_VERSION
+            header["settings"] = settings
+            self._write_line(header)
+        self.num_records = 0
+        # number of records and position before and after the last batch,
+        # to which the manifest can be truncated
+        self._end_position = self._dest.tell()
+        self._last_batch_start = (0, self._end_position)
+
+    def write_batch(self, entries):
+        self._last_batch_start = (self.num_records, self._dest.tell())
+        batch = collections.OrderedDict()
+        batch["completed"] = [list(entry) for entry in entries]
+        batch["output_sizes"] = collections.OrderedDict(
+                (name, compose_output_size(dest)) for name, dest in self.outputs.items())
+        self._write_line(batch)
+        self.num_records += len(entries)
+        self._end_position = self._dest.tell()
+
+    def truncate(self, num_records):
+        """
+        Removes the last batch, if it brought the number of replicates
+        recorded to more than ``num_records`` (e.g., to undo a batch that
+        could not be written out to all the files of a run; see
+        |utility.BufferedOutputSink|), and any partial line written after it.
+        """
+        start_num_records, start_position = self._last_batch_start
+        if num_records == self.num_records:
+            position = self._end_position
+        elif num_records == start_num_records:
+            position = start_position
+        else:
+            raise ValueError("Cannot truncate run manifest with {} replicates to {} replicates: '{}'".format(self.num_records, num_records, self.name))
+        self._dest.seek(position)
+        self._dest.truncate()
+        self.num_records = num_records
+        self._end_position = position
+        self._last_batch_start = (num_records, position)
+
+    def flush(self):
+        self._dest.flush()
+
+    def fileno(self):
+        return self._dest.fileno()
+
+    def close(self):
+        self._dest.close()
+
+    def _write_line(self, d):
+        self._dest.write(json.dumps(d))
+        self._dest.write("\n")
+        self._dest.flush()
+
+class RunManifest(object):
+    """
+    The contents of a run manifest (see module documentation) as read from
+    ``path``: the settings of the run, the replicates completed (as a list of
+    ``(replicate_idx, host_history_idx, random_seed)`` tuples) and the sizes
+    of the output files as of the last batch of completed replicates
+    (`None` if none were completed).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.settings = None
+        self.completed = []
+        self.output_sizes = None
+        with open(path, "r") as src:
+            for line_idx, line in enumerate(src):
+                if not line.endswith("\n"):
+                    break
+                d = json.loads(line)
+                if line_idx == 0:
+                    if d.get("format") != RUN_MANIFEST_FORMAT or d.get("version") != RUN_MANIFEST_VERSION:
+                        raise ValueError("Not a run manifest (or unsupported version): '{}'".format(path))
+                    self.settings = d["settings"]
+                    continue
+                self.completed.extend(tuple(entry) for entry in d["completed"])
+                self.output_sizes = d["output_sizes"]
+        if self.settings is None:
+            raise ValueError("Incomplete run manifest: '{}'".format(path))
+
+    def check_settings(self, settings):
+        """
+        Raises `ValueError` if ``settings`` differ from those of the run.
+        """
+        settings = json.loads(json.dumps(settings))
+        mismatched = [key for key in set(settings) | set(self.settings) if settings.get(key, None) != self.settings.get(key, None)]
+        if mismatched:
+            raise ValueError("Run settings differ from those in manifest '{}': {}".format(
+                self.path,
+                ", ".join("{} ({} != {})".format(key, settings.get(key, None), self.settings.get(key, None)) for key in sorted(mismatched))))
+
+def truncate_output_file(filepath, size):
+    """
+    Truncates the file at ``filepath`` to ``size`` bytes, discarding output
+    written after the last batch recorded in the run manifest.
+    """
+    if os.path.getsize(filepath) < size:
+        raise ValueError("Output file shorter than recorded in run manifest: '{}'".format(filepath))
+    with open(filepath, "r+b") as dest:
+        dest.truncate(size)
@@ -13,11 +13,14 @@ import pprint
 import copy
 import json
 from distutils.util import strtobool
+import numpy
 import dendropy
+from dendropy.dataio import nexusprocessing
 
 from inphest import utility
 from inphest import revbayes
 from inphest import error
+from inphest import statisticgroups
 
 def weighted_choice(seq, weights, rng):
     """
@@ -176,6 +179,64 @@ class RateFunction(object):
         d["description"] = self.description
         return d
 
+class LineageDistanceMatrix(object):
+    """
+    Pairwise (normalized patristic) distances between host lineages, backed by
+    a square array so that it can be stored and memory-mapped directly.
+
+    Supports the nested look-up, ``m[lineage_id1][lineage_id2]``, of the
+    dictionary it replaces.
+    """
+
+    class _Row(object):
+
+        def __init__(self, matrix, row_idx):
+            self._matrix = matrix
+            self._row_idx = row_idx
+
+        def __getitem__(self, lineage_id):
+            return float(self._matrix.distances[self._row_idx, self._matrix.lineage_index[lineage_id]])
+
+        def __contains__(self, lineage_id):
+            return lineage_id in self._matrix.lineage_index
+
+        def __iter__(self):
+            return iter(self._matrix.lineage_ids)
+
+        def __len__(self):
+            return len(self._matrix.lineage_ids)
+
+        def keys(self):
+            return list(self._matrix.lineage_ids)
+
+        def items(self):
+            for lineage_id in self._matrix.lineage_ids:
+                yield lineage_id, self[lineage_id]
+
+    def __init__(self, lineage_ids, distances):
+        self.lineage_ids = list(lineage_ids)
+        self.lineage_index = dict((lineage_id, idx) for idx, lineage_id in enumerate(self.lineage_ids))
+        self.distances = distances
+        assert self.distances.shape == (len(self.lineage_ids), len(self.lineage_ids))
+
+    def __getitem__(self, lineage_id):
+        return LineageDistanceMatrix._Row(self, self.lineage_index[lineage_id])
+
+    def __contains__(self, lineage_id):
+        return lineage_id in self.lineage_index
+
+    def __iter__(self):
+        return iter(self.lineage_ids)
+
+    def __len__(self):
+        return len(self.lineage_ids)
+
+    def keys(self):
+        return list(self.lineage_ids)
+
+    def distance(self, lineage_id1, lineage_id2):
+        return float(self.distances[self.lineage_index[lineage_id1], self.lineage_index[lineage_id2]])
+
 class HostHistory(object):
     """
     A particular host history on which the symbiont history is conditioned.
@@ -209,6 +270,10 @@ class HostHistory(object):
         "child1_lineage_id",        #   split/edge id of second daughter (cladogenesis)
         ])
 
+    # so that host histories can be pickled (e.g., to pass to worker processes)
+    HostLineageDefinition.__qualname__ = "HostHistory.HostLineageDefinition"
+    HostEvent.__qualname__ = "HostHistory.HostEvent"
+
     def __init__(self, taxon_namespace=None,):
         if taxon_namespace is None:
             self.taxon_namespace = dendropy.TaxonNamespace()
@@ -218,37 +283,40 @@ class HostHistory(object):
         self.lineages = {} # keys: lineage_id (== int(Bipartition) == Bipartition.split_bitmask); values: HostLineageDefinition
         self.start_time = None
         self.end_time = None
+        self.sample_idx = None # index of this history in its source, if parsed from a collection of samples
 
-    def compile(self, tree, start_time, end_time):
+    def compile(self, tree, start_time, end_time, lineage_distance_matrix=None):
+        """
+        Binds the host tree to the lineage definitions and derives the
+        tree-based structures (lineage distances, extant leaves, area
+        assemblages). If ``lineage_distance_matrix`` is given (e.g., from a
+        compiled host history cache) it is used instead of being recalculated
+        from the tree.
+        """
         self.tree = tree
-        ndm = self.tree.node_distance_matrix()
-        self.lineage_distance_matrix = {}
         self.area_assemblage_leaf_sets = None
         self.extant_leaf_nodes = set()
-        for node1 in ndm:
+        for node1 in self.tree:
             key1 = int(node1.edge.bipartition.split_bitmask)
             assert key1 in self.lineages, key1
-            if key1 not in self.lineage_distance_matrix:
-                self.lineage_distance_matrix[key1] = {}
-                node1.lineage_definition = self.lineages[key1]
-                if node1.lineage_definition.is_extant_leaf:
-                    node1.taxon.is_extant_leaf = True
-                    self.extant_leaf_nodes.add(node1)
-                    for idx, presence in enumerate(node1.lineage_definition.lineage_end_distribution_bitstring):
-                        if self.area_assemblage_leaf_sets is None:
-                            self.area_assemblage_leaf_sets = [set() for i in range(len(node1.lineage_definition.lineage_end_distribution_bitstring))]
-                        else:
-                            assert len(self.area_assemblage_leaf_sets) == len(node1.lineage_definition.lineage_end_distribution_bitstring)
-                        if presence == "1":
-                            self.area_assemblage_leaf_sets[idx].add(node1)
-                        else:
-                            assert presence == "0"
-                elif node1.taxon is not None:
-                    node1.taxon.is_extant_leaf = False
-            for node2 in ndm:
-                key2 = int(node2.edge.bipartition.split_bitmask)
-                assert key2 in self.lineages
-                self.lineage_distance_matrix[key1][key2] = ndm.patristic_distance(node1, node2, is_normalize_by_tree_size=True)
+            node1.lineage_definition = self.lineages[key1]
+            if node1.lineage_definition.is_extant_leaf:
+                node1.taxon.is_extant_leaf = True
+                self.extant_leaf_nodes.add(node1)
+                for idx, presence in enumerate(node1.lineage_definition.lineage_end_distribution_bitstring):
+                    if self.area_assemblage_leaf_sets is None:
+                        self.area_assemblage_leaf_sets = [set() for i in range(len(node1.lineage_definition.lineage_end_distribution_bitstring))]
+                    else:
+                        assert len(self.area_assemblage_leaf_sets) == len(node1.lineage_definition.lineage_end_distribution_bitstring)
+                    if presence == "1":
+                        self.area_assemblage_leaf_sets[idx].add(node1)
+                    else:
+                        assert presence == "0"
+            elif node1.taxon is not None:
+                node1.taxon.is_extant_leaf = False
+        if lineage_distance_matrix is None:
+            lineage_distance_matrix = self.calc_lineage_distance_matrix()
+        self.lineage_distance_matrix = lineage_distance_matrix
         self.start_time = start_time
         self.end_time = end_time
         self.events.sort(key=lambda x: x.event_time, reverse=False)
@@ -256,6 +324,30 @@ class HostHistory(object):
             assert event.event_time >= self.start_time
             assert event.event_time <= self.end_time, "{} > {}".format(event.event_time, self.end_time)
 
+    @staticmethod
+    def calc_topology_key(tree):
+        """
+        Returns a hashable key identifying the topology and branch lengths of
+        ``tree`` (which must have its bipartitions encoded): two trees with
+        equal keys yield identical lineage distance matrices. The key is the
+        set of (split, edge length) pairs, qualified by the taxon labels that
+        give the split bitmasks their meaning.
+        """
+        return (
+                tuple(taxon.label for taxon in tree.taxon_namespace),
+                frozenset((int(edge.bipartition.split_bitmask), edge.length) for edge in tree.postorder_edge_iter()),
+                )
+
+    def calc_lineage_distance_matrix(self):
+        ndm = self.tree.node_distance_matrix()
+        nodes = list(ndm)
+        lineage_ids = [int(nd.edge.bipartition.split_bitmask) for nd in nodes]
+        distances = numpy.zeros((len(nodes), len(nodes)), dtype=numpy.float64)
+        for idx1, node1 in enumerate(nodes):
+            for idx2, node2 in enumerate(nodes):
+                distances[idx1, idx2] = ndm.patristic_distance(node1, node2, is_normalize_by_tree_size=True)
+        return LineageDistanceMatrix(lineage_ids=lineage_ids, distances=distances)
+
     def validate(self):
         ## Basically, runs through the histories for each edge/lineage,
         ## ensuring the history correctly reproduces the end state given the start state
@@ -299,96 +391,325 @@ class HostHistory(object):
             areas.append(area)
         return areas
 
+class HostHistorySampleSelection(object):
+    """
+    Specifies which of the host history samples in a source are to be used.
+
+    The selection filters are applied in the following order, with all
+    indexes referring to the (0-based) position of the sample in the source:
+
+        1.  The first ``burnin`` samples are discarded.
+        2.  Of the remaining samples, every ``thinning``-th sample is retained,
+            beginning with the first.
+        3.  If ``sample_indexes`` is given, only samples with indexes in this
+            collection are retained.
+        4.  If ``num_random_samples`` is given, this number of samples is
+            drawn at random without replacement from those retained (by
+            reservoir sampling), using a random number generator seeded with
+            ``random_seed``.
+
+    The retained samples are always returned in source order. Explicitly
+    requested sample indexes beyond the end of the source are an error.
+    """
+
+    def __init__(self,
+            burnin=0,
+            thinning=1,
+            sample_indexes=None,
+            num_random_samples=None,
+            random_seed=None):
+        self.burnin = int(burnin)
+        if self.burnin < 0:
+            raise ValueError("Burn-in must be non-negative: {}".format(burnin))
+        self.thinning = int(thinning)
+        if self.thinning < 1:
+            raise ValueError("Thinning stride must be a positive integer: {}".format(thinning))
+        if sample_indexes is None:
+            self.sample_indexes = None
+        else:
+            self.sample_indexes = sorted(set(int(idx) for idx in sample_indexes))
+            if self.sample_indexes and self.sample_indexes[0] < 0:
+                raise ValueError("Sample indexes must be non-negative: {}".format(self.sample_indexes[0]))
+        if num_random_samples is None:
+            self.num_random_samples = None
+        else:
+            self.num_random_samples = int(num_random_samples)
+            if self.num_random_samples < 1:
+                raise ValueError("Number of random samples must be a positive integer: {}".format(num_random_samples))
+        self.random_seed = random_seed
+        self._sample_indexes_set = None if self.sample_indexes is None else set(self.sample_indexes)
+
+    def __str__(self):
+        parts = []
+        if self.burnin:
+            parts.append("burn-in = {}".format(self.burnin))
+        if self.thinning > 1:
+            parts.append("thinning = {}".format(self.thinning))
+        if self.sample_indexes is not None:
+            parts.append("sample indexes = {}".format(self.sample_indexes))
+        if self.num_random_samples is not None:
+            parts.append("random samples = {} (seed = {})".format(self.num_random_samples, self.random_seed))
+        if not parts:
+            return "all samples"
+        return ", ".join(parts)
+
+    @property
+    def is_trivial(self):
+        return (self.burnin == 0
+                and self.thinning == 1
+                and self.sample_indexes is None
+                and self.num_random_samples is None)
+
+    @property
+    def is_reproducible(self):
+        return self.num_random_samples is None or self.random_seed is not None
+
+    def is_selected(self, sample_idx):
+        """
+        Returns `True` if sample ``sample_idx`` passes the burn-in, thinning
+        and explicit index filters (but not random subsampling).
+        """
+        if sample_idx < self.burnin:
+            return False
+        if (sample_idx - self.burnin) % self.thinning:
+            return False
+        if self._sample_indexes_set is not None and sample_idx not in self._sample_indexes_set:
+            return False
+        return True
+
+    def selected_iter(self, samples):
+        """
+        Iterates, in a single pass, over ``(sample_idx, sample)`` for samples
+        in ``samples`` that are selected, in source order, stopping as soon
+        as no further samples can be selected.
+
+        Random subsampling is carried out by reservoir sampling of the
+        samples that pass the other filters, so that only the (at most)
+        ``num_random_samples`` samples in the reservoir are held at any one
+        time, and the source need not be counted (or rewound) beforehand.
+
+        Raises `ValueError` if an explicitly-requested sample index is beyond
+        the end of ``samples``.
+        """
+        if self.sample_indexes is not None:
+            if not self.sample_indexes:
+                return
+            max_sample_idx = self.sample_indexes[-1]
+        else:
+            max_sample_idx = None
+        if self.num_random_samples is not None:
+            rng = random.Random(self.random_seed)
+            reservoir = []
+            num_candidates = 0
+        num_samples = 0
+        for sample_idx, sample in enumerate(samples):
+            num_samples = sample_idx + 1
+            if max_sample_idx is not None and sample_idx > max_sample_idx:
+                break
+            if not self.is_selected(sample_idx):
+                continue
+            if self.num_random_samples is None:
+                yield sample_idx, sample
+                continue
+            num_candidates += 1
+            if len(reservoir) < self.num_random_samples:
+                reservoir.append((sample_idx, sample))
+            else:
+                replaced_idx = rng.randrange(num_candidates)
+                if replaced_idx < self.num_random_samples:
+                    reservoir[replaced_idx] = (sample_idx, sample)
+        if max_sample_idx is not None and num_samples <= max_sample_idx:
+            raise ValueError("Sample index {} out of range: source has {} samples".format(max_sample_idx, num_samples))
+        if self.num_random_samples is not None:
+            reservoir.sort(key=lambda x: x[0])
+            for sample_idx, sample in reservoir:
+                yield sample_idx, sample
+
+    def select(self, num_samples):
+        """
+        Returns the (sorted) list of indexes of the samples selected from a
+        source with ``num_samples`` samples (the same as would be selected
+        by :meth:`selected_iter`).
+        """
+        return [sample_idx for sample_idx, sample in self.selected_iter(range(num_samples))]
+
+    def as_definition(self):
+        d = collections.OrderedDict()
+        d["burnin"] = self.burnin
+        d["thinning"] = self.thinning
+        d["sample_indexes"] = self.sample_indexes
+        d["num_random_samples"] = self.num_random_samples
+        d["random_seed"] = self.random_seed
+        return d
+
 class HostHistorySamples(object):
     """
     A collection of host histories, one a single one of each a particular symbiont history will be conditioned.
     """
 
+    # Bump whenever a change to parsing or compilation would change the
+    # resulting host histories: invalidates compiled host history caches.
+    PARSER_VERSION = 2
+
     def __init__(self):
         self.host_histories = []
+        self.taxon_namespace = dendropy.TaxonNamespace()
+        # Lineage distance matrices, keyed by host tree topology (see
+        # HostHistory.calc_topology_key()): posterior samples frequently
+        # share the same host tree, differing only in the mapped events, and
+        # these then share the (immutable) matrix rather than each
+        # recalculating and holding its own copy.
+        self.topology_lineage_distance_matrices = {}
+
+    def compile_host_history(self, host_history, tree, start_time, end_time):
+        """
+        Compiles ``host_history`` on ``tree``, reusing the lineage distance
+        matrix of a previously-compiled host history with the same host tree
+        topology if there is one.
+        """
+        topology_key = HostHistory.calc_topology_key(tree)
+        lineage_distance_matrix = self.topology_lineage_distance_matrices.get(topology_key, None)
+        host_history.compile(
+                tree=tree,
+                start_time=start_time,
+                end_time=end_time,
+                lineage_distance_matrix=lineage_distance_matrix,
+                )
+        if lineage_distance_matrix is None:
+            self.topology_lineage_distance_matrices[topology_key] = host_history.lineage_distance_matrix
 
     def parse_host_biogeography(self,
             src,
             schema,
             validate=True,
-            ignore_validation_errors=False):
+            ignore_validation_errors=False,
+            sample_selection=None):
+        """
+        Parses host histories from ``src``. If ``sample_selection`` (a
+        |HostHistorySampleSelection| object) is given, only the samples it
+        selects are parsed.
+        """
+        if sample_selection is not None and sample_selection.is_trivial:
+            sample_selection = None
         if schema == "revbayes":
             self.parse_rb_host_biogeography(src=src,
                     validate=validate,
-                    ignore_validation_errors=ignore_validation_errors)
+                    ignore_validation_errors=ignore_validation_errors,
+                    sample_selection=sample_selection)
         else:
             self.parse_archipelago_host_biogeography(src=src,
                     validate=validate,
-                    ignore_validation_errors=ignore_validation_errors)
+                    ignore_validation_errors=ignore_validation_errors,
+                    sample_selection=sample_selection)
 
     def parse_archipelago_host_biogeography(self,
             src,
             validate=True,
-            ignore_validation_errors=False):
-        data = json.load(src)
-        for history_sample in data:
-            taxon_namespace = dendropy.TaxonNamespace(history_sample["leaf_labels"])
-            host_history = HostHistory(taxon_namespace=taxon_namespace)
-            for lineage_d in history_sample["lineages"]:
-                lineage = HostHistory.HostLineageDefinition(
-                        lineage_id=lineage_d["lineage_id"],
-                        lineage_parent_id=lineage_d["lineage_parent_id"],
-                        leafset_bitstring=lineage_d["leafset_bitstring"],
-                        split_bitstring=lineage_d["split_bitstring"],
-                        lineage_start_time=lineage_d["lineage_start_time"],
-                        lineage_end_time=lineage_d["lineage_end_time"],
-                        lineage_start_distribution_bitstring=lineage_d["lineage_start_distribution_bitstring"],
-                        lineage_end_distribution_bitstring=lineage_d["lineage_end_distribution_bitstring"],
-                        is_seed_node=lineage_d["is_seed_node"],
-                        is_leaf=lineage_d["is_leaf"],
-                        is_extant_leaf=lineage_d["is_extant_leaf"],
-                        )
-                assert lineage.lineage_id not in host_history.lineages
-                assert lineage.lineage_start_time <= lineage.lineage_end_time, "{}, {}".format(lineage.lineage_start_time, lineage.lineage_end_time)
-                host_history.lineages[lineage.lineage_id] = lineage
-            for event_d in history_sample["events"]:
-                # if event_d["event_type"] == "extinction":
-                #     continue
-                if event_d["event_type"] == "trait_evolution":
-                    continue
-                event = HostHistory.HostEvent(
-                    event_time=event_d["event_time"],
-                    weight=1.0,
-                    lineage_id=event_d["lineage_id"],
-                    event_type=event_d["event_type"],
-                    event_subtype=event_d["event_subtype"],
-                    area_idx=event_d.get("state_idx", None),
-                    child0_lineage_id=event_d.get("child0_lineage_id", None),
-                    child1_lineage_id=event_d.get("child1_lineage_id", None),
-                    )
-                assert event.lineage_id in host_history.lineages
-                host_history.events.append(event)
-            host_tree = dendropy.Tree.get(
-                    data=history_sample["tree"]["newick"],
-                    schema="newick",
-                    rooting="force-rooted",
-                    taxon_namespace=taxon_namespace,
-                    )
-            host_tree.encode_bipartitions()
-            # host_tree = None
-            host_history.compile(
-                tree=host_tree,
-                start_time=0.0,
-                end_time=history_sample["tree"]["end_time"],
-                )
+            ignore_validation_errors=False,
+            sample_selection=None):
+        """
+        Reads host histories from the output of Archipelago. The source is
+        decoded incrementally, with each history sample built and compiled as
+        soon as it is read, so that only a single raw history sample (or, with
+        random subsampling, only the samples drawn so far) is held in memory
+        at any one time. The source is read in a single pass, and so need not
+        be seekable (e.g., a pipe or a compressed stream).
+        """
+        if sample_selection is not None:
+            selected_history_samples = sample_selection.selected_iter(utility.JsonArrayStreamReader(src))
+        else:
+            selected_history_samples = enumerate(utility.JsonArrayStreamReader(src))
+        for sample_idx, history_sample in selected_history_samples:
+            host_history = self._build_archipelago_host_history(
+                    sample_idx=sample_idx,
+                    history_sample=history_sample)
             if validate:
                 host_history.validate()
             self.host_histories.append(host_history)
 
+    def _build_archipelago_host_history(self, sample_idx, history_sample):
+        taxon_namespace = dendropy.TaxonNamespace(history_sample["leaf_labels"])
+        host_history = HostHistory(taxon_namespace=taxon_namespace)
+        host_history.sample_idx = sample_idx
+        for lineage_d in history_sample["lineages"]:
+            lineage = HostHistory.HostLineageDefinition(
+                    lineage_id=lineage_d["lineage_id"],
+                    lineage_parent_id=lineage_d["lineage_parent_id"],
+                    leafset_bitstring=lineage_d["leafset_bitstring"],
+                    split_bitstring=lineage_d["split_bitstring"],
+                    lineage_start_time=lineage_d["lineage_start_time"],
+                    lineage_end_time=lineage_d["lineage_end_time"],
+                    lineage_start_distribution_bitstring=lineage_d["lineage_start_distribution_bitstring"],
+                    lineage_end_distribution_bitstring=lineage_d["lineage_end_distribution_bitstring"],
+                    is_seed_node=lineage_d["is_seed_node"],
+                    is_leaf=lineage_d["is_leaf"],
+                    is_extant_leaf=lineage_d["is_extant_leaf"],
+                    )
+            assert lineage.lineage_id not in host_history.lineages
+            assert lineage.lineage_start_time <= lineage.lineage_end_time, "{}, {}".format(lineage.lineage_start_time, lineage.lineage_end_time)
+            host_history.lineages[lineage.lineage_id] = lineage
+        for event_d in history_sample["events"]:
+            # if event_d["event_type"] == "extinction":
+            #     continue
+            if event_d["event_type"] == "trait_evolution":
+                continue
+            event = HostHistory.HostEvent(
+                event_time=event_d["event_time"],
+                weight=1.0,
+                lineage_id=event_d["lineage_id"],
+                event_type=event_d["event_type"],
+                event_subtype=event_d["event_subtype"],
+                area_idx=event_d.get("state_idx", None),
+                child0_lineage_id=event_d.get("child0_lineage_id", None),
+                child1_lineage_id=event_d.get("child1_lineage_id", None),
+                )
+            assert event.lineage_id in host_history.lineages
+            host_history.events.append(event)
+        host_tree = dendropy.Tree.get(
+                data=history_sample["tree"]["newick"],
+                schema="newick",
+                rooting="force-rooted",
+                taxon_namespace=taxon_namespace,
+                )
+        host_tree.encode_bipartitions()
+        # host_tree = None
+        self.compile_host_history(
+            host_history=host_history,
+            tree=host_tree,
+            start_time=0.0,
+            end_time=history_sample["tree"]["end_time"],
+            )
+        return host_history
+
     def parse_rb_host_biogeography(self,
             src,
             validate=True,
-            ignore_validation_errors=False):
+            ignore_validation_errors=False,
+            sample_selection=None):
         """
         Reads the output of RevBayes biogeographical history.
         """
         rb = revbayes.RevBayesBiogeographyParser(taxon_namespace=self.taxon_namespace)
-        rb.parse(src)
+        rb.parse(src, sample_selection=sample_selection)
+        self._build_rb_host_histories(rb=rb, validate=validate)
+
+    def load_rb_host_biogeography_database(self,
+            filepath,
+            sample_indexes=None,
+            validate=True):
+        """
+        Reads host histories from a SQLite database of parsed RevBayes
+        biogeographical history samples (as written by
+        |RevBayesBiogeographyParser.serialize_database|). If
+        ``sample_indexes`` is given, only those samples are loaded, without
+        reading any of the others.
+        """
+        rb = revbayes.RevBayesBiogeographyParser(taxon_namespace=self.taxon_namespace)
+        rb.load_database(filepath, tree_idxs=sample_indexes)
+        self._build_rb_host_histories(rb=rb, validate=validate)
+
+    def _build_rb_host_histories(self, rb, validate):
+        tree_entries = dict((tree_entry["tree_idx"], tree_entry) for tree_entry in rb.tree_entries)
 
         # total_tree_ln_likelihoods = 0.0
         # for tree_entry in rb.tree_entries:
@@ -402,6 +723,7 @@ class HostHistorySamples(object):
             tree_idx = edge_entry["tree_idx"]
             if tree_idx not in tree_host_histories:
                 tree_host_histories[tree_idx] = HostHistory(taxon_namespace=self.taxon_namespace)
+                tree_host_histories[tree_idx].sample_idx = tree_idx
             lineage_id = edge_entry["edge_id"]
             lineage = HostHistory.HostLineageDefinition(
                     # tree_idx=edge_entry["tree_idx"],
@@ -430,6 +752,7 @@ class HostHistorySamples(object):
             tree_idx = event_entry["tree_idx"]
             if tree_idx not in tree_host_histories:
                 tree_host_histories[tree_idx] = HostHistory(taxon_namespace=self.taxon_namespace)
+                tree_host_histories[tree_idx].sample_idx = tree_idx
             event = HostHistory.HostEvent(
                 # tree_idx=event_entry["tree_idx"],
                 event_time=event_entry["time"],
@@ -445,11 +768,12 @@ class HostHistorySamples(object):
             assert event.lineage_id in tree_host_histories[tree_idx].lineages
             tree_host_histories[tree_idx].events.append(event)
 
-        for tree_idx in tree_host_histories:
+        for tree_idx in sorted(tree_host_histories):
             host_history = tree_host_histories[tree_idx]
-            end_time = max(rb.tree_entries[tree_idx]["seed_node_age"], rb.max_event_times[tree_idx])
-            host_history.compile(
-                    tree=rb.tree_entries[tree_idx]["tree"],
+            end_time = max(tree_entries[tree_idx]["seed_node_age"], rb.max_event_times[tree_idx])
+            self.compile_host_history(
+                    host_history=host_history,
+                    tree=tree_entries[tree_idx]["tree"],
                     start_time=0.0,
                     end_time=end_time,
                     )
@@ -465,8 +789,8 @@ class Area(object):
 
     def __init__(self, area_idx):
         self.area_idx = area_idx
-        self.host_lineages = set()
-        self.symbiont_lineages = set()
+        self.host_lineages = utility.OrderedSet()
+        self.symbiont_lineages = utility.OrderedSet()
 
     def __str__(self):
         return "Area{}".format(self.area_idx)
@@ -498,13 +822,22 @@ class HostLineage(object):
         self.is_seed_node = host_history_lineage_definition.is_seed_node
         self.is_leaf = host_history_lineage_definition.is_leaf
         self.is_extant_leaf = host_history_lineage_definition.is_extant_leaf
-        self._current_areas = set()
-        self.extancy = "pre"
-        self.debug_mode = False
+        self.reset()
 
     def __str__(self):
         return str(self.lineage_id)
 
+    def reset(self):
+        """
+        Returns the lineage to its state before the start of a simulation
+        replicate.
+        """
+        self._current_areas = utility.OrderedSet()
+        self.extancy = "pre"
+        self.debug_mode = False
+        self.is_post_area_gain = False
+        self._current_distribution_check_bitlist = None
+
     def activate(self, simulation_elapsed_time=None, debug_mode=None):
         assert self.extancy == "pre"
         if debug_mode is not None:
@@ -534,7 +867,7 @@ class HostLineage(object):
         assert self.extancy == "current"
         for area in self._current_areas:
             area.host_lineages.remove(self)
-        self._current_areas = set()
+        self._current_areas = utility.OrderedSet()
         self.extancy = "post"
 
     def add_area(self, area):
@@ -704,6 +1037,20 @@ class HostSystem(object):
                 host_to_symbiont_time_scale_factor=host_to_symbiont_time_scale_factor,
                 debug_mode=debug_mode,
                 )
+        self.reset()
+
+    def reset(self):
+        """
+        Returns the host system to its state before the start of a simulation
+        replicate, so that it can be reused by the next replicate (or restart)
+        on the same host history rather than compiled again.
+        """
+        for host_lineage in self.host_lineages:
+            host_lineage.reset()
+        for area in self.areas:
+            area.host_lineages = utility.OrderedSet()
+            area.symbiont_lineages = utility.OrderedSet()
+        self.host_events = list(self.compiled_host_events)
         self._next_host_event = None
 
     def compile(self, host_history, host_to_symbiont_time_scale_factor, debug_mode=False):
@@ -725,10 +1072,10 @@ class HostSystem(object):
         #         self.area_host_symbiont_host_area_distribution[area][host_lineage] = {}
 
         # compile lineages
-        self.host_lineages = set()
+        self.host_lineages = utility.OrderedSet()
         self.host_lineages_by_id = {}
-        self.leaf_host_lineages = set()
-        self.extant_leaf_host_lineages = set()
+        self.leaf_host_lineages = utility.OrderedSet()
+        self.extant_leaf_host_lineages = utility.OrderedSet()
         self.seed_host_lineage = None
         for host_history_lineage_id_definition in self.host_history.lineages.values():
             host = HostLineage(
@@ -746,9 +1093,10 @@ class HostSystem(object):
             if host.is_extant_leaf:
                 self.extant_leaf_host_lineages.add(host)
 
-        # local copy of host events
+        # local copy of host events (with times scaled), from which the
+        # queue of host events of each replicate is copied
         # self.host_events = list(self.host_history.events)
-        self.host_events = []
+        self.compiled_host_events = []
         for event in self.host_history.events:
             event_copy = HostHistory.HostEvent(
                 event_time=event.event_time * self.host_to_symbiont_time_scale_factor,
@@ -760,7 +1108,7 @@ class HostSystem(object):
                 child0_lineage_id=event.child0_lineage_id,
                 child1_lineage_id=event.child1_lineage_id,
                 )
-            self.host_events.append(event_copy)
+            self.compiled_host_events.append(event_copy)
 
     def extant_host_lineages_at_current_time(self, current_time):
         ## TODO: if we hit this often, we need to construct a look-up table
@@ -806,8 +1154,8 @@ class SymbiontLineage(dendropy.Node):
                 self._host_area_distribution[host_lineage][area] = 0
 
         ## For quick look-up if host/area is infected
-        self._infected_hosts = set()
-        self._infected_areas = set()
+        self._infected_hosts = utility.OrderedSet()
+        self._infected_areas = utility.OrderedSet()
 
     def host_occurrences_bitstring(self):
         s = []
@@ -960,8 +1308,8 @@ class SymbiontLineage(dendropy.Node):
                 self._host_area_distribution[host_lineage][area] = 0
         for area in self._infected_areas:
             area.symbiont_lineages.remove(self)
-        self._infected_hosts = set()
-        self._infected_areas = set()
+        self._infected_hosts = utility.OrderedSet()
+        self._infected_areas = utility.OrderedSet()
 
     def update_distribution(self, other):
         """
@@ -1018,6 +1366,11 @@ class SymbiontPhylogeny(dendropy.Tree):
         self.model_id = self.model.model_id
         self.host_system = kwargs.pop("host_system")
         self.annotations.add_bound_attribute("model_id")
+        # allows the host history to be identified when summarizing trees
+        # separately from the simulation
+        self.host_history_sample_idx = self.host_system.host_history.sample_idx
+        if self.host_history_sample_idx is not None:
+            self.annotations.add_bound_attribute("host_history_sample_idx")
         self.rng = kwargs.pop("rng")
         self.debug_mode = kwargs.pop("debug_mode")
         self.run_logger = kwargs.pop("run_logger")
@@ -1029,7 +1382,7 @@ class SymbiontPhylogeny(dendropy.Tree):
                     )
             kwargs["seed_node"] = seed_node
         dendropy.Tree.__init__(self, *args, **kwargs)
-        self.current_lineages = set([self.seed_node])
+        self.current_lineages = utility.OrderedSet([self.seed_node])
 
     def __deepcopy__(self, memo=None):
         raise NotImplementedError
@@ -1103,6 +1456,83 @@ class SymbiontPhylogeny(dendropy.Tree):
         # self.run_logger.info("Total extinction: {}".format(msg))
         raise error.TotalExtinctionException(msg)
 
+    def write_newick(self,
+            out,
+            host_lineages=None,
+            suppress_internal_node_labels=True):
+        """
+        Writes the phylogeny to ``out`` as a NEWICK tree statement, preceded
+        by the tree annotations (model and host history identifiers) as a
+        comment.
+
+        If ``host_lineages`` is given, each leaf is labeled with its host and
+        area occurrences (see |InphestModel.compose_encoded_label|), the host
+        occurrence bits being in the order of ``host_lineages`` (which, for
+        the labels to be decoded, should be the extant leaf host lineages in
+        order of lineage id, i.e., host tree taxon order) and the area
+        occurrence bits in order of area index; otherwise each leaf is
+        labeled ``s<index>``. Internal nodes are labeled ``s<index>`` unless
+        ``suppress_internal_node_labels`` is `True`.
+
+        The occurrences of each leaf are collected as bitmasks from the hosts
+        and areas it occupies, rather than by querying every host, and the
+        tree is traversed iteratively (so that its depth is not limited by
+        the recursion limit), with each element written to ``out`` as it is
+        composed.
+        """
+        if host_lineages is not None:
+            host_positions = dict((host_lineage, position) for position, host_lineage in enumerate(host_lineages))
+            num_hosts = len(host_lineages)
+            num_areas = self.host_system.num_areas
+        if not self.rooting_state_is_undefined:
+            out.write("[&R] " if self.is_rooted else "[&U] ")
+        out.write(nexusprocessing.format_item_annotations_as_comments(self))
+        # nodes are pushed twice: once to be opened (or, if leaves, written),
+        # and, if internal, once more to be closed once their children have
+        # been written
+        stack = [(self.seed_node, False)]
+        while stack:
+            node, is_closing = stack.pop()
+            if is_closing:
+                out.write(")")
+                if not suppress_internal_node_labels:
+                    out.write("s{}".format(node.index))
+            else:
+                if node._parent_node is not None and node._parent_node._child_nodes[0] is not node:
+                    out.write(",")
+                if node._child_nodes:
+                    out.write("(")
+                    stack.append((node, True))
+                    for child_node in reversed(node._child_nodes):
+                        stack.append((child_node, False))
+                    continue
+                if host_lineages is None:
+                    out.write("s{}".format(node.index))
+                else:
+                    assert node._infected_hosts
+                    host_occurrences = 0
+                    for host_lineage in node._infected_hosts:
+                        position = host_positions.get(host_lineage, None)
+                        if position is not None:
+                            host_occurrences |= 1 << position
+                    assert host_occurrences
+                    area_occurrences = 0
+                    for area in node._infected_areas:
+                        area_occurrences |= 1 << area.area_idx
+                    out.write(InphestModel.compose_encoded_label(
+                            lineage_index=node.index,
+                            host_occurrences_bitstring=SymbiontPhylogeny._format_occurrences_bitmask(host_occurrences, num_hosts),
+                            area_occurrences_bitstring=SymbiontPhylogeny._format_occurrences_bitmask(area_occurrences, num_areas),
+                            ))
+            if node.edge.length is not None:
+                out.write(":{}".format(node.edge.length))
+        out.write(";\n")
+
+    @staticmethod
+    def _format_occurrences_bitmask(occurrences, num_positions):
+        # bit i of the mask is character i of the bitstring
+        return "{:0{}b}".format(occurrences, num_positions)[::-1]
+
     # def evolve_trait(self, lineage, trait_idx, state_idx):
     #     lineage.traits_vector[trait_idx] = state_idx
 
@@ -1209,38 +1639,34 @@ class InphestModel(object):
         return archipelago_model
 
     @staticmethod
-    def compose_encoded_label(symbiont_lineage):
-        return "s{lineage_index}{sep}{host_occurrences}".format(
-                lineage_index=symbiont_lineage.index,
+    def compose_encoded_label(
+            lineage_index,
+            host_occurrences_bitstring,
+            area_occurrences_bitstring):
+        """
+        Returns a label of the form ``s<idx>^<host bits>^<area bits>``, where
+        the host bits give the occurrence of the lineage in each of the extant
+        host lineages (in order of host lineage id, i.e., host tree taxon
+        order) and the area bits its occurrence in each area.
+        """
+        return "s{lineage_index}{sep}{host_occurrences}{sep}{area_occurrences}".format(
+                lineage_index=lineage_index,
                 sep=InphestModel._LABEL_COMPONENTS_SEPARATOR,
-                host_occurrences=symbiont_lineage.host_occurrences_bitstring(),
+                host_occurrences=host_occurrences_bitstring,
+                area_occurrences=area_occurrences_bitstring,
                 )
-        return encoding
 
     @staticmethod
     def decode_label(label):
-        raise NotImplementedError
-        # parts = label.split(ArchipelagoModel._LABEL_COMPONENTS_SEPARATOR)
-        # traits_string = parts[1]
-        # if not traits_string or traits_string == ArchipelagoModel._NULL_TRAITS:
-        #     traits_vector = StatesVector(nchar=0)
-        # else:
-        #     traits_string_parts = traits_string.split(ArchipelagoModel._TRAITS_SEPARATOR)
-        #     traits_vector = StatesVector(
-        #             nchar=len(traits_string_parts),
-        #             # The trait states need to be an integer if
-        #             # archipelago-summarize.py coerces the user input to
-        #             # integers
-        #             # values=[int(i) for i in traits_string_parts],
-        #             # The reason we do NOT want it parsed to an integer value
-        #             # is to allow null traits 'NA', 'null', etc.
-        #             values=[i for i in traits_string_parts],
-        #             )
-        # distribution_string = parts[2]
-        # distribution_vector = DistributionVector(
-        #         num_areas=len(distribution_string),
-        #         values=[int(i) for i in distribution_string],)
-        # return traits_vector, distribution_vector
+        """
+        Returns a tuple of the lineage index, host occurrences bitstring and
+        area occurrences bitstring encoded in ``label`` (see
+        :meth:`compose_encoded_label`).
+        """
+        parts = label.split(InphestModel._LABEL_COMPONENTS_SEPARATOR)
+        if len(parts) != 3 or not parts[0].startswith("s"):
+            raise ValueError("Label does not encode host and area occurrences: '{}'".format(label))
+        return int(parts[0][1:]), parts[1], parts[2]
 
     @staticmethod
     def set_lineage_data(
@@ -1446,6 +1872,21 @@ class InphestModel(object):
             run_logger.info("(CLADOGENETIC GEOGRAPHICAL RANGE EVOLUTION) Base weight of widespread vicariance speciation mode: {}".format(self.symbiont_cladogenesis_widespread_vicariance_speciation_weight))
             run_logger.info("(CLADOGENETIC GEOGRAPHICAL RANGE EVOLUTION) Base weight of founder event speciation ('jump dispersal') mode: {} (note that the effective weight of this event for each lineage is actually the product of this and the lineage-specific area gain weight)".format(self.symbiont_cladogenesis_founder_event_speciation_weight))
 
+        # Summary Statistics
+        summary_statistics_d = dict(model_definition.pop("summary_statistics", {}))
+        statistic_groups = summary_statistics_d.pop("statistic_groups", None)
+        if statistic_groups is None:
+            self.summary_statistic_groups = None
+        else:
+            if isinstance(statistic_groups, str):
+                statistic_groups = [statistic_groups]
+            self.summary_statistic_groups = statisticgroups.validate_statistic_groups(statistic_groups)
+        if summary_statistics_d:
+            raise TypeError("Unsupported keywords in summary statistics specification: {}".format(summary_statistics_d))
+        if run_logger is not None:
+            run_logger.info("(SUMMARY STATISTICS) Summary statistic groups: {}".format(
+                ", ".join(self.summary_statistic_groups) if self.summary_statistic_groups is not None else "default"))
+
         if model_definition:
             raise TypeError("Unsupported model keywords: {}".format(model_definition))
 
@@ -1481,6 +1922,8 @@ class InphestModel(object):
         model_definition["cladogenetic_host_assemblage_evolution"] = self.cladogenetic_host_assemblage_evolution_as_definition()
         model_definition["anagenetic_geographical_range_evolution"] = self.anagenetic_geographical_range_evolution_as_definition()
         model_definition["cladogenetic_geographical_range_evolution"] = self.cladogenetic_geographical_range_evolution_as_definition()
+        if self.summary_statistic_groups is not None:
+            model_definition["summary_statistics"] = self.summary_statistics_as_definition()
         json.dump(model_definition, out, indent=4, separators=(',', ': '))
         out.flush()
 
@@ -1524,3 +1967,7 @@ class InphestModel(object):
         d["founder_event_speciation_weight"] = self.symbiont_cladogenesis_founder_event_speciation_weight
         return d
 
+    def summary_statistics_as_definition(self):
+        d = collections.OrderedDict()
+        d["statistic_groups"] = list(self.summary_statistic_groups)
+        return d
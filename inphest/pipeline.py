@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Asynchronous calculation of summary statistics.
+
+Completed symbiont phylogenies are submitted (as compact
+|summarize.SymbiontPhylogenySample| objects) to a bounded task queue,
+from which a pool of worker processes calculates the summary statistics,
+while the simulation proceeds with the next replicate. Results are
+collected in the parent process, which writes the summary statistics rows
+together with the corresponding trees (so that the two remain in
+correspondence), and reports the keys of the tasks that failed (with a
+|error.PostTerminationFailedSimulationException|) so that the
+corresponding replicates can be restarted.
+"""
+
+import collections
+import itertools
+import multiprocessing
+import traceback
+try:
+    import queue
+except ImportError:
+    import Queue as queue # Python 2
+
+from inphest import summarize
+from inphest import utility
+from inphest import error
+
+def _run_summary_stats_worker(
+        host_histories,
+        host_references,
+        summary_stats_config_d,
+        debug_mode,
+        task_queue,
+        result_queue):
+    summary_stats_calculators = {}
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, host_history_idx, symbiont_phylogeny_sample, statistic_groups, random_seed = task
+        try:
+            try:
+                summary_stats_calculator = summary_stats_calculators[host_history_idx]
+            except KeyError:
+                summary_stats_calculator = summarize.SummaryStatsCalculator(
+                        host_history=host_histories[host_history_idx],
+                        debug_mode=debug_mode,
+                        config_d=summary_stats_config_d,
+                        host_references=host_references[host_history_idx] if host_references is not None else None,
+                        )
+                summary_stats_calculators[host_history_idx] = summary_stats_calculator
+            ss = summary_stats_calculator.calculate_for_sample(
+                    symbiont_phylogeny_sample=symbiont_phylogeny_sample,
+                    statistic_groups=statistic_groups,
+                    random_seed=random_seed)
+        except error.PostTerminationFailedSimulationException as e:
+            result_queue.put(("failed", task_id, e))
+        except Exception:
+            result_queue.put(("error", task_id, traceback.format_exc()))
+        else:
+            result_queue.put(("completed", task_id, ss))
+    statistic_group_costs = [summary_stats_calculator.statistic_group_costs for summary_stats_calculator in summary_stats_calculators.values()]
+    result_queue.put(("finished", None, statistic_group_costs))
+
+class SummaryStatsPipeline(object):
+
+    def __init__(self,
+            host_histories,
+            num_workers,
+            trees_file,
+            summary_stats_file,
+            failed_trees_file=None,
+            max_queue_size=None,
+            summary_stats_config_d=None,
+            debug_mode=False,
+            host_references=None,
+            output_sink=None,
+            is_summary_stats_header_written=False):
+        """
+        Parameters
+        ----------
+        host_histories : list of |model.HostHistory|
+            The host histories on which the symbiont phylogenies submitted
+            will have been simulated.
+        num_workers : int
+            Number of worker processes calculating summary statistics.
+        trees_file : file-like object
+            Destination for trees whose summary statistics have been
+            successfully calculated.
+        summary_stats_file : file-like object
+            Destination for summary statistics.
+        failed_trees_file : file-like object or None
+            If given, destination for trees whose summary statistics could not
+            be calculated.
+        max_queue_size : int or None
+            Maximum number of symbiont phylogenies awaiting calculation; once
+            reached, submission blocks until a worker becomes free. Defaults
+            to twice the number of workers.
+        summary_stats_config_d : dict
+            Summary statistics calculator configuration.
+        host_references : list of |summarize.HostReferenceStructures| or None
+            If given, the precomputed host-side reference structures for each
+            of ``host_histories`` (in the same order), shared by the workers
+            instead of being computed by each of them.
+        output_sink : |utility.BufferedOutputSink| or None
+            Sink through which the summary statistics and trees are written
+            out, each row together with its tree as one record; if not given,
+            each record is written out as soon as it is complete.
+        is_summary_stats_header_written : bool
+            If `True`, ``summary_stats_file`` already has its header (e.g.,
+            when resuming a run).
+        """
+        if num_workers < 1:
+            raise ValueError("At least one summary statistics worker is required")
+        if max_queue_size is None:
+            max_queue_size = 2 * num_workers
+        self.trees_file = trees_file
+        self.summary_stats_file = summary_stats_file
+        self.failed_trees_file = failed_trees_file
+        if output_sink is None:
+            output_sink = utility.BufferedOutputSink()
+        self.output_sink = output_sink
+        self.is_summary_stats_header_written = is_summary_stats_header_written
+        self.host_history_indexes = dict((id(host_history), idx) for idx, host_history in enumerate(host_histories))
+        self.task_queue = multiprocessing.Queue(max_queue_size)
+        self.result_queue = multiprocessing.Queue()
+        self.pending_tasks = {}
+        self.completed_task_keys = []
+        self.failures = []
+        self.task_ids = itertools.count()
+        self.statistic_group_costs = collections.OrderedDict()
+        self.workers = []
+        for worker_idx in range(num_workers):
+            worker = multiprocessing.Process(
+                    target=_run_summary_stats_worker,
+                    args=(host_histories, host_references, summary_stats_config_d, debug_mode, self.task_queue, self.result_queue),
+                    )
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.num_running_workers = num_workers
+
+    def __len__(self):
+        return len(self.pending_tasks)
+
+    def submit(self,
+            task_key,
+            host_history,
+            symbiont_phylogeny_sample,
+            statistic_groups,
+            model_id,
+            tree_str,
+            record_items=None,
+            random_seed=None):
+        """
+        Queues ``symbiont_phylogeny_sample`` for calculation of its summary
+        statistics, blocking (while collecting completed tasks) as long as the
+        queue is full. If given, ``record_items`` is a list of ``(destination,
+        item)`` tuples (e.g., trees index and run manifest entries) written
+        out together with ``tree_str`` once the summary statistics have been
+        calculated, and ``random_seed`` seeds the randomizations of the
+        standardized effect sizes (see
+        |summarize.SummaryStatsCalculator.calculate|), so that the results do
+        not depend on which worker calculates them, or in what order.
+        """
+        task_id = next(self.task_ids)
+        self.pending_tasks[task_id] = (task_key, model_id, tree_str, record_items)
+        task = (task_id, self.host_history_indexes[id(host_history)], symbiont_phylogeny_sample, statistic_groups, random_seed)
+        while True:
+            try:
+                self.task_queue.put(task, timeout=0.1)
+                break
+            except queue.Full:
+                self._collect_results(timeout=0)
+                self._check_workers()
+
+    def collect(self, timeout=None):
+        """
+        Writes out the results of completed tasks. If ``timeout`` is `None`,
+        waits until at least one task is completed (unless there are no
+        pending tasks); otherwise, waits no more than ``timeout`` seconds.
+        Returns (and clears) the list of keys of the tasks that have been
+        completed and the list of ``(task_key, exception)`` tuples for the
+        tasks that have failed since last collected.
+        """
+        self._collect_results(timeout=timeout)
+        return self._pop_outcomes()
+
+    def drain(self):
+        """
+        Waits for all pending tasks to complete. Returns the same as
+        :meth:`collect`.
+        """
+        while self.pending_tasks:
+            self._collect_results()
+        return self._pop_outcomes()
+
+    def close(self):
+        """
+        Waits for all pending tasks to complete and shuts down the workers.
+        Returns the same as :meth:`collect`.
+        """
+        while self.pending_tasks:
+            self._collect_results()
+        for worker in self.workers:
+            self.task_queue.put(None)
+        while self.num_running_workers:
+            try:
+                message = self.result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    break
+                continue
+            self._process_result(message)
+        for worker in self.workers:
+            worker.join()
+        self.output_sink.flush()
+        return self._pop_outcomes()
+
+    def _pop_outcomes(self):
+        completed_task_keys = self.completed_task_keys
+        failures = self.failures
+        self.completed_task_keys = []
+        self.failures = []
+        return completed_task_keys, failures
+
+    def _collect_results(self, timeout=None):
+        num_collected = 0
+        while self.pending_tasks:
+            try:
+                if num_collected:
+                    message = self.result_queue.get_nowait()
+                elif timeout is None:
+                    message = self.result_queue.get(timeout=1.0)
+                elif timeout > 0:
+                    message = self.result_queue.get(timeout=timeout)
+                else:
+                    message = self.result_queue.get_nowait()
+            except queue.Empty:
+                if timeout is None and not num_collected:
+                    self._check_workers()
+                    continue
+                break
+            self._process_result(message)
+            num_collected += 1
+
+    def _check_workers(self):
+        if not all(worker.is_alive() for worker in self.workers):
+            raise RuntimeError("Summary statistics worker process terminated unexpectedly")
+
+    def _process_result(self, message):
+        message_type, task_id, payload = message
+        if message_type == "finished":
+            summarize.SummaryStatsCalculator.merge_statistic_group_costs(payload, self.statistic_group_costs)
+            self.num_running_workers -= 1
+            return
+        task_key, model_id, tree_str, record_items = self.pending_tasks.pop(task_id)
+        if message_type == "completed":
+            ss = payload
+            if getattr(self.summary_stats_file, "is_batch_destination", False):
+                # binary columnar store: no formatting needed
+                self.output_sink.write(self.summary_stats_file, (model_id, ss))
+            else:
+                if not self.is_summary_stats_header_written:
+                    header = ["model.id"] + list(ss.keys())
+                    self.output_sink.write(self.summary_stats_file, ",".join(header) + "\n")
+                    self.is_summary_stats_header_written = True
+                self.output_sink.write(self.summary_stats_file, "{},{}\n".format(
+                    model_id,
+                    ",".join("{}".format(ss[k]) for k in ss)))
+            if self.trees_file is not None:
+                self.output_sink.write(self.trees_file, tree_str)
+            for dest, item in record_items or ():
+                self.output_sink.write(dest, item)
+            self.output_sink.end_record()
+            self.completed_task_keys.append(task_key)
+        elif message_type == "failed":
+            if self.failed_trees_file is not None:
+                self.output_sink.write(self.failed_trees_file, tree_str)
+                self.output_sink.end_record()
+            self.failures.append((task_key, payload))
+        else:
+            raise RuntimeError("Summary statistics calculation failed:\n{}".format(payload))
@@ -19,7 +19,9 @@ import sys
 import csv
 import collections
 import re
+import sqlite3
 import dendropy
+from inphest import utility
 
 class RevBayesBiogeographyParser(object):
 
@@ -51,6 +53,58 @@ class RevBayesBiogeographyParser(object):
             "child1_edge_id",
             )
     NULL_VALUE = "NA"
+    DATABASE_SCHEMA = """
+        DROP TABLE IF EXISTS taxa;
+        DROP TABLE IF EXISTS trees;
+        DROP TABLE IF EXISTS edges;
+        DROP TABLE IF EXISTS events;
+        CREATE TABLE taxa (
+            taxon_idx INTEGER PRIMARY KEY,
+            label TEXT
+        );
+        CREATE TABLE trees (
+            tree_idx INTEGER PRIMARY KEY,
+            iteration REAL,
+            posterior REAL,
+            ln_likelihood REAL,
+            prior REAL,
+            seed_node_age REAL,
+            max_event_time REAL,
+            newick TEXT
+        );
+        CREATE TABLE edges (
+            tree_idx INTEGER,
+            edge_id TEXT,
+            parent_edge_id TEXT,
+            split_bitstring TEXT,
+            leafset_bitstring TEXT,
+            edge_start_time REAL,
+            edge_end_time REAL,
+            edge_duration REAL,
+            edge_starting_state TEXT,
+            edge_ending_state TEXT,
+            child0_edge_id TEXT,
+            child1_edge_id TEXT,
+            edge_cladogenetic_speciation_mode TEXT,
+            rb_index TEXT,
+            is_seed_node INTEGER,
+            is_leaf INTEGER
+        );
+        CREATE TABLE events (
+            tree_idx INTEGER,
+            edge_id TEXT,
+            time REAL,
+            event_type TEXT,
+            event_subtype TEXT,
+            area_idx INTEGER,
+            child0_edge_id TEXT,
+            child1_edge_id TEXT
+        );
+        CREATE INDEX edges_tree_idx_edge_id ON edges (tree_idx, edge_id);
+        CREATE INDEX edges_edge_id ON edges (edge_id);
+        CREATE INDEX events_tree_idx_time ON events (tree_idx, time);
+        CREATE INDEX events_time ON events (time);
+        """
 
     def __init__(self, taxon_namespace=None):
         ## information on each tree in sample
@@ -68,159 +122,173 @@ class RevBayesBiogeographyParser(object):
         else:
             self.taxon_namespace = taxon_namespace
 
-    def parse(self, src, skip_first_row=True):
+    def parse(self, src, skip_first_row=True, sample_selection=None):
+        """
+        Parses the RevBayes biogeographical history samples in ``src``.
+
+        If ``sample_selection`` is given (see
+        |inphest.model.HostHistorySampleSelection|), only the rows (samples)
+        it selects are parsed: the remaining rows are never tokenized. The
+        ``tree_idx`` of each parsed sample is its index in the source,
+        regardless of selection. If ``src`` is a path, the file may be
+        compressed (see |inphest.utility.open_input_file|).
+        """
         if isinstance(src, str):
-            src = open(src)
+            src = utility.open_input_file(src)
         if skip_first_row:
             next(src) # skip over header
-        tree_idx = -1
-        for row_idx, row in enumerate(src):
-            row = row.strip("\n")
-            if not row:
-                continue
+        rows = (row.strip("\n") for row in src)
+        rows = (row for row in rows if row)
+        if sample_selection is None:
+            selected_rows = enumerate(rows)
+        else:
+            # random subsampling only holds the (unparsed) rows selected so far
+            selected_rows = sample_selection.selected_iter(rows)
+        for tree_idx, row in selected_rows:
+            self._parse_row(tree_idx=tree_idx, row=row)
 
-            tree_idx += 1
-            parts = row.split("\t")
-            iteration, posterior, likelihood, prior, tree_str = row.split("\t")
+    def _parse_row(self, tree_idx, row):
+        parts = row.split("\t")
+        iteration, posterior, likelihood, prior, tree_str = row.split("\t")
 
-            tree_entry = {}
-            tree_entry["tree_idx"] = tree_idx
-            tree_entry["iteration"] = float(iteration)
-            tree_entry["posterior"] = float(posterior)
-            tree_entry["ln_likelihood"] = float(likelihood)
-            tree_entry["prior"] = float(prior)
-            tree = dendropy.Tree.get(
-                    data=tree_str,
-                    schema="newick",
-                    taxon_namespace=self.taxon_namespace,
-                    terminating_semicolon_required=False,
-                    rooting="force-rooted",
-                    extract_comment_metadata=False,
-                    )
-            tree_entry["tree"] = tree
-            tree.encode_bipartitions()
-            # print(tree.as_string("newick", suppress_annotations=True))
-            tree.calc_node_ages(ultrametricity_precision=0.01)
-            tree_entry["seed_node_age"] = tree.seed_node.age
-            self.tree_entries.append(tree_entry)
+        tree_entry = {}
+        tree_entry["tree_idx"] = tree_idx
+        tree_entry["iteration"] = float(iteration)
+        tree_entry["posterior"] = float(posterior)
+        tree_entry["ln_likelihood"] = float(likelihood)
+        tree_entry["prior"] = float(prior)
+        tree = dendropy.Tree.get(
+                data=tree_str,
+                schema="newick",
+                taxon_namespace=self.taxon_namespace,
+                terminating_semicolon_required=False,
+                rooting="force-rooted",
+                extract_comment_metadata=False,
+                )
+        tree_entry["tree"] = tree
+        tree.encode_bipartitions()
+        # print(tree.as_string("newick", suppress_annotations=True))
+        tree.calc_node_ages(ultrametricity_precision=0.01)
+        tree_entry["seed_node_age"] = tree.seed_node.age
+        self.tree_entries.append(tree_entry)
 
-            for nd in tree:
-                edge_entry = {}
-                edge_entry["tree_idx"] = tree_idx
-                edge_entry["edge_id"] = int(nd.edge.bipartition)
-                edge_entry["split_bitstring"] = nd.edge.bipartition.split_as_bitstring()
-                edge_entry["leafset_bitstring"] = nd.edge.bipartition.leafset_as_bitstring()
+        for nd in tree:
+            edge_entry = {}
+            edge_entry["tree_idx"] = tree_idx
+            edge_entry["edge_id"] = int(nd.edge.bipartition)
+            edge_entry["split_bitstring"] = nd.edge.bipartition.split_as_bitstring()
+            edge_entry["leafset_bitstring"] = nd.edge.bipartition.leafset_as_bitstring()
 
-                if nd.parent_node:
-                    nd.time = nd.parent_node.time + nd.edge.length
-                    edge_entry["edge_start_time"] = nd.parent_node.time
-                    edge_entry["is_seed_node"] = False
-                    edge_entry["parent_edge_id"] = int(nd.parent_node.edge.bipartition)
-                else:
-                    nd.time = 0.0
-                    edge_entry["edge_start_time"] = -1.0
-                    edge_entry["is_seed_node"] = True
-                    edge_entry["parent_edge_id"] = None
-                edge_entry["edge_duration"] = nd.edge.length
-                edge_entry["edge_end_time"] = nd.time
-                # edge_entry["edge_duration"] = nd.edge.length
-                # edge_entry["edge_ending_age"] = nd.age
-                # if nd.parent_node:
-                #     edge_entry["edge_starting_age"] = nd.parent_node.age
-                # else:
-                #     # special case for root
-                #     edge_entry["edge_starting_age"] = 0.0
-                #     edge_entry["edge_duration"] = nd.age
-                if nd.is_leaf():
-                    edge_entry["child0_edge_id"] = RevBayesBiogeographyParser.NULL_VALUE
-                    edge_entry["child1_edge_id"] = RevBayesBiogeographyParser.NULL_VALUE
-                    edge_entry["is_leaf"] = True
-                else:
-                    edge_entry["is_leaf"] = False
-                    for ch_idx, ch in enumerate(nd.child_node_iter()):
-                        edge_entry["child{}_edge_id".format(ch_idx)] = int(ch.edge.bipartition)
-                edge_metadata, edge_events = self._extract_comment_metadata(nd)
-                # edge_entry["edge_revbayes_index"] = edge_metadata["index"]
-                edge_entry["rb_index"] = edge_metadata["index"]
-                edge_entry["edge_starting_state"] = edge_metadata["pa"]
-                edge_entry["edge_ending_state"] = edge_metadata["nd"]
-                if "cs" in edge_metadata:
-                    if edge_metadata["cs"] == "s":
-                        edge_entry["edge_cladogenetic_speciation_mode"] = "subset_sympatry"
-                    elif edge_metadata["cs"] == "n":
-                        edge_entry["edge_cladogenetic_speciation_mode"] = "narrow_sympatry"
-                    elif edge_metadata["cs"] == "w":
-                        edge_entry["edge_cladogenetic_speciation_mode"] = "widespread_sympatry"
-                    elif edge_metadata["cs"] == "a":
-                        edge_entry["edge_cladogenetic_speciation_mode"] = "allopatry"
-                    else:
-                        raise ValueError("Unrecognized cladogenetic speciation mode event type: '{}'".format(edge_metadata["cs"]))
+            if nd.parent_node:
+                nd.time = nd.parent_node.time + nd.edge.length
+                edge_entry["edge_start_time"] = nd.parent_node.time
+                edge_entry["is_seed_node"] = False
+                edge_entry["parent_edge_id"] = int(nd.parent_node.edge.bipartition)
+            else:
+                nd.time = 0.0
+                edge_entry["edge_start_time"] = -1.0
+                edge_entry["is_seed_node"] = True
+                edge_entry["parent_edge_id"] = None
+            edge_entry["edge_duration"] = nd.edge.length
+            edge_entry["edge_end_time"] = nd.time
+            # edge_entry["edge_duration"] = nd.edge.length
+            # edge_entry["edge_ending_age"] = nd.age
+            # if nd.parent_node:
+            #     edge_entry["edge_starting_age"] = nd.parent_node.age
+            # else:
+            #     # special case for root
+            #     edge_entry["edge_starting_age"] = 0.0
+            #     edge_entry["edge_duration"] = nd.age
+            if nd.is_leaf():
+                edge_entry["child0_edge_id"] = RevBayesBiogeographyParser.NULL_VALUE
+                edge_entry["child1_edge_id"] = RevBayesBiogeographyParser.NULL_VALUE
+                edge_entry["is_leaf"] = True
+            else:
+                edge_entry["is_leaf"] = False
+                for ch_idx, ch in enumerate(nd.child_node_iter()):
+                    edge_entry["child{}_edge_id".format(ch_idx)] = int(ch.edge.bipartition)
+            edge_metadata, edge_events = self._extract_comment_metadata(nd)
+            # edge_entry["edge_revbayes_index"] = edge_metadata["index"]
+            edge_entry["rb_index"] = edge_metadata["index"]
+            edge_entry["edge_starting_state"] = edge_metadata["pa"]
+            edge_entry["edge_ending_state"] = edge_metadata["nd"]
+            if "cs" in edge_metadata:
+                if edge_metadata["cs"] == "s":
+                    edge_entry["edge_cladogenetic_speciation_mode"] = "subset_sympatry"
+                elif edge_metadata["cs"] == "n":
+                    edge_entry["edge_cladogenetic_speciation_mode"] = "narrow_sympatry"
+                elif edge_metadata["cs"] == "w":
+                    edge_entry["edge_cladogenetic_speciation_mode"] = "widespread_sympatry"
+                elif edge_metadata["cs"] == "a":
+                    edge_entry["edge_cladogenetic_speciation_mode"] = "allopatry"
                 else:
-                    edge_entry["edge_cladogenetic_speciation_mode"] = RevBayesBiogeographyParser.NULL_VALUE
-                self.edge_entries.append(edge_entry)
-                _debug_edge_events = []
-                for event in edge_events:
-                    event_entry = {}
-                    event_entry["tree_idx"] = edge_entry["tree_idx"]
-                    event_entry["edge_id"] = edge_entry["edge_id"]
+                    raise ValueError("Unrecognized cladogenetic speciation mode event type: '{}'".format(edge_metadata["cs"]))
+            else:
+                edge_entry["edge_cladogenetic_speciation_mode"] = RevBayesBiogeographyParser.NULL_VALUE
+            self.edge_entries.append(edge_entry)
+            _debug_edge_events = []
+            for event in edge_events:
+                event_entry = {}
+                event_entry["tree_idx"] = edge_entry["tree_idx"]
+                event_entry["edge_id"] = edge_entry["edge_id"]
 
-                    # Michael Lands, pers. comm., 2015-11-11:
-                    # "Yes, "a" is absolute time since the present, but "t" is
-                    # the relative unit position along that particular branch
-                    # (0 is parent-side, 1 is child-side). You can always
-                    # deduce "t" from "a", but it's there for convenience. "
+                # Michael Lands, pers. comm., 2015-11-11:
+                # "Yes, "a" is absolute time since the present, but "t" is
+                # the relative unit position along that particular branch
+                # (0 is parent-side, 1 is child-side). You can always
+                # deduce "t" from "a", but it's there for convenience. "
 
-                    if not nd.parent_node:
-                        ## we ignore all events in edge subtending root
-                        pass
+                if not nd.parent_node:
+                    ## we ignore all events in edge subtending root
+                    pass
+                else:
+                    event_time1 = nd.parent_node.time + (nd.edge.length - (event["age"] - nd.age))
+                    event_time2 = nd.parent_node.time + (event["time"] * nd.edge.length)
+                    assert abs(event_time1 - event_time2) <= 1e-2, "{} != {}".format(event_time1, event_time2)
+                    event_entry["time"] = event_time1
+                    try:
+                        self.max_event_times[tree_idx] = max(event_entry["time"], self.max_event_times[tree_idx])
+                    except KeyError:
+                        self.max_event_times[tree_idx] = event_entry["time"]
+                    event_entry["event_type"] = "anagenesis"
+                    if event["to_state"] == "1":
+                        event_entry["event_subtype"] = "area_gain"
+                    elif event["to_state"] == "0":
+                        event_entry["event_subtype"] = "area_loss"
                     else:
-                        event_time1 = nd.parent_node.time + (nd.edge.length - (event["age"] - nd.age))
-                        event_time2 = nd.parent_node.time + (event["time"] * nd.edge.length)
-                        assert abs(event_time1 - event_time2) <= 1e-2, "{} != {}".format(event_time1, event_time2)
-                        event_entry["time"] = event_time1
-                        try:
-                            self.max_event_times[tree_idx] = max(event_entry["time"], self.max_event_times[tree_idx])
-                        except KeyError:
-                            self.max_event_times[tree_idx] = event_entry["time"]
-                        event_entry["event_type"] = "anagenesis"
-                        if event["to_state"] == "1":
-                            event_entry["event_subtype"] = "area_gain"
-                        elif event["to_state"] == "0":
-                            event_entry["event_subtype"] = "area_loss"
-                        else:
-                            raise ValueError("Unexpected value for state: expecting '0' or '1' but found '{}'".format(event["to_state"]))
-                        event_entry["area_idx"] = event["area_idx"]
-                        # event_entry["to_state"] = event["to_state"]
-                        self.event_schedules_across_all_trees.append(event_entry)
-                        try:
-                            self.event_schedules_by_tree[tree].append(event_entry)
-                        except KeyError:
-                            self.event_schedules_by_tree[tree] = [event_entry]
-                        _debug_edge_events.append(event_entry)
-
-                ## handle splitting event
-                if not nd.is_leaf():
-                    split_event = {
-                        "tree_idx": edge_entry["tree_idx"],
-                        "edge_id": edge_entry["edge_id"],
-                        "time": edge_entry["edge_end_time"],
-                        "event_type": "cladogenesis",
-                        "event_subtype": edge_entry["edge_cladogenetic_speciation_mode"],
-                        "child0_edge_id": edge_entry["child0_edge_id"],
-                        "child1_edge_id": edge_entry["child1_edge_id"],
-                            }
-                    self.event_schedules_across_all_trees.append(split_event)
+                        raise ValueError("Unexpected value for state: expecting '0' or '1' but found '{}'".format(event["to_state"]))
+                    event_entry["area_idx"] = event["area_idx"]
+                    # event_entry["to_state"] = event["to_state"]
+                    self.event_schedules_across_all_trees.append(event_entry)
                     try:
-                        self.event_schedules_by_tree[tree].append(split_event)
+                        self.event_schedules_by_tree[tree].append(event_entry)
                     except KeyError:
-                        self.event_schedules_by_tree[tree] = [split_event]
-                    _debug_edge_events.append(split_event)
+                        self.event_schedules_by_tree[tree] = [event_entry]
+                    _debug_edge_events.append(event_entry)
 
-                # print("--- edge {}: {} ---".format(edge_entry["rb_index"], nd.edge.bipartition.leafset_as_bitstring()))
-                # print("times: {} to {}".format(edge_entry["edge_start_time"], edge_entry["edge_end_time"]))
-                # _debug_edge_events.sort(key=lambda e: e["time"])
-                # event_times = [e["time"] for e in _debug_edge_events]
-                # print("event times: {}".format(event_times))
+            ## handle splitting event
+            if not nd.is_leaf():
+                split_event = {
+                    "tree_idx": edge_entry["tree_idx"],
+                    "edge_id": edge_entry["edge_id"],
+                    "time": edge_entry["edge_end_time"],
+                    "event_type": "cladogenesis",
+                    "event_subtype": edge_entry["edge_cladogenetic_speciation_mode"],
+                    "child0_edge_id": edge_entry["child0_edge_id"],
+                    "child1_edge_id": edge_entry["child1_edge_id"],
+                        }
+                self.event_schedules_across_all_trees.append(split_event)
+                try:
+                    self.event_schedules_by_tree[tree].append(split_event)
+                except KeyError:
+                    self.event_schedules_by_tree[tree] = [split_event]
+                _debug_edge_events.append(split_event)
+
+            # print("--- edge {}: {} ---".format(edge_entry["rb_index"], nd.edge.bipartition.leafset_as_bitstring()))
+            # print("times: {} to {}".format(edge_entry["edge_start_time"], edge_entry["edge_end_time"]))
+            # _debug_edge_events.sort(key=lambda e: e["time"])
+            # event_times = [e["time"] for e in _debug_edge_events]
+            # print("event times: {}".format(event_times))
 
     def _extract_comment_metadata(self, nd):
 
@@ -337,11 +405,182 @@ class RevBayesBiogeographyParser(object):
         writer.writerows(self.event_schedules_across_all_trees)
         events_by_treef.close()
 
+    def serialize_database(self, filepath):
+        """
+        Writes the tree, edge and event tables to the SQLite database at
+        ``filepath`` (replacing any existing tables), indexed so that
+        individual samples can be retrieved by ``tree_idx`` without a full
+        scan (see :meth:`load_database`).
+        """
+        # Edge (split) ids are bitmasks that overflow SQLite's 64-bit integers
+        # on trees with more than 63 leaves, and so are stored as text.
+        connection = sqlite3.connect(filepath)
+        try:
+            with connection:
+                connection.executescript(RevBayesBiogeographyParser.DATABASE_SCHEMA)
+                connection.executemany(
+                        "INSERT INTO taxa (taxon_idx, label) VALUES (?, ?)",
+                        ((taxon_idx, taxon.label) for taxon_idx, taxon in enumerate(self.taxon_namespace)))
+                connection.executemany(
+                        "INSERT INTO trees (tree_idx, iteration, posterior, ln_likelihood, prior, seed_node_age, max_event_time, newick) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        ((tree_entry["tree_idx"],
+                            tree_entry["iteration"],
+                            tree_entry["posterior"],
+                            tree_entry["ln_likelihood"],
+                            tree_entry["prior"],
+                            tree_entry["seed_node_age"],
+                            self.max_event_times.get(tree_entry["tree_idx"], None),
+                            tree_entry["tree"].as_string(
+                                schema="newick",
+                                suppress_rooting=True,
+                                suppress_annotations=True,
+                                suppress_item_comments=True,
+                                suppress_internal_node_labels=True,
+                                ).strip(),
+                            ) for tree_entry in self.tree_entries))
+                connection.executemany(
+                        "INSERT INTO edges (tree_idx, edge_id, parent_edge_id, split_bitstring, leafset_bitstring, edge_start_time, edge_end_time, edge_duration, edge_starting_state, edge_ending_state, child0_edge_id, child1_edge_id, edge_cladogenetic_speciation_mode, rb_index, is_seed_node, is_leaf) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        ((edge_entry["tree_idx"],
+                            self._compose_database_id(edge_entry["edge_id"]),
+                            self._compose_database_id(edge_entry["parent_edge_id"]),
+                            edge_entry["split_bitstring"],
+                            edge_entry["leafset_bitstring"],
+                            edge_entry["edge_start_time"],
+                            edge_entry["edge_end_time"],
+                            edge_entry["edge_duration"],
+                            edge_entry["edge_starting_state"],
+                            edge_entry["edge_ending_state"],
+                            self._compose_database_id(edge_entry["child0_edge_id"]),
+                            self._compose_database_id(edge_entry["child1_edge_id"]),
+                            self._compose_database_text(edge_entry["edge_cladogenetic_speciation_mode"]),
+                            edge_entry["rb_index"],
+                            edge_entry["is_seed_node"],
+                            edge_entry["is_leaf"],
+                            ) for edge_entry in self.edge_entries))
+                connection.executemany(
+                        "INSERT INTO events (tree_idx, edge_id, time, event_type, event_subtype, area_idx, child0_edge_id, child1_edge_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        ((event_entry["tree_idx"],
+                            self._compose_database_id(event_entry["edge_id"]),
+                            event_entry["time"],
+                            event_entry["event_type"],
+                            event_entry["event_subtype"],
+                            event_entry.get("area_idx", None),
+                            self._compose_database_id(event_entry.get("child0_edge_id", None)),
+                            self._compose_database_id(event_entry.get("child1_edge_id", None)),
+                            ) for event_entry in self.event_schedules_across_all_trees))
+        finally:
+            connection.close()
+
+    def load_database(self, filepath, tree_idxs=None):
+        """
+        Populates the tree, edge and event tables from the SQLite database at
+        ``filepath`` (as written by :meth:`serialize_database`), as if the
+        samples had been parsed from the original RevBayes output. If
+        ``tree_idxs`` is given, only those samples are loaded.
+        """
+        connection = sqlite3.connect(filepath)
+        try:
+            for taxon_idx, label in connection.execute("SELECT taxon_idx, label FROM taxa ORDER BY taxon_idx"):
+                taxon = self.taxon_namespace.require_taxon(label=label)
+                if taxon_idx >= len(self.taxon_namespace) or self.taxon_namespace[taxon_idx] is not taxon:
+                    raise ValueError("Taxon '{}' at index {} in database but not in taxon namespace".format(label, taxon_idx))
+            if tree_idxs is None:
+                tree_idxs = [row[0] for row in connection.execute("SELECT tree_idx FROM trees ORDER BY tree_idx")]
+            for tree_idx in tree_idxs:
+                self._load_database_tree(connection, tree_idx)
+        finally:
+            connection.close()
+
+    def _load_database_tree(self, connection, tree_idx):
+        row = connection.execute(
+                "SELECT iteration, posterior, ln_likelihood, prior, seed_node_age, max_event_time, newick FROM trees WHERE tree_idx = ?",
+                (tree_idx,)).fetchone()
+        if row is None:
+            raise KeyError("No tree with index {} in database".format(tree_idx))
+        iteration, posterior, ln_likelihood, prior, seed_node_age, max_event_time, newick = row
+        tree = dendropy.Tree.get(
+                data=newick,
+                schema="newick",
+                taxon_namespace=self.taxon_namespace,
+                rooting="force-rooted",
+                )
+        tree.encode_bipartitions()
+        self.tree_entries.append({
+            "tree_idx": tree_idx,
+            "iteration": iteration,
+            "posterior": posterior,
+            "ln_likelihood": ln_likelihood,
+            "prior": prior,
+            "tree": tree,
+            "seed_node_age": seed_node_age,
+            })
+        if max_event_time is not None:
+            self.max_event_times[tree_idx] = max_event_time
+        for row in connection.execute(
+                "SELECT edge_id, parent_edge_id, split_bitstring, leafset_bitstring, edge_start_time, edge_end_time, edge_duration, edge_starting_state, edge_ending_state, child0_edge_id, child1_edge_id, edge_cladogenetic_speciation_mode, rb_index, is_seed_node, is_leaf FROM edges WHERE tree_idx = ? ORDER BY rowid",
+                (tree_idx,)):
+            edge_entry = {
+                "tree_idx": tree_idx,
+                "edge_id": int(row[0]),
+                "parent_edge_id": self._parse_database_id(row[1], None),
+                "split_bitstring": row[2],
+                "leafset_bitstring": row[3],
+                "edge_start_time": row[4],
+                "edge_end_time": row[5],
+                "edge_duration": row[6],
+                "edge_starting_state": row[7],
+                "edge_ending_state": row[8],
+                "child0_edge_id": self._parse_database_id(row[9], RevBayesBiogeographyParser.NULL_VALUE),
+                "child1_edge_id": self._parse_database_id(row[10], RevBayesBiogeographyParser.NULL_VALUE),
+                "edge_cladogenetic_speciation_mode": row[11] if row[11] is not None else RevBayesBiogeographyParser.NULL_VALUE,
+                "rb_index": row[12],
+                "is_seed_node": bool(row[13]),
+                "is_leaf": bool(row[14]),
+                }
+            self.edge_entries.append(edge_entry)
+        event_entries = []
+        for row in connection.execute(
+                "SELECT edge_id, time, event_type, event_subtype, area_idx, child0_edge_id, child1_edge_id FROM events WHERE tree_idx = ? ORDER BY rowid",
+                (tree_idx,)):
+            event_entry = {
+                "tree_idx": tree_idx,
+                "edge_id": int(row[0]),
+                "time": row[1],
+                "event_type": row[2],
+                "event_subtype": row[3],
+                }
+            if row[2] == "cladogenesis":
+                event_entry["child0_edge_id"] = self._parse_database_id(row[5], RevBayesBiogeographyParser.NULL_VALUE)
+                event_entry["child1_edge_id"] = self._parse_database_id(row[6], RevBayesBiogeographyParser.NULL_VALUE)
+            else:
+                event_entry["area_idx"] = row[4]
+            event_entries.append(event_entry)
+        self.event_schedules_across_all_trees.extend(event_entries)
+        if event_entries:
+            self.event_schedules_by_tree[tree] = event_entries
+
+    def _compose_database_id(self, value):
+        if value is None or value == RevBayesBiogeographyParser.NULL_VALUE:
+            return None
+        return str(value)
+
+    def _compose_database_text(self, value):
+        if value == RevBayesBiogeographyParser.NULL_VALUE:
+            return None
+        return value
+
+    def _parse_database_id(self, value, null_value):
+        if value is None:
+            return null_value
+        return int(value)
 
 def main():
     rbp = RevBayesBiogeographyParser()
     rbp.parse(sys.argv[1])
-    rbp.serialize_tables(sys.argv[2])
+    if sys.argv[2].endswith(".sqlite") or sys.argv[2].endswith(".db"):
+        rbp.serialize_database(sys.argv[2])
+    else:
+        rbp.serialize_tables(sys.argv[2])
 
 if __name__ == "__main__":
     main()
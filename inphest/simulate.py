@@ -12,6 +12,7 @@ import pprint
 import copy
 import json
 import os
+import time
 from distutils.util import strtobool
 
 import dendropy
@@ -21,6 +22,11 @@ from dendropy.utility import error as dendropy_error
 import inphest
 from inphest import summarize
 from inphest import model
+from inphest import hostcache
+from inphest import pipeline
+from inphest import columnar
+from inphest import manifest
+from inphest import checkpoint
 from inphest import utility
 from inphest import error
 
@@ -35,20 +41,43 @@ class InphestSimulator(object):
         return f
 
     @staticmethod
-    def compose_trees_filepath(output_prefix):
-        return output_prefix + ".trees"
+    def compose_trees_filepath(output_prefix, compression=None):
+        return utility.compose_compressed_filepath(output_prefix + ".trees", compression)
 
     @staticmethod
-    def compose_failed_trees_filepath(output_prefix):
-        return output_prefix + ".failed.trees"
+    def compose_failed_trees_filepath(output_prefix, compression=None):
+        return utility.compose_compressed_filepath(output_prefix + ".failed.trees", compression)
 
     @staticmethod
-    def compose_summary_stats_filepath(output_prefix):
-        return output_prefix + ".summary-stats.csv"
+    def compose_summary_stats_filepath(output_prefix, compression=None):
+        return utility.compose_compressed_filepath(output_prefix + ".summary-stats.csv", compression)
 
     @staticmethod
-    def open_summary_stats_file(output_prefix):
-        summary_stats_file = open(InphestSimulator.compose_summary_stats_filepath(output_prefix), "w")
+    def compose_log_filepath(output_prefix, compression=None):
+        return utility.compose_compressed_filepath(output_prefix + ".log", compression)
+
+    @staticmethod
+    def compose_summary_stats_columns_path(output_prefix):
+        return output_prefix + "." + columnar.SUMMARY_STATS_COLUMNS_EXTENSION
+
+    @staticmethod
+    def open_summary_stats_file(output_prefix, compression=None, summary_stats_format="csv", output_size=None):
+        """
+        Opens the summary statistics file (or store) for writing or, if
+        ``output_size`` (in bytes or, for the binary columnar store, rows) is
+        given, for appending to the existing one, truncated to that size.
+        """
+        if summary_stats_format == "columns":
+            if compression is not None and compression != "none":
+                raise ValueError("Binary columnar summary statistics cannot be compressed")
+            return columnar.SummaryStatsColumnWriter(InphestSimulator.compose_summary_stats_columns_path(output_prefix), num_rows=output_size)
+        elif summary_stats_format != "csv":
+            raise ValueError("Unrecognized summary statistics format: '{}'".format(summary_stats_format))
+        summary_stats_filepath = InphestSimulator.compose_summary_stats_filepath(output_prefix, compression)
+        if output_size is not None:
+            manifest.truncate_output_file(summary_stats_filepath, output_size)
+            return utility.open_output_file(summary_stats_filepath, compression, append=True)
+        summary_stats_file = utility.open_output_file(summary_stats_filepath, compression)
         return summary_stats_file
 
     @staticmethod
@@ -60,7 +89,8 @@ class InphestSimulator(object):
             host_history,
             config_d,
             is_verbose_setup,
-            summary_stats_calculator):
+            summary_stats_calculator,
+            host_system=None):
 
         # configure
         self.elapsed_time = 0.0 # need to be here for logging
@@ -72,11 +102,19 @@ class InphestSimulator(object):
         self.model = inphest_model
         self.host_history = host_history
 
-        # initialize host system
-        self.host_system = model.HostSystem(
-                host_history=self.host_history,
-                host_to_symbiont_time_scale_factor=self.model.host_to_symbiont_time_scale_factor,
-                run_logger=self.run_logger,)
+        # initialize host system: if given (e.g., as used by a previous
+        # replicate on the same host history), it is reset rather than
+        # compiled again
+        if host_system is None:
+            self.host_system = model.HostSystem(
+                    host_history=self.host_history,
+                    host_to_symbiont_time_scale_factor=self.model.host_to_symbiont_time_scale_factor,
+                    run_logger=self.run_logger,)
+        else:
+            if host_system.host_history is not self.host_history or host_system.host_to_symbiont_time_scale_factor != self.model.host_to_symbiont_time_scale_factor:
+                raise ValueError("Host system was not compiled from this host history and model")
+            host_system.reset()
+            self.host_system = host_system
 
         # track host events
         self.next_host_event = None
@@ -105,6 +143,7 @@ class InphestSimulator(object):
         if self.name is None:
             self.name = str(id(self))
         self.output_prefix = config_d.pop("output_prefix", "inphest-{}".format(self.name))
+        self.output_compression = config_d.pop("output_compression", None)
 
         self.run_logger = config_d.pop("run_logger", None)
         if self.run_logger is None:
@@ -112,7 +151,7 @@ class InphestSimulator(object):
                     name="inphest",
                     stderr_logging_level=config_d.pop("standard_error_logging_level", "info"),
                     log_to_file=config_d.pop("log_to_file", True),
-                    log_path=self.output_prefix + ".log",
+                    log_path=InphestSimulator.compose_log_filepath(self.output_prefix, self.output_compression),
                     file_logging_level=config_d.pop("file_logging_level", "info"),
                     )
         self.run_logger.system = self
@@ -122,13 +161,19 @@ class InphestSimulator(object):
 
         self.trees_file = config_d.pop("trees_file", None)
         if self.trees_file is None:
-            self.trees_file = open(InphestSimulator.compose_trees_filepath(self.output_prefix), "w")
+            self.trees_file = utility.open_output_file(InphestSimulator.compose_trees_filepath(self.output_prefix, self.output_compression))
         if verbose:
             self.run_logger.info("Output trees filepath: {}".format(self.trees_file.name))
 
         if not self.trees_file:
             self.run_logger.warning("No trees will be stored!")
 
+        # identify the replicate in the trees index and run manifest, if any
+        self.trees_index_file = config_d.pop("trees_index_file", None)
+        self.run_manifest = config_d.pop("run_manifest", None)
+        self.replicate_idx = config_d.pop("replicate_idx", None)
+        self.host_history_idx = config_d.pop("host_history_idx", None)
+
         self.debug_mode = config_d.pop("debug_mode", False)
         if verbose and self.debug_mode:
             self.run_logger.info("Running in DEBUG mode")
@@ -137,7 +182,7 @@ class InphestSimulator(object):
             self.is_store_failed_trees = config_d.pop("store_failed_trees", True)
             self.failed_trees_file = config_d.pop("failed_trees_file", None)
             if self.failed_trees_file is None:
-                self.failed_trees_file = open(InphestSimulator.compose_failed_trees_filepath(self.output_prefix), "w")
+                self.failed_trees_file = utility.open_output_file(InphestSimulator.compose_failed_trees_filepath(self.output_prefix, self.output_compression))
             if verbose:
                 self.run_logger.info("Output failed trees filepath: {}".format(self.failed_trees_file.name))
         else:
@@ -161,11 +206,21 @@ class InphestSimulator(object):
             else:
                 self.run_logger.info("Host associations and geographical ranges will NOT be annotated on node labels")
 
+        # trees and summary statistics are written out through the sink, as
+        # one record per replicate
+        self.output_sink = config_d.pop("output_sink", None)
+        if self.output_sink is None:
+            self.output_sink = utility.BufferedOutputSink()
+
         self.is_process_summary_stats = config_d.pop("store_summary_stats", True)
-        if self.is_process_summary_stats:
+        self.summary_stats_pipeline = config_d.pop("summary_stats_pipeline", None)
+        if self.summary_stats_pipeline is not None:
+            if verbose:
+                self.run_logger.info("Summary statistics and trees will be stored asynchronously")
+        elif self.is_process_summary_stats:
             self.summary_stats_file = config_d.pop("summary_stats_file", None)
             if self.summary_stats_file is None:
-                self.summary_stats_file = InphestSimulator.open_summary_stats_file(self.output_prefix)
+                self.summary_stats_file = InphestSimulator.open_summary_stats_file(self.output_prefix, self.output_compression)
                 self.is_summary_stats_header_written = False
             else:
                 self.is_summary_stats_header_written = config_d.pop("is_summary_stats_header_written", False)
@@ -183,11 +238,21 @@ class InphestSimulator(object):
         else:
             if "random_seed" in config_d:
                 raise TypeError("Cannot specify both 'rng' and 'random_seed'")
+            self.random_seed = None
             if verbose:
                 self.run_logger.info("Using existing random number generator")
 
         self.log_frequency = config_d.pop("log_frequency", None)
 
+        # the state of the simulation is written to the checkpoint file (if
+        # given) every ``checkpoint_interval`` seconds (if given), and, if
+        # requested, restored from it (if it exists) when run
+        self.checkpoint_path = config_d.pop("checkpoint_path", None)
+        self.checkpoint_interval = config_d.pop("checkpoint_interval", None)
+        self.is_restore_checkpoint = config_d.pop("restore_checkpoint", False)
+        if verbose and self.checkpoint_path is not None and self.checkpoint_interval is not None:
+            self.run_logger.info("Simulation state will be checkpointed every {} seconds to: {}".format(self.checkpoint_interval, self.checkpoint_path))
+
         if config_d.pop("store_model_description", True):
             self.model_description_file = config_d.pop("model_description_file", None)
             if self.model_description_file is None:
@@ -241,11 +306,19 @@ class InphestSimulator(object):
         if self.debug_mode:
             num_events = 0
 
-        ### Initialize seed node distribution
-        extant_host_lineages = self.host_system.extant_host_lineages_at_current_time(0)
-        self.activate_host_lineage(self.host_system.seed_host_lineage)
-        for lineage in self.phylogeny.current_lineages:
-            lineage.add_host_in_area(host_lineage=self.host_system.seed_host_lineage)
+        ### Initialize seed node distribution, or restore state from checkpoint
+        if self.is_restore_checkpoint and self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            checkpoint.restore_checkpoint(self, self.checkpoint_path)
+            self.run_logger.info("Restored simulation state at t = {} from checkpoint: {}".format(self.elapsed_time, self.checkpoint_path))
+        else:
+            extant_host_lineages = self.host_system.extant_host_lineages_at_current_time(0)
+            self.activate_host_lineage(self.host_system.seed_host_lineage)
+            for lineage in self.phylogeny.current_lineages:
+                lineage.add_host_in_area(host_lineage=self.host_system.seed_host_lineage)
+
+        ### Initialize checkpointing
+        if self.checkpoint_path is not None and self.checkpoint_interval is not None:
+            last_checkpoint_time = time.time()
 
         ### Initialize termination conditiong checking
         # ntips_in_focal_areas = self.phylogeny.num_focal_area_lineages()
@@ -253,6 +326,12 @@ class InphestSimulator(object):
 
         while True:
 
+            ### CHECKPOINTING
+            if self.checkpoint_path is not None and self.checkpoint_interval is not None:
+                if time.time() - last_checkpoint_time >= self.checkpoint_interval:
+                    self.write_checkpoint()
+                    last_checkpoint_time = time.time()
+
             ### DEBUG
             if self.debug_mode:
                 num_events += 1
@@ -316,7 +395,10 @@ class InphestSimulator(object):
                 assert len(self.host_system.host_events) == 0
                 self.run_logger.info("Termination condition of t = {} reached: calculating summary statistics".format(self.elapsed_time))
                 self.store_sample(trees_file=self.trees_file)
-                self.run_logger.info("Summary statistics and trees stored")
+                if self.summary_stats_pipeline is None:
+                    self.run_logger.info("Summary statistics and trees stored")
+                else:
+                    self.run_logger.info("Summary statistics calculation queued")
                 break
             for lineage in self.phylogeny.current_lineage_iter():
                 lineage.edge.length += time_till_event
@@ -336,6 +418,22 @@ class InphestSimulator(object):
                     assert lineage.is_extant
                     lineage.debug_check(simulation_elapsed_time=self.elapsed_time)
 
+    def write_checkpoint(self):
+        """
+        Writes the current state of the simulation to the checkpoint file
+        (see |checkpoint|).
+        """
+        checkpoint.write_checkpoint(self, self.checkpoint_path)
+        self.run_logger.debug("Simulation state at t = {} checkpointed: {} lineages".format(self.elapsed_time, len(self.phylogeny.current_lineages)))
+
+    def discard_checkpoint(self):
+        """
+        Removes the checkpoint file, if any, once the simulation has either
+        completed or failed.
+        """
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
     def schedule_events(self):
         event_fluxes = {}
         event_calls = {}
@@ -581,6 +679,14 @@ class InphestSimulator(object):
         self.processed_host_events.add(host_event)
 
     def store_sample(self, trees_file):
+        # The tree statement is composed into a single string, rather than
+        # written straight into the output sink's buffer for the trees file,
+        # because it is needed whole in several places: it is sent as is to
+        # the summary statistics workers, its length in bytes is recorded in
+        # the trees index, and, if the summary statistics fail, it goes to
+        # the failed trees file instead (the record being discarded). The
+        # sink then holds a reference to this same string, so the tree is
+        # not copied again until the batch is written out.
         s = StringIO()
         self.write_tree(
                 out=s,
@@ -588,30 +694,81 @@ class InphestSimulator(object):
                 )
         tree_str = s.getvalue()
         try:
+            if self.summary_stats_pipeline is not None:
+                self.submit_summary_stats_sample(tree_str)
+                return
             if self.is_process_summary_stats:
                 self.calculate_and_store_summary_stats()
         except:
+            self.output_sink.discard_record()
             if self.is_store_failed_trees:
-                self.failed_trees_file.write(tree_str)
-                self.failed_trees_file.flush()
+                self.output_sink.write(self.failed_trees_file, tree_str)
+                self.output_sink.end_record()
             raise
-        self.trees_file.write(tree_str)
-        self.trees_file.flush()
+        self.output_sink.write(self.trees_file, tree_str)
+        for dest, item in self.compose_record_items(tree_str):
+            self.output_sink.write(dest, item)
+        self.output_sink.end_record()
+
+    def compose_record_items(self, tree_str):
+        """
+        Returns a list of ``(destination, item)`` tuples to be written out
+        together with the tree (i.e., the trees index and run manifest
+        entries, if any).
+        """
+        record_items = []
+        if self.trees_index_file is not None:
+            record_items.append((self.trees_index_file, (tree_str,
+                self.replicate_idx,
+                self.host_history_idx,
+                self.host_history.sample_idx,
+                self.random_seed)))
+        if self.run_manifest is not None:
+            record_items.append((self.run_manifest, (
+                self.replicate_idx,
+                self.host_history_idx,
+                self.random_seed)))
+        return record_items
+
+    def submit_summary_stats_sample(self, tree_str):
+        # quick checks (tree size, occupancies) are carried out here, so
+        # that replicates that fail them are restarted immediately
+        symbiont_phylogeny_leaf_sets_by_area, symbiont_phylogeny_leaf_sets_by_host = self.summary_stats_calculator.compose_assemblage_leaf_sets(
+                symbiont_phylogeny=self.phylogeny,
+                host_system=self.host_system,
+                simulation_elapsed_time=self.elapsed_time)
+        symbiont_phylogeny_sample = summarize.SymbiontPhylogenySample.from_assemblage_leaf_sets(
+                symbiont_phylogeny=self.phylogeny,
+                leaf_sets_by_area=symbiont_phylogeny_leaf_sets_by_area,
+                leaf_sets_by_host=symbiont_phylogeny_leaf_sets_by_host)
+        self.summary_stats_pipeline.submit(
+                task_key=self.name,
+                host_history=self.host_history,
+                symbiont_phylogeny_sample=symbiont_phylogeny_sample,
+                statistic_groups=self.model.summary_statistic_groups,
+                model_id=self.model.model_id,
+                tree_str=tree_str,
+                record_items=self.compose_record_items(tree_str),
+                random_seed=self.random_seed)
 
     def calculate_and_store_summary_stats(self):
         ss = self.summary_stats_calculator.calculate(
                 symbiont_phylogeny=self.phylogeny,
                 host_system=self.host_system,
-                simulation_elapsed_time=self.elapsed_time)
+                simulation_elapsed_time=self.elapsed_time,
+                statistic_groups=self.model.summary_statistic_groups,
+                random_seed=self.random_seed)
+        if getattr(self.summary_stats_file, "is_batch_destination", False):
+            # binary columnar store: no formatting needed
+            self.output_sink.write(self.summary_stats_file, (self.model.model_id, ss))
+            return
         if not self.is_summary_stats_header_written:
             header = ["model.id"] + list(ss.keys())
-            self.summary_stats_file.write(",".join(header))
-            self.summary_stats_file.write("\n")
+            self.output_sink.write(self.summary_stats_file, ",".join(header) + "\n")
             self.is_summary_stats_header_written = True
-        self.summary_stats_file.write("{},".format(self.model.model_id))
-        self.summary_stats_file.write(",".join("{}".format(ss[k]) for k in ss))
-        self.summary_stats_file.write("\n")
-        self.summary_stats_file.flush()
+        self.output_sink.write(self.summary_stats_file, "{},{}\n".format(
+            self.model.model_id,
+            ",".join("{}".format(ss[k]) for k in ss)))
 
     def write_tree(self, out, tree):
         if self.is_encode_nodes:
@@ -631,41 +788,36 @@ class InphestSimulator(object):
             # print("\n")
             assert k1 == k2
             # host_lineages = self.host_system.extant_host_lineages_at_current_time(self.elapsed_time)
-            host_lineages = self.host_system.extant_leaf_host_lineages
+            # fixed order (by lineage id, i.e., host tree taxon order), so that
+            # the host occurrence bits can be decoded
+            host_lineages = sorted(self.host_system.extant_leaf_host_lineages, key=lambda x: x.lineage_id)
 
             # host_lineages = self.host_system.host_lineages
             for host_lineage in host_lineages:
                 # print("{}: {} ({} to {})".format(self.elapsed_time, host_lineage.lineage_id, host_lineage.start_time, host_lineage.end_time))
                 host_lineage.debug_check(simulation_elapsed_time=self.elapsed_time)
                 # assert self.elapsed_time >= host_lineage.start_time and self.elapsed_time <= host_lineage.end_time
-            lineage_labels = {}
-            for symbiont_lineage in tree.leaf_node_iter():
-                # print(">>> {}".format(symbiont_lineage._infected_hosts))
-                assert len(symbiont_lineage._infected_hosts)
-                current_hosts = []
-                for idx, host_lineage in enumerate(host_lineages):
-                    if symbiont_lineage.has_host(host_lineage):
-                        current_hosts.append("1")
-                    else:
-                        current_hosts.append("0")
-                assert "1" in current_hosts
-                current_hosts_bitstring = "".join(current_hosts)
-                label = "s{lineage_index}{sep}{hosts_occupied}".format(
-                        lineage_index=symbiont_lineage.index,
-                        sep=model.InphestModel._LABEL_COMPONENTS_SEPARATOR,
-                        hosts_occupied=current_hosts_bitstring,
-                        )
-                lineage_labels[symbiont_lineage] = label
-            labelf = lambda x: lineage_labels.get(x, None)
+            tree.write_newick(
+                    out,
+                    host_lineages=host_lineages,
+                    suppress_internal_node_labels=self.is_suppress_internal_node_labels,
+                    )
         else:
-            labelf = InphestSimulator.simple_node_label_function
-        tree.write_to_stream(
-                out,
-                schema="newick",
-                suppress_annotations=False,
-                node_label_compose_fn=labelf,
-                suppress_internal_node_labels=self.is_suppress_internal_node_labels,
-                )
+            tree.write_newick(
+                    out,
+                    suppress_internal_node_labels=self.is_suppress_internal_node_labels,
+                    )
+
+def compose_replicate_random_seed(run_random_seed, replicate_idx, host_history_idx, num_restarts=0):
+    """
+    Returns the random seed for the simulation of replicate ``replicate_idx``
+    on host history ``host_history_idx`` (after ``num_restarts`` restarts)
+    in a run with random seed ``run_random_seed``: depending only on these,
+    and not on the replicates simulated before it, it is the same whether
+    or not the run was interrupted and resumed.
+    """
+    rng = random.Random("{}.{}.{}.{}".format(run_random_seed, replicate_idx, host_history_idx, num_restarts))
+    return rng.randint(0, sys.maxsize)
 
 def repeat_run(
         output_prefix,
@@ -680,6 +832,20 @@ def repeat_run(
         stderr_logging_level="info",
         file_logging_level="debug",
         maximum_num_restarts_per_replicates=100,
+        host_history_sample_selection=None,
+        is_use_host_history_cache=True,
+        host_history_cache_dir=None,
+        summary_stats_config_d=None,
+        num_summary_stats_workers=0,
+        summary_stats_queue_size=None,
+        output_buffer_size=1,
+        output_buffer_time=None,
+        is_sync_output=False,
+        output_compression=None,
+        summary_stats_format="csv",
+        is_index_trees=True,
+        is_resume=False,
+        checkpoint_interval=None,
         debug_mode=False):
     """
     Executes multiple runs of the Inphest simulator under identical
@@ -714,8 +880,8 @@ def repeat_run(
     interpolate_missing_model_values : bool
         Allow missing values in model to be populated by default values (inadvisable).
     random_seed : integer
-        Random seed to be used (for single random number generator across all
-        replicates).
+        Random seed of the run, from which the random seed of each replicate
+        is derived.
     stderr_logging_level : string or None
         Message level threshold for screen logs; if 'none' or `None`, screen
         logs will be supprsed.
@@ -725,12 +891,98 @@ def repeat_run(
     maximum_num_restarts_per_replicates : int
         A failed replicate (due to e.g., total extinction of all taxa) will be
         re-run. This limits the number of re-runs.
+    host_history_sample_selection : |model.HostHistorySampleSelection| or None
+        If given, only the host biogeographical history samples selected by
+        this (e.g., after burn-in and thinning) are loaded and simulated on.
+    is_use_host_history_cache : bool
+        If `True`, compiled host histories, as well as the host-side
+        reference structures used by the summary statistics, are read from
+        (or, if not yet available, written to) an on-disk cache keyed to the
+        contents of the host biogeographical history samples file.
+    host_history_cache_dir : str or None
+        Directory in which to store compiled host history caches; if `None`,
+        caches are stored alongside the host biogeographical history samples
+        file.
+    summary_stats_config_d : dict
+        Summary statistics calculator configuration parameters as
+        keyword-value pairs (e.g., 'num_randomization_replicates',
+        'randomization_tolerance', 'max_randomization_replicates',
+        'randomization_block_size').
+    num_summary_stats_workers : int
+        If greater than 0, summary statistics are calculated asynchronously,
+        by this number of worker processes, while the simulation of
+        subsequent replicates proceeds. Replicates whose summary statistics
+        calculation fails are restarted as usual.
+    summary_stats_queue_size : int or None
+        Maximum number of simulated replicates awaiting calculation of their
+        summary statistics before the simulation waits for the workers
+        (default: twice the number of workers).
+    output_buffer_size : int
+        Number of replicates whose trees and summary statistics are held in
+        memory before being written out together (see
+        |utility.BufferedOutputSink|).
+    output_buffer_time : float or None
+        If given, the trees and summary statistics held in memory are also
+        written out once this number of seconds have passed since they were
+        last written out.
+    is_sync_output : bool
+        If `True`, each output file is synchronized to disk (see
+        ``os.fsync``) whenever written out, before the run manifest records
+        it, so that a run can be resumed after a system crash, not only
+        after the program itself is interrupted.
+    output_compression : str or None
+        If given, one of 'gzip', 'bz2' or 'xz': the trees, summary statistics
+        and log files are compressed as they are written, with the
+        corresponding extension appended to their paths.
+    summary_stats_format : str
+        Either 'csv', for the summary statistics to be written as a CSV file,
+        or 'columns', for them to be written to a binary columnar store (see
+        |columnar|), which is not compressed even if ``output_compression`` is
+        given.
+    is_index_trees : bool
+        If `True`, an index of the byte offset of each tree in the trees file,
+        and the replicate, host history and random seed of the simulation
+        that produced it, is written alongside the trees file (see
+        |columnar|), so that trees can be read directly by position or by
+        replicate. Each replicate is simulated using its own random seed,
+        derived from the random seed of the run and the replicate, host
+        history and restart indexes (see
+        :func:`compose_replicate_random_seed`). The index records this seed
+        to identify the replicate; it is not in itself a means of
+        regenerating the tree, which also requires the same model, host
+        history and version of this package (and a simulation whose
+        iteration over lineages and areas does not depend on memory layout;
+        see |utility.OrderedSet|).
+    is_resume : bool
+        If `True` and a run manifest (see |manifest|) is found for
+        ``output_prefix``, the run is resumed: the output files are truncated
+        to the last batch of replicates recorded as written in the manifest,
+        and appended to, with only the replicates not yet completed being
+        simulated. As the random seed of each replicate is derived from that
+        of the run, the resumed run produces the same replicates as an
+        uninterrupted one. Requires uncompressed output, and the same
+        settings as the interrupted run. Replicates that were checkpointed
+        (see ``checkpoint_interval``) are restored from their checkpoints.
+    checkpoint_interval : float or None
+        If given, the state of each replicate in progress is written to a
+        checkpoint file (``<output prefix>.R<replicate>.H<host
+        history>.checkpoint.npz``; see |checkpoint|) every this number of
+        seconds, so that, if the run is interrupted and resumed, long
+        replicates are continued from their last checkpoint (exactly as they
+        would have without interruption) rather than simulated again.
     """
     if output_prefix is None:
         output_prefix = config_d.pop("output_prefix", "inphest")
     if config_d is None:
         config_d = {}
     config_d["output_prefix"] = output_prefix
+    if output_compression is None:
+        output_compression = config_d.get("output_compression", None)
+    else:
+        config_d["output_compression"] = output_compression
+    # files opened here are closed here, once all replicates are done, as
+    # compressed files are only complete once closed
+    opened_files = []
     if stderr_logging_level is None or stderr_logging_level.lower() == "none":
         log_to_stderr = False
     else:
@@ -745,107 +997,351 @@ def repeat_run(
                 log_to_stderr=log_to_stderr,
                 stderr_logging_level=stderr_logging_level,
                 log_to_file=log_to_file,
-                log_path=output_prefix + ".log",
+                log_path=InphestSimulator.compose_log_filepath(output_prefix, output_compression),
                 file_logging_level=file_logging_level,
+                log_append=is_resume,
                 )
+        opened_run_logger = config_d["run_logger"]
+    else:
+        opened_run_logger = None
     config_d["debug_mode"] = debug_mode
     run_logger = config_d["run_logger"]
     run_logger.info("-inphest- Starting: {}".format(inphest.description()))
-    if "rng" not in config_d:
-        if random_seed is None:
-            random_seed = config_d.pop("random_seed", None)
-            if random_seed is None:
-                random_seed = random.randint(0, sys.maxsize)
-        else:
-            random_seed = int(random_seed)
-        run_logger.info("-inphest- Initializing with random seed: {}".format(random_seed))
-        config_d["rng"] = random.Random(random_seed)
+    run_manifest_filepath = manifest.compose_run_manifest_filepath(output_prefix)
+    if is_resume and os.path.exists(run_manifest_filepath):
+        if output_compression is not None and output_compression != "none":
+            raise ValueError("Runs with compressed output cannot be resumed")
+        if host_history_sample_selection is not None and not host_history_sample_selection.is_reproducible:
+            raise ValueError("Runs with a non-reproducible host biogeographical regime sample selection cannot be resumed: specify a random seed for the sample selection")
+        resumed_run_manifest = manifest.RunManifest(run_manifest_filepath)
     else:
+        resumed_run_manifest = None
+    if "rng" in config_d:
         run_logger.info("-inphest- Using existing RNG: {}".format(config_d["rng"]))
+        random_seed = config_d.pop("rng").randint(0, sys.maxsize)
+    elif random_seed is None:
+        random_seed = config_d.pop("random_seed", None)
+    if random_seed is None:
+        if resumed_run_manifest is not None:
+            random_seed = resumed_run_manifest.settings["random_seed"]
+        else:
+            random_seed = random.randint(0, sys.maxsize)
+    random_seed = int(random_seed)
+    run_logger.info("-inphest- Initializing with random seed: {}".format(random_seed))
+
+    run_settings = collections.OrderedDict()
+    run_settings["random_seed"] = random_seed
+    run_settings["nreps"] = nreps
+    run_settings["host_history_samples_path"] = os.path.abspath(host_history_samples_path)
+    run_settings["host_history_samples_format"] = host_history_samples_format
+    if host_history_sample_selection is None or host_history_sample_selection.is_trivial:
+        run_settings["host_history_sample_selection"] = None
+    else:
+        run_settings["host_history_sample_selection"] = host_history_sample_selection.as_definition()
+    run_settings["model_definition_type"] = model_definition_type
+    if isinstance(model_definition_source, str):
+        run_settings["model_definition_source"] = model_definition_source
+    run_settings["maximum_num_restarts_per_replicates"] = maximum_num_restarts_per_replicates
+    run_settings["summary_stats_format"] = summary_stats_format
+    # the summary statistics of each replicate are calculated with
+    # randomizations seeded by its random seed (recorded with it as
+    # completed), so the settings are all that is needed to reproduce them
+    run_settings["summary_stats_config"] = dict(summary_stats_config_d) if summary_stats_config_d else None
+    run_settings["is_index_trees"] = is_index_trees
+    if resumed_run_manifest is not None:
+        resumed_run_manifest.check_settings(run_settings)
+        output_sizes = resumed_run_manifest.output_sizes
+        if output_sizes is None:
+            # nothing was written out before the interruption
+            run_logger.info("-inphest- No completed replicates found in run manifest: starting afresh")
+            resumed_run_manifest = None
+        else:
+            run_logger.info("-inphest- Resuming run: {} replicates already completed".format(len(resumed_run_manifest.completed)))
+
+    # output files (and writers) opened here, by name, to be recorded in the
+    # run manifest
+    run_outputs = collections.OrderedDict()
+    def open_run_output_file(name, filepath):
+        if resumed_run_manifest is not None:
+            manifest.truncate_output_file(filepath, output_sizes[name])
+            f = utility.open_output_file(filepath, append=True)
+        else:
+            f = utility.open_output_file(filepath, output_compression)
+        run_outputs[name] = f
+        opened_files.append(f)
+        return f
     if config_d.get("store_trees", True) and "trees_file" not in config_d:
-        config_d["trees_file"] = open(InphestSimulator.compose_trees_filepath(output_prefix), "w")
+        config_d["trees_file"] = open_run_output_file("trees", InphestSimulator.compose_trees_filepath(output_prefix, output_compression))
+        if is_index_trees and "trees_index_file" not in config_d:
+            if resumed_run_manifest is not None:
+                config_d["trees_index_file"] = columnar.TreesIndexWriter(
+                        config_d["trees_file"].name,
+                        offset=output_sizes["trees"],
+                        num_records=output_sizes["trees_index"])
+            else:
+                config_d["trees_index_file"] = columnar.TreesIndexWriter(config_d["trees_file"].name)
+            run_outputs["trees_index"] = config_d["trees_index_file"]
     if (debug_mode and config_d.get("store_failed_trees", True)) or config_d.get("store_failed_trees", False):
         if "failed_trees_file" not in config_d:
-            config_d["failed_trees_file"] = open(InphestSimulator.compose_failed_trees_filepath(output_prefix), "w")
+            config_d["failed_trees_file"] = open_run_output_file("failed_trees", InphestSimulator.compose_failed_trees_filepath(output_prefix, output_compression))
     if config_d.get("store_summary_stats", True) and "summary_stats_file" not in config_d:
-        config_d["summary_stats_file"] = InphestSimulator.open_summary_stats_file(output_prefix)
+        if resumed_run_manifest is not None:
+            summary_stats_output_size = output_sizes["summary_stats"]
+        else:
+            summary_stats_output_size = None
+        config_d["summary_stats_file"] = InphestSimulator.open_summary_stats_file(
+                output_prefix,
+                compression=None if summary_stats_format == "columns" else output_compression,
+                summary_stats_format=summary_stats_format,
+                output_size=summary_stats_output_size)
+        run_outputs["summary_stats"] = config_d["summary_stats_file"]
+        opened_files.append(config_d["summary_stats_file"])
+        is_summary_stats_header_written = bool(summary_stats_output_size)
+    else:
+        is_summary_stats_header_written = False
+    if "output_sink" not in config_d:
+        config_d["output_sink"] = utility.BufferedOutputSink(
+                max_buffered_records=output_buffer_size,
+                max_buffer_time=output_buffer_time,
+                is_sync=is_sync_output)
+    output_sink = config_d["output_sink"]
+    # the run manifest is only written for (resumable) uncompressed output;
+    # it is the last destination of the sink, so that each batch is recorded
+    # once the output files have been written to
+    if output_compression is None or output_compression == "none":
+        for output in run_outputs.values():
+            output_sink.add_destination(output)
+        config_d["run_manifest"] = manifest.RunManifestWriter(
+                run_manifest_filepath,
+                settings=run_settings,
+                outputs=run_outputs,
+                is_append=resumed_run_manifest is not None)
+        output_sink.add_destination(config_d["run_manifest"])
+        opened_files.append(config_d["run_manifest"])
 
     host_history_samples_path = os.path.normpath(host_history_samples_path)
     run_logger.info("-inphest- Using host biogeographical regime samples from: {}".format(host_history_samples_path))
-    hrs = model.HostHistorySamples()
-    hrs.parse_host_biogeography(
-            src=open(host_history_samples_path, "r"),
+    if host_history_sample_selection is not None:
+        run_logger.info("-inphest- Host biogeographical regime sample selection: {}".format(host_history_sample_selection))
+    hrs = hostcache.load_host_history_samples(
+            source_path=host_history_samples_path,
             schema=host_history_samples_format,
+            sample_selection=host_history_sample_selection,
+            is_use_cache=is_use_host_history_cache,
+            cache_dir=host_history_cache_dir,
+            run_logger=run_logger,
             )
     run_logger.info("-inphest- {} host biogeographical regime samples found in source".format(len(hrs.host_histories), host_history_samples_path))
 
-    current_rep = 0
+    # The model is compiled (and its description written) once, and shared
+    # by all replicates and restarts.
+    inphest_model = model.InphestModel.create(
+            model_definition_source=model_definition_source,
+            model_definition_type=model_definition_type,
+            interpolate_missing_model_values=interpolate_missing_model_values,
+            run_logger=run_logger,
+            )
+    if config_d.pop("store_model_description", True):
+        model_description_file = config_d.pop("model_description_file", None)
+        if model_description_file is None:
+            with open(output_prefix + ".model.log.json", "w") as model_description_file:
+                inphest_model.write_model(model_description_file)
+        else:
+            inphest_model.write_model(model_description_file)
+    config_d["store_model_description"] = False
+
+    # The host-side reference structures against which the symbiont
+    # phylogenies are compared are computed once for each host history (or
+    # read from the cache), and shared by all replicates and workers.
+    summary_statistic_groups = (summary_stats_config_d or {}).get("statistic_groups", None)
+    if summary_statistic_groups is None:
+        summary_statistic_groups = inphest_model.summary_statistic_groups
+    if summary_statistic_groups is None:
+        summary_statistic_groups = summarize.SummaryStatsCalculator.DEFAULT_STATISTIC_GROUPS
+    if is_use_host_history_cache and (host_history_sample_selection is None or host_history_sample_selection.is_reproducible):
+        host_reference_cache_filepath = hostcache.compose_host_reference_cache_filepath(
+                source_path=host_history_samples_path,
+                schema=host_history_samples_format,
+                sample_selection=host_history_sample_selection,
+                cache_dir=host_history_cache_dir)
+    else:
+        host_reference_cache_filepath = None
+    host_references = hostcache.load_host_references(
+            host_histories=hrs.host_histories,
+            statistic_groups=summarize.SummaryStatsCalculator.validate_statistic_groups(summary_statistic_groups),
+            cache_filepath=host_reference_cache_filepath,
+            run_logger=run_logger)
+
+    num_host_histories = len(hrs.host_histories)
+    if num_summary_stats_workers:
+        summary_stats_pipeline = pipeline.SummaryStatsPipeline(
+                host_histories=hrs.host_histories,
+                num_workers=num_summary_stats_workers,
+                trees_file=config_d.get("trees_file", None),
+                summary_stats_file=config_d.pop("summary_stats_file", None),
+                failed_trees_file=config_d.get("failed_trees_file", None),
+                max_queue_size=summary_stats_queue_size,
+                summary_stats_config_d=summary_stats_config_d,
+                debug_mode=debug_mode,
+                host_references=host_references,
+                output_sink=output_sink,
+                is_summary_stats_header_written=is_summary_stats_header_written)
+        config_d["summary_stats_pipeline"] = summary_stats_pipeline
+        run_logger.info("-inphest- Calculating summary statistics asynchronously using {} worker processes".format(num_summary_stats_workers))
+    else:
+        summary_stats_pipeline = None
+
+    # Each job is a (replicate index, host history index, number of restarts)
+    # tuple; failed jobs are restarted ahead of the remaining ones. When
+    # summary statistics are calculated asynchronously, jobs that have been
+    # simulated are held until their summary statistics calculation has
+    # either succeeded or failed.
+    if resumed_run_manifest is not None:
+        completed_jobs = set((rep_idx, hh_idx) for rep_idx, hh_idx, seed in resumed_run_manifest.completed)
+    else:
+        completed_jobs = set()
+    # when resuming, replicates that were interrupted after being
+    # checkpointed are restored from their checkpoint, by identifying the
+    # restart that was checkpointed from its random seed
+    def compose_checkpoint_filepath(current_rep, host_history_idx):
+        return checkpoint.compose_checkpoint_filepath("{}.R{:04d}.H{:04d}".format(output_prefix, current_rep+1, host_history_idx+1))
+    def find_checkpointed_job(current_rep, host_history_idx):
+        checkpoint_filepath = compose_checkpoint_filepath(current_rep, host_history_idx)
+        if not os.path.exists(checkpoint_filepath):
+            return None
+        checkpoint_random_seed = checkpoint.read_checkpoint_header(checkpoint_filepath)["random_seed"]
+        for num_restarts in range(maximum_num_restarts_per_replicates+1):
+            if compose_replicate_random_seed(random_seed, current_rep, host_history_idx, num_restarts) == checkpoint_random_seed:
+                return (current_rep, host_history_idx, num_restarts)
+        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Ignoring checkpoint from a different run: {}".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, checkpoint_filepath))
+        return None
+    checkpointed_jobs = set()
+    jobs = collections.deque()
+    for current_rep in range(nreps):
+        for host_history_idx in range(num_host_histories):
+            if (current_rep, host_history_idx) in completed_jobs:
+                continue
+            job = None
+            if is_resume:
+                job = find_checkpointed_job(current_rep, host_history_idx)
+            if job is None:
+                job = (current_rep, host_history_idx, 0)
+            else:
+                checkpointed_jobs.add(job)
+            jobs.append(job)
+    submitted_jobs = {}
     summary_stats_calculators = {}
-    while current_rep < nreps:
-        for host_history_idx, host_history in enumerate(hrs.host_histories):
-            simulation_name="Run_{}_{}".format(current_rep+1, host_history_idx+1)
-            run_output_prefix = "{}.R{:04d}.H{:04d}".format(output_prefix, current_rep+1, host_history_idx+1)
-            run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Starting".format(current_rep+1, nreps, host_history_idx+1, len(hrs.host_histories)))
-            num_restarts = 0
-            try:
-                summary_stats_calculator = summary_stats_calculators[host_history]
-            except KeyError:
-                summary_stats_calculator = summarize.SummaryStatsCalculator(
-                        host_history=host_history,
-                        debug_mode=debug_mode,
-                        )
-                summary_stats_calculators[host_history] = summary_stats_calculator
-            while True:
-                if num_restarts == 0 and current_rep == 0:
-                    is_verbose_setup = True
-                    config_d["is_summary_stats_header_written"] = False
-                    model_setup_logger = run_logger
+    host_systems = {}
+    if summary_stats_pipeline is None:
+        config_d["is_summary_stats_header_written"] = is_summary_stats_header_written
+    is_verbose_setup = True
+
+    def restart_job(job, e, inphest_simulator=None):
+        current_rep, host_history_idx, num_restarts = job
+        if isinstance(e, error.PreTerminationFailedSimulationException):
+            run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Simulation failure at t = {} before termination condition reached: {}".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, inphest_simulator.elapsed_time, e))
+        elif isinstance(e, error.PostTerminationFailedSimulationException):
+            run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Post-simulation failure: {}".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, e))
+        else:
+            run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Simulation failure: {}".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, e))
+        num_restarts += 1
+        if num_restarts > maximum_num_restarts_per_replicates:
+            run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Maximum number of restarts exceeded: aborting".format(current_rep+1, nreps, host_history_idx+1, num_host_histories))
+        else:
+            run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Restarting replicate (number of restarts: {})".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, num_restarts))
+            jobs.appendleft((current_rep, host_history_idx, num_restarts))
+
+    # trees and summary statistics of completed replicates still held in the
+    # output sink are written out whatever happens
+    try:
+        while jobs or submitted_jobs:
+            if jobs:
+                job = jobs.popleft()
+                current_rep, host_history_idx, num_restarts = job
+                host_history = hrs.host_histories[host_history_idx]
+                simulation_name="Run_{}_{}".format(current_rep+1, host_history_idx+1)
+                run_output_prefix = "{}.R{:04d}.H{:04d}".format(output_prefix, current_rep+1, host_history_idx+1)
+                if num_restarts == 0:
+                    run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Starting".format(current_rep+1, nreps, host_history_idx+1, num_host_histories))
+                try:
+                    summary_stats_calculator = summary_stats_calculators[host_history]
+                except KeyError:
+                    summary_stats_calculator = summarize.SummaryStatsCalculator(
+                            host_history=host_history,
+                            debug_mode=debug_mode,
+                            config_d=summary_stats_config_d,
+                            host_references=host_references[host_history_idx],
+                            )
+                    summary_stats_calculators[host_history] = summary_stats_calculator
+                # the host system of each host history is compiled once, and
+                # reset by each replicate (or restart)
+                host_system = host_systems.get(host_history, None)
+                config_d["name"] = simulation_name
+                config_d["replicate_idx"] = current_rep
+                config_d["host_history_idx"] = host_history_idx
+                # each replicate (or restart) is simulated using its own
+                # random seed, recorded in the trees index and run manifest
+                config_d["random_seed"] = compose_replicate_random_seed(random_seed, current_rep, host_history_idx, num_restarts)
+                run_logger.debug("-inphest- Replicate {} of {}, host regime {} of {}: Using random seed: {}".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, config_d["random_seed"]))
+                if checkpoint_interval is not None or job in checkpointed_jobs:
+                    config_d["checkpoint_path"] = compose_checkpoint_filepath(current_rep, host_history_idx)
                 else:
-                    is_verbose_setup = False
-                    model_setup_logger = None
-                inphest_model = model.InphestModel.create(
-                        model_definition_source=model_definition_source,
-                        model_definition_type=model_definition_type,
-                        interpolate_missing_model_values=interpolate_missing_model_values,
-                        run_logger=model_setup_logger,
-                        )
-                # inphest_model = model.InphestModel.create(
-                #         model_definition_source=model_definition_source,
-                #         model_definition_type=model_definition_type,
-                #         interpolate_missing_model_values=interpolate_missing_model_values,
-                #         run_logger=model_setup_logger,
-                #         )
+                    config_d["checkpoint_path"] = None
+                config_d["checkpoint_interval"] = checkpoint_interval
+                config_d["restore_checkpoint"] = job in checkpointed_jobs
                 inphest_simulator = InphestSimulator(
                     inphest_model=inphest_model,
                     host_history=host_history,
                     config_d=config_d,
                     is_verbose_setup=is_verbose_setup,
                     summary_stats_calculator=summary_stats_calculator,
+                    host_system=host_system,
                     )
+                host_systems[host_history] = inphest_simulator.host_system
+                is_verbose_setup = False
                 try:
                     inphest_simulator.run()
-                    config_d["is_summary_stats_header_written"] = True
+                    if summary_stats_pipeline is None:
+                        config_d["is_summary_stats_header_written"] = True
                     run_logger.system = None
                 except error.InphestException as e:
                     run_logger.system = None
-                    if isinstance(e, error.PreTerminationFailedSimulationException):
-                        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Simulation failure at t = {} before termination condition reached: {}".format(current_rep+1, nreps, host_history_idx+1, len(hrs.host_histories), inphest_simulator.elapsed_time, e))
-                    elif isinstance(e, error.PostTerminationFailedSimulationException):
-                        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Post-simulation failure: {}".format(current_rep+1, nreps, host_history_idx+1, len(hrs.host_histories), e))
-                    else:
-                        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Simulation failure: {}".format(current_rep+1, nreps, host_history_idx+1, len(hrs.host_histories), e))
-                    num_restarts += 1
-                    if num_restarts > maximum_num_restarts_per_replicates:
-                        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Maximum number of restarts exceeded: aborting".format(current_rep+1, nreps, host_history_idx+1, len(hrs.host_histories)))
-                        break
-                    else:
-                        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Restarting replicate (number of restarts: {})".format(current_rep+1, nreps, host_history_idx+1, len(hrs.host_histories), num_restarts))
+                    inphest_simulator.discard_checkpoint()
+                    restart_job(job, e, inphest_simulator)
                 else:
                     run_logger.system = None
-                    run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Completed to termination condition at t = {}".format(current_rep+1, nreps, host_history_idx+1, len(hrs.host_histories), inphest_simulator.elapsed_time))
-                    num_restarts = 0
-                    break
-        current_rep += 1
+                    inphest_simulator.discard_checkpoint()
+                    if summary_stats_pipeline is None:
+                        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Completed to termination condition at t = {}".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, inphest_simulator.elapsed_time))
+                    else:
+                        run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Completed to termination condition at t = {}: summary statistics pending".format(current_rep+1, nreps, host_history_idx+1, num_host_histories, inphest_simulator.elapsed_time))
+                        submitted_jobs[simulation_name] = job
+                if summary_stats_pipeline is None:
+                    continue
+                completed_task_keys, failures = summary_stats_pipeline.collect(timeout=0)
+            else:
+                completed_task_keys, failures = summary_stats_pipeline.collect()
+            for task_key in completed_task_keys:
+                current_rep, host_history_idx, num_restarts = submitted_jobs.pop(task_key)
+                run_logger.info("-inphest- Replicate {} of {}, host regime {} of {}: Summary statistics and trees stored".format(current_rep+1, nreps, host_history_idx+1, num_host_histories))
+            for task_key, e in failures:
+                restart_job(submitted_jobs.pop(task_key), e)
+        if summary_stats_pipeline is not None:
+            summary_stats_pipeline.close()
+            del config_d["summary_stats_pipeline"]
+    finally:
+        output_sink.close()
+        for opened_file in opened_files:
+            opened_file.close()
+
+    statistic_group_costs_list = [summary_stats_calculator.statistic_group_costs for summary_stats_calculator in summary_stats_calculators.values()]
+    if summary_stats_pipeline is not None:
+        statistic_group_costs_list.append(summary_stats_pipeline.statistic_group_costs)
+    statistic_group_costs = summarize.SummaryStatsCalculator.merge_statistic_group_costs(statistic_group_costs_list)
+    for description in summarize.SummaryStatsCalculator.statistic_group_cost_report(statistic_group_costs):
+        run_logger.info("-inphest- Summary statistic group {}".format(description))
+    if opened_run_logger is not None:
+        opened_run_logger.close()
 
 if __name__ == "__main__":
     rb_data = os.path.join(utility.TEST_DATA_PATH, "revbayes", "bg_large.events.txt")
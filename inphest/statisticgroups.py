@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Names of the groups of summary statistics that can be selected for
+calculation.
+
+Kept apart from |summarize|, which calculates them, so that model
+definitions can be validated without importing the statistics stack.
+"""
+
+# In the order in which they are calculated and reported.
+STATISTIC_GROUPS = (
+    "community",
+    "tree_shape_kernel",
+    "profile_distance",
+    )
+DEFAULT_STATISTIC_GROUPS = ("community",)
+
+def validate_statistic_groups(statistic_groups):
+    """
+    Returns ``statistic_groups`` as a tuple of names in calculation order,
+    raising a ValueError if any of them is not a recognized group.
+    """
+    statistic_groups = set(statistic_groups)
+    unrecognized = statistic_groups - set(STATISTIC_GROUPS)
+    if unrecognized:
+        raise ValueError("Unrecognized summary statistic groups: {} (supported: {})".format(
+            ", ".join(sorted(unrecognized)),
+            ", ".join(STATISTIC_GROUPS)))
+    if not statistic_groups:
+        raise ValueError("No summary statistic groups selected")
+    return tuple(name for name in STATISTIC_GROUPS if name in statistic_groups)
@@ -11,16 +11,20 @@
 ##############################################################################
 
 import collections
-import itertools
 import math
-import subprocess
+import re
+import time
+import numpy
 import dendropy
 from dendropy.calculate import treecompare
 from dendropy.calculate import profiledistance
 from dendropy.utility import constants
 from dendropy.calculate import statistics
-from dendropy.interop import paup
+from inphest import communityecology
 from inphest import error
+from inphest import model
+from inphest import statisticgroups
+from inphest import utility
 
 
 def estimate_tree_from_assemblage_leafsets(
@@ -29,48 +33,618 @@ def estimate_tree_from_assemblage_leafsets(
         membership_element_type=dendropy.Taxon,
         only_include_taxa=None,
         ):
-    d = collections.OrderedDict()
-    blank = ["0" for i in range(len(assemblage_memberships))]
-    exclude_from_taxa_blocks = set()
-    for taxon in taxon_namespace:
-        if not only_include_taxa or taxon in only_include_taxa:
-            d[taxon] = list(blank)
-        else:
-            exclude_from_taxa_blocks.add(taxon)
-    for idx, taxa in enumerate(assemblage_memberships):
+    """
+    Returns an (unrooted) tree of the taxa in ``taxon_namespace`` (or, if
+    given, only those in ``only_include_taxa``) estimated from their
+    memberships in ``assemblage_memberships`` (a list of sets of taxa or, if
+    ``membership_element_type`` is |dendropy.Node|, of nodes), by neighbor
+    joining on the Jaccard distances between the sets of assemblages to which
+    each taxon belongs. Runs in-process, in O(n^3) time for n taxa.
+    """
+    taxa = [taxon for taxon in taxon_namespace if not only_include_taxa or taxon in only_include_taxa]
+    taxon_indexes = dict((taxon, idx) for idx, taxon in enumerate(taxa))
+    occurrences = numpy.zeros((len(taxa), len(assemblage_memberships)), dtype=bool)
+    for idx, members in enumerate(assemblage_memberships):
         if membership_element_type is dendropy.Taxon:
-            for taxon in taxa:
-                d[taxon][idx] = "1"
+            member_taxa = members
         elif membership_element_type is dendropy.Node:
-            for node in taxa:
-                d[node.taxon][idx] = "1"
+            member_taxa = [node.taxon for node in members]
         else:
             raise TypeError(membership_element_type)
-    # for membership_idx, membership in enumerate(assemblage_memberships):
-    #     for element in membership:
-    #         if membership_element_type is dendropy.Taxon:
-    #             taxon = element
-    #     elif membership_element_type is dendropy.Node:
-    #             taxon = element.taxon
-    #     else:
-    #         raise TypeError(membership_element_type)
-    char_matrix = dendropy.StandardCharacterMatrix.from_dict(
-            source_dict=d,
+        for taxon in member_taxa:
+            if taxon in taxon_indexes:
+                occurrences[taxon_indexes[taxon], idx] = True
+    occurrences = occurrences.astype(numpy.float64)
+    intersections = occurrences.dot(occurrences.T)
+    sizes = occurrences.sum(axis=1)
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    # taxa that belong to no assemblage are at distance 0 from each other,
+    # and 1 from all others
+    distances = 1.0 - numpy.divide(intersections, unions, out=numpy.ones_like(unions), where=unions > 0)
+    numpy.fill_diagonal(distances, 0.0)
+    return neighbor_joining_tree(
+            taxa=taxa,
+            distances=distances,
             taxon_namespace=taxon_namespace)
-    try:
-        tree = paup.estimate_tree(
-                char_matrix=char_matrix,
-                tree_est_criterion="parsimony",
-                num_states=len(assemblage_memberships),
-                char_matrix_writing_kwargs={"exclude_from_taxa_blocks": exclude_from_taxa_blocks},
-                timeout=60,
-                )
-    except subprocess.TimeoutExpired:
-        raise error.SummaryStatisticCalculationExternalProcessTimeoutExpired
+
+def neighbor_joining_tree(taxa, distances, taxon_namespace=None):
+    """
+    Returns the (unrooted) neighbor-joining tree of ``taxa`` given the
+    (symmetric) matrix of pairwise ``distances`` between them. Negative edge
+    lengths are set to 0.
+    """
+    tree = dendropy.Tree(taxon_namespace=taxon_namespace, is_rooted=False)
+    nodes = [dendropy.Node(taxon=taxon) for taxon in taxa]
+    if len(nodes) <= 3:
+        for idx, nd in enumerate(nodes):
+            if len(nodes) == 1:
+                edge_length = 0.0
+            elif len(nodes) == 2:
+                edge_length = distances[0][1] / 2.0
+            else:
+                others = [jdx for jdx in range(3) if jdx != idx]
+                edge_length = max(0.0, (distances[idx][others[0]] + distances[idx][others[1]] - distances[others[0]][others[1]]) / 2.0)
+            nd.edge.length = edge_length
+            tree.seed_node.add_child(nd)
+        return tree
+    d = numpy.array(distances, dtype=numpy.float64)
+    active = list(range(len(nodes)))
+    while len(active) > 3:
+        n = len(active)
+        sub = d[numpy.ix_(active, active)]
+        row_sums = sub.sum(axis=1)
+        q = (n - 2) * sub - row_sums[:, None] - row_sums[None, :]
+        numpy.fill_diagonal(q, numpy.inf)
+        i, j = numpy.unravel_index(numpy.argmin(q), q.shape)
+        delta = (row_sums[i] - row_sums[j]) / (n - 2)
+        ni, nj = active[i], active[j]
+        new_node = dendropy.Node()
+        nodes[ni].edge.length = max(0.0, (sub[i, j] + delta) / 2.0)
+        nodes[nj].edge.length = max(0.0, (sub[i, j] - delta) / 2.0)
+        new_node.add_child(nodes[ni])
+        new_node.add_child(nodes[nj])
+        # the new node takes the place (row and column) of the first of the
+        # pair joined
+        new_distances = (sub[i, :] + sub[j, :] - sub[i, j]) / 2.0
+        d[ni, active] = new_distances
+        d[active, ni] = new_distances
+        d[ni, ni] = 0.0
+        nodes[ni] = new_node
+        active.remove(nj)
+    i, j, k = active
+    for a, b, c in ((i, j, k), (j, i, k), (k, i, j)):
+        nodes[a].edge.length = max(0.0, (d[a, b] + d[a, c] - d[b, c]) / 2.0)
+        tree.seed_node.add_child(nodes[a])
     return tree
 
+class SymbiontPhylogenySample(object):
+    """
+    A compact, picklable snapshot of a symbiont phylogeny and its leaf
+    assemblages (by area and by host), as needed to calculate its summary
+    statistics independently of the simulation (e.g., in a separate process).
+    Nodes are stored in preorder, so that each parent precedes its children.
+    """
+
+    @classmethod
+    def from_assemblage_leaf_sets(cls,
+            symbiont_phylogeny,
+            leaf_sets_by_area,
+            leaf_sets_by_host):
+        node_positions = {}
+        node_indexes = []
+        parent_positions = []
+        edge_lengths = []
+        for nd in symbiont_phylogeny.preorder_node_iter():
+            node_positions[nd] = len(node_indexes)
+            node_indexes.append(nd.index)
+            if nd.parent_node is None:
+                parent_positions.append(-1)
+            else:
+                parent_positions.append(node_positions[nd.parent_node])
+            edge_lengths.append(nd.edge.length)
+        area_leaf_positions = [sorted(node_positions[nd] for nd in leaf_set) for leaf_set in leaf_sets_by_area]
+        host_leaf_positions = [sorted(node_positions[nd] for nd in leaf_set) for leaf_set in leaf_sets_by_host]
+        return cls(
+                node_indexes=node_indexes,
+                parent_positions=parent_positions,
+                edge_lengths=edge_lengths,
+                area_leaf_positions=area_leaf_positions,
+                host_leaf_positions=host_leaf_positions)
+
+    def __init__(self,
+            node_indexes,
+            parent_positions,
+            edge_lengths,
+            area_leaf_positions,
+            host_leaf_positions):
+        self.node_indexes = node_indexes
+        self.parent_positions = parent_positions
+        self.edge_lengths = edge_lengths
+        self.area_leaf_positions = area_leaf_positions
+        self.host_leaf_positions = host_leaf_positions
+
+    def compose_tree(self):
+        """
+        Returns a tuple of the reconstructed tree and its leaf sets by area and
+        by host.
+        """
+        tree = dendropy.Tree(is_rooted=True)
+        nodes = []
+        for node_index, parent_position, edge_length in zip(self.node_indexes, self.parent_positions, self.edge_lengths):
+            if parent_position < 0:
+                nd = tree.seed_node
+            else:
+                nd = nodes[parent_position].new_child()
+            nd.index = node_index
+            nd.edge.length = edge_length
+            nodes.append(nd)
+        leaf_sets_by_area = [set(nodes[position] for position in positions) for positions in self.area_leaf_positions]
+        leaf_sets_by_host = [set(nodes[position] for position in positions) for positions in self.host_leaf_positions]
+        return tree, leaf_sets_by_area, leaf_sets_by_host
+
+class EncodedSymbiontPhylogenySample(object):
+    """
+    A symbiont phylogeny as written by the simulator, in NEWICK format, with
+    the host and area occurrences of each leaf encoded in its label (see
+    |model.InphestModel.compose_encoded_label|), and the model and host
+    history identified in the tree comment metadata. Can be used wherever a
+    |SymbiontPhylogenySample| is; the tree is only parsed when composed.
+    """
+
+    _TREE_COMMENT_PATTERN = re.compile(r"\[&([^\]]*)\]")
+    _TREE_METADATA_PATTERN = re.compile(r"([A-Za-z_][A-Za-z0-9_.]*)=('[^']*'|\"[^\"]*\"|[^,]*)")
+    @staticmethod
+    def iterate_tree_strings(src):
+        """
+        Iterates over the NEWICK tree statements in ``src`` (one or more lines
+        each, as written by the simulator), reading no more than one tree
+        statement at a time.
+        """
+        lines = []
+        for line in src:
+            if not line.strip():
+                continue
+            lines.append(line)
+            if line.rstrip().endswith(";"):
+                yield "".join(lines)
+                lines = []
+        if lines:
+            raise ValueError("Incomplete tree statement at end of data: '{}'".format("".join(lines)[:100]))
+
+    def __init__(self, tree_str):
+        self.tree_str = tree_str
+        self.metadata = {}
+        for comment in EncodedSymbiontPhylogenySample._TREE_COMMENT_PATTERN.finditer(tree_str[:tree_str.find("(")]):
+            for match in EncodedSymbiontPhylogenySample._TREE_METADATA_PATTERN.finditer(comment.group(1)):
+                self.metadata[match.group(1)] = match.group(2).strip("'\"")
+
+    def compose_tree(self):
+        """
+        Returns a tuple of the tree and its leaf sets by area and by host.
+        """
+        tree = dendropy.Tree.get(
+                data=self.tree_str,
+                schema="newick",
+                rooting="force-rooted",
+                suppress_leaf_node_taxa=True,
+                suppress_internal_node_taxa=True,
+                )
+        leaf_sets_by_area = None
+        leaf_sets_by_host = None
+        for nd_idx, nd in enumerate(tree.preorder_node_iter()):
+            nd.index = nd_idx
+            if nd._child_nodes:
+                continue
+            lineage_index, host_occurrences, area_occurrences = model.InphestModel.decode_label(nd.label or "")
+            if leaf_sets_by_host is None:
+                leaf_sets_by_host = [set() for i in host_occurrences]
+                leaf_sets_by_area = [set() for i in area_occurrences]
+            elif len(host_occurrences) != len(leaf_sets_by_host) or len(area_occurrences) != len(leaf_sets_by_area):
+                raise ValueError("Inconsistent number of hosts or areas encoded in leaf label: '{}'".format(nd.label))
+            for host_idx, occurrence in enumerate(host_occurrences):
+                if occurrence == "1":
+                    leaf_sets_by_host[host_idx].add(nd)
+            for area_idx, occurrence in enumerate(area_occurrences):
+                if occurrence == "1":
+                    leaf_sets_by_area[area_idx].add(nd)
+        return tree, leaf_sets_by_area, leaf_sets_by_host
+
+class TreeShapeKernel(treecompare.TreeShapeKernel):
+    """
+    Tree shape kernel (see |treecompare.TreeShapeKernel|) with the values
+    precomputed for each tree cached, keyed by the shape of the tree (its
+    branching structure and edge lengths, in traversal order) rather than
+    the tree object. Trees of the same shape thus share an entry, and trees
+    that have been modified since they were last seen are never matched with
+    stale entries, so caches never need to be explicitly updated.
+
+    Trees that are compared over and over (i.e., the host tree and its
+    subtrees) are pinned using :meth:`pin_tree`: their entries are kept for
+    the lifetime of the kernel, and may be shared with other kernels (see
+    :meth:`derive`). All other trees are held in a least-recently-used cache
+    of at most ``max_cache_size`` entries, so that entries of trees that are
+    no longer compared are eventually evicted without ever displacing pinned
+    ones.
+    """
+
+    DEFAULT_MAX_CACHE_SIZE = 256
+
+    def __init__(self, **kwargs):
+        self.max_cache_size = kwargs.pop("max_cache_size", TreeShapeKernel.DEFAULT_MAX_CACHE_SIZE)
+        pinned_cache = kwargs.pop("pinned_cache", None)
+        treecompare.TreeShapeKernel.__init__(self, **kwargs)
+        self._tree_cache = collections.OrderedDict()
+        if pinned_cache is None:
+            pinned_cache = {}
+        self._pinned_cache = pinned_cache
+        self.num_cache_hits = 0
+        self.num_cache_misses = 0
+
+    def derive(self, max_cache_size=None):
+        """
+        Returns a new kernel with the same parameters, sharing the pinned
+        entries of this one (including those pinned later by either), but
+        with its own least-recently-used cache of at most ``max_cache_size``
+        (by default, that of this kernel) entries for all other trees.
+        """
+        if max_cache_size is None:
+            max_cache_size = self.max_cache_size
+        return TreeShapeKernel(
+                sigma=self.sigma,
+                gauss_factor=self.gauss_factor,
+                decay_factor=self.decay_factor,
+                max_cache_size=max_cache_size,
+                pinned_cache=self._pinned_cache)
+
+    @staticmethod
+    def compose_tree_key(tree):
+        """
+        Returns a key identifying the shape of ``tree``, as seen by the
+        kernel.
+        """
+        return tuple((len(nd._child_nodes), nd.edge.length) for nd in tree.postorder_node_iter())
+
+    @staticmethod
+    def compose_tree_fragments(tree):
+        """
+        Returns the values needed for the kernel trick for each internal node
+        of ``tree``, in postorder, as a tuple of the node's production, the
+        lengths of its child edges, their sum of squares and, for each child,
+        its production and index (or |None| if it is a leaf).
+        """
+        fragments = []
+        node_fragment_indexes = {}
+        for nd in tree.postorder_internal_node_iter():
+            nterms = 0
+            edge_lengths = []
+            children = []
+            for ch in nd._child_nodes:
+                if ch._child_nodes:
+                    ch_idx = node_fragment_indexes[ch]
+                    children.append((fragments[ch_idx][0], ch_idx))
+                else:
+                    nterms += 1
+                    children.append((0, None))
+                edge_lengths.append(ch.edge.length)
+            node_fragment_indexes[nd] = len(fragments)
+            fragments.append((
+                nterms + 1,
+                edge_lengths,
+                sum([elen**2 for elen in edge_lengths]),
+                children))
+        return fragments
+
+    def remove_from_cache(self, tree):
+        """
+        Removes the entry of ``tree`` from the least-recently-used cache
+        (pinned entries are kept).
+        """
+        self._tree_cache.pop(TreeShapeKernel.compose_tree_key(tree), None)
+
+    def clear_cache(self):
+        """
+        Clears the least-recently-used cache (pinned entries are kept).
+        """
+        self._tree_cache.clear()
+
+    def pin_tree(self, tree):
+        """
+        Caches the values needed for the kernel trick with ``tree`` for the
+        lifetime of the kernel (and of any kernels sharing its pinned
+        entries), and returns them.
+        """
+        key = TreeShapeKernel.compose_tree_key(tree)
+        try:
+            return self._pinned_cache[key]
+        except KeyError:
+            fragments = self._tree_cache.pop(key, None)
+            if fragments is None:
+                fragments = TreeShapeKernel.compose_tree_fragments(tree)
+            self._pinned_cache[key] = fragments
+            return fragments
+
+    def update_cache(self, tree):
+        """
+        Returns the (cached, if possible) values needed for the kernel trick
+        with this tree.
+        """
+        key = TreeShapeKernel.compose_tree_key(tree)
+        try:
+            fragments = self._pinned_cache[key]
+        except KeyError:
+            pass
+        else:
+            self.num_cache_hits += 1
+            return fragments
+        try:
+            fragments = self._tree_cache[key]
+        except KeyError:
+            self.num_cache_misses += 1
+            fragments = TreeShapeKernel.compose_tree_fragments(tree)
+            self._tree_cache[key] = fragments
+            while len(self._tree_cache) > self.max_cache_size:
+                self._tree_cache.popitem(last=False)
+        else:
+            self.num_cache_hits += 1
+            self._tree_cache.move_to_end(key)
+        return fragments
+
+    def __call__(self,
+            tree1,
+            tree2,
+            is_tree1_cache_updated=False,
+            is_tree2_cache_updated=False,
+            ):
+        """
+        Returns the tree shape kernel score of ``tree1`` and ``tree2``.
+        ``is_tree1_cache_updated`` and ``is_tree2_cache_updated`` are
+        accepted for compatibility, but ignored: cache entries are always
+        current.
+        """
+        fragments1 = self.update_cache(tree1)
+        fragments2 = self.update_cache(tree2)
+        sigma = self.sigma
+        decay_factor = self.decay_factor
+        gauss_factor = self.gauss_factor
+        dp_matrix = {}
+        k = 0
+        for idx1, (production1, edge_lengths1, ssq1, children1) in enumerate(fragments1):
+            for idx2, (production2, edge_lengths2, ssq2, children2) in enumerate(fragments2):
+                if production1 != production2:
+                    continue
+                res = decay_factor * math.exp( -1. / gauss_factor
+                    * (ssq1 + ssq2 - 2*sum([(edge_lengths1[i]*edge_lengths2[i]) for i in range(len(edge_lengths1))])))
+                for (c1_production, c1_idx), (c2_production, c2_idx) in zip(children1, children2):
+                    if c1_production != c2_production:
+                        continue
+                    if c1_production == 0:
+                        # branches are terminal
+                        res *= sigma + decay_factor
+                    else:
+                        try:
+                            res *= sigma + dp_matrix[(c1_idx, c2_idx)]
+                        except KeyError:
+                            res *= sigma
+                dp_matrix[(idx1, idx2)] = res
+                k += res
+        return k
+
+class HostReferenceStructures(object):
+    """
+    The host-side structures against which symbiont phylogenies are compared
+    (the subtrees of the host tree induced by the areas, the profiles of the
+    host tree and of these subtrees, and the tree shape kernel with their
+    values cached), computed once per host history and shared by all
+    replicates simulated on it.
+
+    Instances can be pickled (e.g., to be sent to worker processes), in which
+    case neither the host history itself nor the tree shape kernel values
+    (which are cheap to recalculate) are included: the host history must be
+    reattached using :meth:`bind_to_host_history` on loading. The computed
+    structures can also be written out as plain data (e.g., to be stored in
+    a cache file) using :meth:`as_definition`, and restored using
+    :meth:`from_definition`.
+    """
+
+    # The settings of a |profiledistance.TreeProfile| that are not derived
+    # from the measurements themselves.
+    _TREE_PROFILE_SETTINGS = (
+        "tree_id",
+        "is_measure_edge_lengths",
+        "is_measure_patristic_distances",
+        "is_measure_patristic_steps",
+        "is_measure_node_distances",
+        "is_measure_node_steps",
+        "is_measure_node_ages",
+        "is_measure_coalescence_intervals",
+        "is_normalize",
+        "is_skip_normalization_on_zero_division_error",
+        "ultrametricity_precision",
+        )
+
+    @staticmethod
+    def _tree_as_definition(tree):
+        return tree.as_string(
+                schema="newick",
+                suppress_rooting=True,
+                suppress_annotations=True,
+                suppress_internal_node_labels=True,
+                ).strip()
+
+    @staticmethod
+    def _tree_profile_as_definition(tree_profile):
+        d = collections.OrderedDict()
+        for name in HostReferenceStructures._TREE_PROFILE_SETTINGS:
+            d[name] = getattr(tree_profile, name)
+        d["measurements"] = collections.OrderedDict()
+        for name, measurement_profile in tree_profile.measurement_profiles.items():
+            d["measurements"][name] = {
+                    "profile_data": list(measurement_profile._profile_data),
+                    "fixed_size": measurement_profile.fixed_size,
+                    "interpolation_method": measurement_profile.interpolation_method,
+                    }
+        return d
+
+    @staticmethod
+    def _tree_profile_from_definition(definition):
+        # the measurements are restored as stored rather than recalculated
+        tree_profile = profiledistance.TreeProfile.__new__(profiledistance.TreeProfile)
+        for name in HostReferenceStructures._TREE_PROFILE_SETTINGS:
+            setattr(tree_profile, name, definition[name])
+        tree_profile.measurement_profiles = collections.OrderedDict()
+        for name, measurement in definition["measurements"].items():
+            measurement_profile = profiledistance.MeasurementProfile(
+                    profile_data=measurement["profile_data"],
+                    interpolation_method=measurement["interpolation_method"])
+            measurement_profile.fixed_size = measurement["fixed_size"]
+            tree_profile.measurement_profiles[name] = measurement_profile
+        return tree_profile
+
+    @classmethod
+    def from_definition(cls, definition, host_history):
+        """
+        Returns a new instance bound to ``host_history``, with the structures
+        given by ``definition`` (as returned by :meth:`as_definition` for the
+        same host tree and area assemblages).
+        """
+        host_references = cls(host_history)
+        if definition.get("host_area_assemblage_trees") is not None:
+            host_references._host_area_assemblage_trees = [dendropy.Tree.get(
+                    data=tree_str,
+                    schema="newick",
+                    rooting="force-rooted",
+                    taxon_namespace=host_history.taxon_namespace,
+                    ) for tree_str in definition["host_area_assemblage_trees"]]
+        if definition.get("host_tree_profile") is not None:
+            host_references._host_tree_profile = HostReferenceStructures._tree_profile_from_definition(definition["host_tree_profile"])
+        if definition.get("host_area_assemblage_tree_profiles") is not None:
+            host_references._host_area_assemblage_tree_profiles = [HostReferenceStructures._tree_profile_from_definition(d)
+                    for d in definition["host_area_assemblage_tree_profiles"]]
+        return host_references
+
+    # The (picklable) reference structures required by each of the groups
+    # of summary statistics.
+    STATISTIC_GROUP_REQUIREMENTS = {
+        "community": (),
+        "tree_shape_kernel": ("host_area_assemblage_trees",),
+        "profile_distance": ("host_area_assemblage_trees", "host_tree_profile", "host_area_assemblage_tree_profiles"),
+    }
+
+    def __init__(self, host_history):
+        self.host_history = host_history
+        self.host_tree = host_history.tree
+        self.tree_shape_kernel = TreeShapeKernel()
+        self._is_tree_shape_kernel_cache_updated = False
+        self._host_area_assemblage_trees = None
+        self._host_tree_profile = None
+        self._host_area_assemblage_tree_profiles = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["host_history"] = None
+        state["tree_shape_kernel"] = None
+        state["_is_tree_shape_kernel_cache_updated"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tree_shape_kernel = TreeShapeKernel()
+
+    def bind_to_host_history(self, host_history):
+        self.host_history = host_history
+
+    def as_definition(self):
+        """
+        Returns the structures computed so far as plain (JSON-serializable)
+        data, from which they can be restored using :meth:`from_definition`.
+        """
+        d = collections.OrderedDict()
+        if self._host_area_assemblage_trees is None:
+            d["host_area_assemblage_trees"] = None
+        else:
+            d["host_area_assemblage_trees"] = [HostReferenceStructures._tree_as_definition(t) for t in self._host_area_assemblage_trees]
+        if self._host_tree_profile is None:
+            d["host_tree_profile"] = None
+        else:
+            d["host_tree_profile"] = HostReferenceStructures._tree_profile_as_definition(self._host_tree_profile)
+        if self._host_area_assemblage_tree_profiles is None:
+            d["host_area_assemblage_tree_profiles"] = None
+        else:
+            d["host_area_assemblage_tree_profiles"] = [HostReferenceStructures._tree_profile_as_definition(p) for p in self._host_area_assemblage_tree_profiles]
+        return d
+
+    def _get_host_area_assemblage_trees(self):
+        if self._host_area_assemblage_trees is None:
+            self._host_area_assemblage_trees = SummaryStatsCalculator.generate_induced_trees(
+                    tree=self.host_history.tree,
+                    assemblage_leaf_sets=self.host_history.area_assemblage_leaf_sets,
+                    skip_null_assemblages=False)
+        return self._host_area_assemblage_trees
+    host_area_assemblage_trees = property(_get_host_area_assemblage_trees)
+
+    def _get_host_tree_profile(self):
+        if self._host_tree_profile is None:
+            self._host_tree_profile = SummaryStatsCalculator.get_profile_for_tree(self.host_tree)
+        return self._host_tree_profile
+    host_tree_profile = property(_get_host_tree_profile)
+
+    def _get_host_area_assemblage_tree_profiles(self):
+        if self._host_area_assemblage_tree_profiles is None:
+            self._host_area_assemblage_tree_profiles = [SummaryStatsCalculator.get_profile_for_tree(t) for t in self.host_area_assemblage_trees]
+        return self._host_area_assemblage_tree_profiles
+    host_area_assemblage_tree_profiles = property(_get_host_area_assemblage_tree_profiles)
+
+    def update_tree_shape_kernel_cache(self):
+        """
+        Pins the tree shape kernel values of the host tree and its area
+        assemblage subtrees in the kernel cache (comparisons against which
+        then only need the values of the symbiont trees to be calculated).
+        """
+        if self._is_tree_shape_kernel_cache_updated:
+            return
+        self.tree_shape_kernel.pin_tree(self.host_tree)
+        for induced_tree in self.host_area_assemblage_trees:
+            self.tree_shape_kernel.pin_tree(induced_tree)
+        self._is_tree_shape_kernel_cache_updated = True
+
+    def is_computed_for(self, statistic_groups):
+        """
+        Returns `True` if all the structures required by ``statistic_groups``
+        have been computed.
+        """
+        computed = {
+            "host_area_assemblage_trees": self._host_area_assemblage_trees is not None,
+            "host_tree_profile": self._host_tree_profile is not None,
+            "host_area_assemblage_tree_profiles": self._host_area_assemblage_tree_profiles is not None,
+        }
+        for group_name in statistic_groups:
+            for requirement in HostReferenceStructures.STATISTIC_GROUP_REQUIREMENTS[group_name]:
+                if not computed[requirement]:
+                    return False
+        return True
+
+    def compute_for(self, statistic_groups):
+        """
+        Computes all the structures required by ``statistic_groups`` that
+        have not yet been computed.
+        """
+        for group_name in statistic_groups:
+            for requirement in HostReferenceStructures.STATISTIC_GROUP_REQUIREMENTS[group_name]:
+                getattr(self, requirement)
+        if "tree_shape_kernel" in statistic_groups:
+            self.update_tree_shape_kernel_cache()
+
 class SummaryStatsCalculator(object):
 
+    # Groups of summary statistics that can be selected for calculation, in
+    # the order in which they are calculated and reported, with the methods
+    # that calculate them.
+    STATISTIC_GROUPS = collections.OrderedDict(
+            (group_name, "calc_{}_statistics".format(group_name))
+            for group_name in statisticgroups.STATISTIC_GROUPS)
+    DEFAULT_STATISTIC_GROUPS = statisticgroups.DEFAULT_STATISTIC_GROUPS
+    validate_statistic_groups = staticmethod(statisticgroups.validate_statistic_groups)
+
     @staticmethod
     def _euclidean_distance(v1, v2, is_weight_values_by_comparison_size=True):
         v1_size = len(v1)
@@ -100,36 +674,132 @@ class SummaryStatsCalculator(object):
             assemblage_leaf_sets,
             skip_null_assemblages=False,
             ):
+        """
+        Returns the subtrees of ``tree`` induced by each of the sets of leaf
+        nodes in ``assemblage_leaf_sets`` (with unifurcations suppressed and
+        edge lengths summed accordingly), constructed for all assemblages in
+        a single postorder traversal. The induced trees consist of plain nodes
+        referencing the taxa of ``tree``, without annotations or labels.
+        """
+        if tree.bipartition_encoding is None:
+            tree.encode_bipartitions()
+        assemblage_leafset_bitmasks = []
+        for idx, assemblage_leaf_set in enumerate(assemblage_leaf_sets):
+            if len(assemblage_leaf_set) == 0 and not skip_null_assemblages:
+                raise error.PostTerminationFailedSimulationException("null assemblage set")
+            bitmask = 0
+            for nd in assemblage_leaf_set:
+                bitmask |= nd.edge.bipartition.leafset_bitmask
+            assemblage_leafset_bitmasks.append(bitmask)
+        # For each node visited, ``present[nd]`` is a bitmask over the
+        # assemblages with at least one leaf descending from the node, and
+        # ``heads[nd][idx]`` the root of the subtree induced by assemblage
+        # ``idx`` on the leaves descending from the node together with the
+        # length of the path from it to (the parent of) the node.
+        present = {}
+        heads = {}
+        for nd in tree.postorder_node_iter():
+            edge_length = nd.edge.length if nd.edge.length is not None else 0.0
+            nd_heads = {}
+            nd_branching = 0
+            if not nd._child_nodes:
+                leafset_bitmask = nd.edge.bipartition.leafset_bitmask
+                nd_present = 0
+                for idx, bitmask in enumerate(assemblage_leafset_bitmasks):
+                    if bitmask & leafset_bitmask:
+                        nd_present |= 1 << idx
+                        nd_heads[idx] = (dendropy.Node(taxon=nd.taxon), edge_length)
+            else:
+                nd_present = 0
+                for ch in nd._child_nodes:
+                    nd_branching |= nd_present & present[ch]
+                    nd_present |= present[ch]
+                children_heads = [heads.pop(ch) for ch in nd._child_nodes]
+                for ch in nd._child_nodes:
+                    del present[ch]
+                for ch_heads in children_heads:
+                    for idx, (head, head_length) in ch_heads.items():
+                        if nd_branching & (1 << idx):
+                            if idx not in nd_heads:
+                                nd_heads[idx] = (dendropy.Node(), edge_length)
+                            head.edge.length = head_length
+                            nd_heads[idx][0].add_child(head)
+                        else:
+                            nd_heads[idx] = (head, head_length + edge_length)
+            present[nd] = nd_present
+            heads[nd] = nd_heads
+        root_heads = heads[tree.seed_node]
+        seed_node_branching = nd_branching # seed node is visited last
+        # as with |dendropy.Tree.extract_tree|, an induced tree rooted at the
+        # seed node inherits its edge length as is
+        is_seed_node_edge_length_none = tree.seed_node.edge.length is None
         induced_trees = []
         for idx, assemblage_leaf_set in enumerate(assemblage_leaf_sets):
             if len(assemblage_leaf_set) == 0:
-                if skip_null_assemblages:
-                    continue
-                raise error.PostTerminationFailedSimulationException("null assemblage set")
-            node_filter_fn = lambda nd: nd in assemblage_leaf_set
-            induced_tree = tree.extract_tree(
-                               node_filter_fn=node_filter_fn,
-                               is_apply_filter_to_leaf_nodes=True,
-                               is_apply_filter_to_internal_nodes=False,
-                               tree_factory=dendropy.Tree,
-                               node_factory=dendropy.Node)
+                continue
+            head, head_length = root_heads[idx]
+            if is_seed_node_edge_length_none and seed_node_branching & (1 << idx):
+                head.edge.length = None
+            else:
+                head.edge.length = head_length
+            induced_tree = dendropy.Tree(
+                    taxon_namespace=tree.taxon_namespace,
+                    seed_node=head,
+                    is_rooted=tree.is_rooted)
             induced_trees.append(induced_tree)
         return induced_trees
 
-    def __init__(self, host_history, debug_mode):
+    def __init__(self, host_history, debug_mode, config_d=None, host_references=None):
         self.is_exchangeable_areas = True
         self.skip_null_symbiont_area_assemblages = True # If `False` requires all areas to have at least on symbiont lineage
         self.debug_mode = debug_mode
         self.ignore_incomplete_host_occupancies = False
         self.ignore_incomplete_area_occupancies = False
-        self.bind_to_host_history(host_history)
-        self.tree_shape_kernel = treecompare.TreeShapeKernel()
+        self.tree_shape_kernel_cache_size = None
+        self.bind_to_host_history(host_history, host_references=host_references)
         self.num_profile_measurements = 6
         self.stat_name_delimiter = "."
-        self.num_randomization_replicates = 100
         self.stat_name_prefix = "predictor"
+        self.configure(config_d)
 
-    def get_unweighted_profile_for_tree(self, tree):
+    def configure(self, config_d=None):
+        if config_d is None:
+            config_d = {}
+        else:
+            config_d = dict(config_d) # make copy so we can pop items
+        self.num_randomization_replicates = config_d.pop("num_randomization_replicates", 100)
+        # If not `None`, randomization replicates are drawn in blocks until the
+        # SES estimates are stable to within this tolerance (see
+        # `communityecology.LeafDistanceMatrix.standardized_effect_sizes()`)
+        self.randomization_tolerance = config_d.pop("randomization_tolerance", None)
+        self.max_randomization_replicates = config_d.pop("max_randomization_replicates", None)
+        self.randomization_block_size = config_d.pop("randomization_block_size", None)
+        communityecology.compose_randomization_schedule(
+                num_randomization_replicates=self.num_randomization_replicates,
+                randomization_tolerance=self.randomization_tolerance,
+                max_randomization_replicates=self.max_randomization_replicates,
+                randomization_block_size=self.randomization_block_size)
+        # If not `None`, overrides the statistic groups requested by the model
+        self.statistic_groups = config_d.pop("statistic_groups", None)
+        if self.statistic_groups is not None:
+            self.statistic_groups = SummaryStatsCalculator.validate_statistic_groups(self.statistic_groups)
+        self.statistic_group_costs = collections.OrderedDict()
+        for group_name in SummaryStatsCalculator.STATISTIC_GROUPS:
+            self.statistic_group_costs[group_name] = {"num_calculations": 0, "num_statistics": 0, "elapsed_time": 0.0}
+        self.statistic_group_costs["tree_shape_kernel"].update({"num_cache_hits": 0, "num_cache_misses": 0})
+        # If not `None`, bounds the number of symbiont trees whose tree shape
+        # kernel values are cached by this calculator (the host tree values,
+        # shared by all calculators bound to the same host reference
+        # structures, are always kept)
+        self.tree_shape_kernel_cache_size = config_d.pop("tree_shape_kernel_cache_size", None)
+        if self.tree_shape_kernel_cache_size is not None and self.tree_shape_kernel_cache_size < 1:
+            raise ValueError("Tree shape kernel cache size must be at least 1")
+        self._bind_tree_shape_kernel()
+        if config_d:
+            raise TypeError("Unsupported summary statistics configuration keywords: {}".format(config_d))
+
+    @staticmethod
+    def get_unweighted_profile_for_tree(tree):
         tree_profile = profiledistance.TreeProfile(
                 tree=tree,
                 is_measure_edge_lengths=False,
@@ -148,7 +818,8 @@ class SummaryStatsCalculator(object):
                 )
         return tree_profile
 
-    def get_profile_for_tree(self, tree):
+    @staticmethod
+    def get_profile_for_tree(tree):
         tree_profile = profiledistance.TreeProfile(
                 tree=tree,
                 is_measure_edge_lengths=True,
@@ -167,10 +838,31 @@ class SummaryStatsCalculator(object):
                 )
         return tree_profile
 
-    def bind_to_host_history(self, host_history):
+    def bind_to_host_history(self, host_history, host_references=None):
+        """
+        Binds this calculator to ``host_history``, using the host-side
+        reference structures given by ``host_references`` (a
+        |HostReferenceStructures| object, which may be shared with other
+        calculators bound to the same host history) or, if not given, new
+        ones computed on demand.
+        """
         self.host_history = host_history
         self.host_tree = host_history.tree
         assert host_history.tree.taxon_namespace is self.host_history.taxon_namespace
+        if host_references is None:
+            host_references = HostReferenceStructures(host_history)
+        elif host_references.host_history is None:
+            host_references.bind_to_host_history(host_history)
+        self.host_references = host_references
+        self._bind_tree_shape_kernel()
+
+    def _bind_tree_shape_kernel(self):
+        # A calculator with its own cache size gets its own kernel, sharing
+        # the pinned host tree values, rather than resizing the shared one.
+        if self.tree_shape_kernel_cache_size is None:
+            self.tree_shape_kernel = self.host_references.tree_shape_kernel
+        else:
+            self.tree_shape_kernel = self.host_references.tree_shape_kernel.derive(max_cache_size=self.tree_shape_kernel_cache_size)
 
         # self.host_area_tree = estimate_tree_from_assemblage_leafsets(
         #         assemblage_memberships=self.host_history.area_assemblage_leaf_sets,
@@ -180,27 +872,79 @@ class SummaryStatsCalculator(object):
         #         )
         # self.host_area_tree_profile = self.get_unweighted_profile_for_tree(self.host_area_tree)
 
-        # self.host_area_assemblage_trees = self.generate_induced_trees(
-        #         tree=self.host_tree,
-        #         assemblage_leaf_sets=self.host_history.area_assemblage_leaf_sets,
-        #         skip_null_assemblages=False)
-        # self.host_tree_profile = self.get_profile_for_tree(self.host_tree)
-        # self.host_area_assemblage_tree_profiles = [self.get_profile_for_tree(t) for t in self.host_area_assemblage_trees]
+    def calculate(self,
+            symbiont_phylogeny,
+            host_system,
+            simulation_elapsed_time,
+            statistic_groups=None,
+            random_seed=None):
+        """
+        Calculates the summary statistics of the groups given by
+        ``statistic_groups`` (or those given in the calculator configuration,
+        which take precedence, or by default ``DEFAULT_STATISTIC_GROUPS``)
+        for ``symbiont_phylogeny``. The randomizations of the standardized
+        effect sizes are seeded with ``random_seed`` (e.g., that of the
+        replicate that produced the phylogeny) so that the results are
+        reproducible, or freshly seeded if it is |None|.
+        """
+        symbiont_phylogeny_leaf_sets_by_area, symbiont_phylogeny_leaf_sets_by_host = self.compose_assemblage_leaf_sets(
+                symbiont_phylogeny=symbiont_phylogeny,
+                host_system=host_system,
+                simulation_elapsed_time=simulation_elapsed_time)
+        return self.calculate_for_assemblages(
+                symbiont_phylogeny=symbiont_phylogeny,
+                symbiont_phylogeny_leaf_sets_by_area=symbiont_phylogeny_leaf_sets_by_area,
+                symbiont_phylogeny_leaf_sets_by_host=symbiont_phylogeny_leaf_sets_by_host,
+                statistic_groups=statistic_groups,
+                random_seed=random_seed)
+
+    def calculate_for_sample(self, symbiont_phylogeny_sample, statistic_groups=None, random_seed=None):
+        """
+        Calculates the summary statistics for a |SymbiontPhylogenySample|
+        (see :meth:`calculate`).
+        """
+        symbiont_phylogeny, symbiont_phylogeny_leaf_sets_by_area, symbiont_phylogeny_leaf_sets_by_host = symbiont_phylogeny_sample.compose_tree()
+        self.validate_assemblage_leaf_sets(
+                num_leaves=sum(1 for nd in symbiont_phylogeny.leaf_node_iter()),
+                symbiont_phylogeny_leaf_sets_by_area=symbiont_phylogeny_leaf_sets_by_area,
+                symbiont_phylogeny_leaf_sets_by_host=symbiont_phylogeny_leaf_sets_by_host)
+        return self.calculate_for_assemblages(
+                symbiont_phylogeny=symbiont_phylogeny,
+                symbiont_phylogeny_leaf_sets_by_area=symbiont_phylogeny_leaf_sets_by_area,
+                symbiont_phylogeny_leaf_sets_by_host=symbiont_phylogeny_leaf_sets_by_host,
+                statistic_groups=statistic_groups,
+                random_seed=random_seed)
 
-    def calculate(self, symbiont_phylogeny, host_system, simulation_elapsed_time):
-        old_taxon_namespace = self.preprocess_tree(symbiont_phylogeny)
+    def compose_assemblage_leaf_sets(self, symbiont_phylogeny, host_system, simulation_elapsed_time):
+        """
+        Returns the sets of symbiont leaf nodes in each area and in each
+        current host, raising a |PostTerminationFailedSimulationException| if
+        the phylogeny is too small or (unless ignored) the occupancy of the
+        areas or hosts incomplete.
+        """
+        # assemblages are sets of symbiont leaf nodes
         current_host_leaf_lineages = list(host_system.extant_host_lineages_at_current_time(simulation_elapsed_time))
         symbiont_phylogeny_leaf_sets_by_area = [set() for i in range(host_system.num_areas)]
         symbiont_phylogeny_leaf_sets_by_host = [set() for i in current_host_leaf_lineages]
         for leaf_idx, symbiont_lineage in enumerate(symbiont_phylogeny.leaf_node_iter()):
             for area in symbiont_lineage.area_iter():
-                symbiont_phylogeny_leaf_sets_by_area[area.area_idx].add(symbiont_lineage.taxon)
+                symbiont_phylogeny_leaf_sets_by_area[area.area_idx].add(symbiont_lineage)
             for host_idx, host_lineage in enumerate(current_host_leaf_lineages):
                 # if symbiont_lineage.has_host(host_system.host_lineages_by_id[host.lineage_definition.lineage_id]):
                 if symbiont_lineage.has_host(host_lineage):
-                    symbiont_phylogeny_leaf_sets_by_host[host_idx].add(symbiont_lineage.taxon)
-        if leaf_idx <= 2:
-            raise error.InsufficientLineagesGenerated("Generated tree has too few lineages ({})".format(leaf_idx+1))
+                    symbiont_phylogeny_leaf_sets_by_host[host_idx].add(symbiont_lineage)
+        self.validate_assemblage_leaf_sets(
+                num_leaves=leaf_idx+1,
+                symbiont_phylogeny_leaf_sets_by_area=symbiont_phylogeny_leaf_sets_by_area,
+                symbiont_phylogeny_leaf_sets_by_host=symbiont_phylogeny_leaf_sets_by_host)
+        return symbiont_phylogeny_leaf_sets_by_area, symbiont_phylogeny_leaf_sets_by_host
+
+    def validate_assemblage_leaf_sets(self,
+            num_leaves,
+            symbiont_phylogeny_leaf_sets_by_area,
+            symbiont_phylogeny_leaf_sets_by_host):
+        if num_leaves <= 3:
+            raise error.InsufficientLineagesGenerated("Generated tree has too few lineages ({})".format(num_leaves))
         if not self.ignore_incomplete_host_occupancies:
             if set() in symbiont_phylogeny_leaf_sets_by_host:
                 raise error.IncompleteHostOccupancyException("incomplete host occupancy")
@@ -208,6 +952,103 @@ class SummaryStatsCalculator(object):
             if set() in symbiont_phylogeny_leaf_sets_by_area:
                 raise error.IncompleteAreaOccupancyException("incomplete area occupancy")
 
+    def resolve_statistic_groups(self, statistic_groups=None):
+        """
+        Returns the statistic groups to be calculated when
+        ``statistic_groups`` are requested: those given in the calculator
+        configuration, if any, take precedence, and ``DEFAULT_STATISTIC_GROUPS``
+        are used if none are requested.
+        """
+        if self.statistic_groups is not None:
+            return self.statistic_groups
+        elif statistic_groups is None:
+            return SummaryStatsCalculator.DEFAULT_STATISTIC_GROUPS
+        else:
+            return SummaryStatsCalculator.validate_statistic_groups(statistic_groups)
+
+    def calculate_for_assemblages(self,
+            symbiont_phylogeny,
+            symbiont_phylogeny_leaf_sets_by_area,
+            symbiont_phylogeny_leaf_sets_by_host,
+            statistic_groups=None,
+            random_seed=None):
+        statistic_groups = self.resolve_statistic_groups(statistic_groups)
+        calculation = {
+            "symbiont_phylogeny": symbiont_phylogeny,
+            "symbiont_phylogeny_leaf_sets_by_area": symbiont_phylogeny_leaf_sets_by_area,
+            "symbiont_phylogeny_leaf_sets_by_host": symbiont_phylogeny_leaf_sets_by_host,
+            "rng": communityecology.get_numpy_rng(random_seed),
+        }
+        results = collections.OrderedDict()
+        # the tree-based statistics require taxa on the symbiont tree
+        is_preprocess_tree = any(group_name != "community" for group_name in statistic_groups)
+        if is_preprocess_tree:
+            old_taxon_namespace = self.preprocess_tree(symbiont_phylogeny)
+        try:
+            for group_name in statistic_groups:
+                group_fn = getattr(self, SummaryStatsCalculator.STATISTIC_GROUPS[group_name])
+                group_cost = self.statistic_group_costs[group_name]
+                start_time = time.time()
+                try:
+                    group_results = group_fn(calculation)
+                finally:
+                    group_cost["num_calculations"] += 1
+                    group_cost["elapsed_time"] += time.time() - start_time
+                group_cost["num_statistics"] += len(group_results)
+                results.update(group_results)
+        finally:
+            if is_preprocess_tree:
+                self.restore_tree(symbiont_phylogeny, old_taxon_namespace)
+        return results
+
+    @staticmethod
+    def describe_statistic_group_cost(group_name, group_cost):
+        """
+        Returns a description of ``group_cost``, the cost of calculating the
+        statistic group ``group_name`` (as recorded in
+        ``statistic_group_costs``, possibly summed over several calculators).
+        """
+        description = "'{}': {} statistics in {} calculations, {:.4f} seconds in total ({:.4f} seconds per calculation)".format(
+            group_name,
+            group_cost["num_statistics"],
+            group_cost["num_calculations"],
+            group_cost["elapsed_time"],
+            group_cost["elapsed_time"] / group_cost["num_calculations"])
+        if "num_cache_hits" in group_cost:
+            description += "; {} cache hits, {} cache misses".format(group_cost["num_cache_hits"], group_cost["num_cache_misses"])
+        return description
+
+    @staticmethod
+    def merge_statistic_group_costs(statistic_group_costs_list, merged_statistic_group_costs=None):
+        """
+        Sums the ``statistic_group_costs`` of several calculators (or of
+        previous merges) into ``merged_statistic_group_costs`` (a new
+        dictionary if not given), and returns it.
+        """
+        if merged_statistic_group_costs is None:
+            merged_statistic_group_costs = collections.OrderedDict()
+        for statistic_group_costs in statistic_group_costs_list:
+            for group_name, group_cost in statistic_group_costs.items():
+                if group_name not in merged_statistic_group_costs:
+                    merged_statistic_group_costs[group_name] = collections.Counter()
+                merged_statistic_group_costs[group_name].update(group_cost)
+        return merged_statistic_group_costs
+
+    @staticmethod
+    def statistic_group_cost_report(statistic_group_costs):
+        """
+        Returns a list of descriptions of the cost of each statistic group in
+        ``statistic_group_costs`` that was calculated at least once.
+        """
+        report = []
+        for group_name, group_cost in statistic_group_costs.items():
+            if not group_cost["num_calculations"]:
+                continue
+            report.append(SummaryStatsCalculator.describe_statistic_group_cost(group_name, group_cost))
+        return report
+
+    def calc_community_statistics(self, calculation):
+        symbiont_phylogeny = calculation["symbiont_phylogeny"]
         results = collections.OrderedDict()
 
         ### DISABLING TREE-ESTIMATION AND PROFILE DISTANCE STATS FOR NOW
@@ -225,10 +1066,10 @@ class SummaryStatsCalculator(object):
         #         fieldname_suffix="",
         #         results=results)
 
-        symbiont_pdm = symbiont_phylogeny.phylogenetic_distance_matrix()
+        symbiont_pdm = communityecology.LeafDistanceMatrix.from_tree(symbiont_phylogeny)
 
         area_assemblage_descriptions = []
-        for area_idx, areas in enumerate(symbiont_phylogeny_leaf_sets_by_area):
+        for area_idx, areas in enumerate(calculation["symbiont_phylogeny_leaf_sets_by_area"]):
             regime = {
                 "assemblage_basis_class_id": "area",
                 "assemblage_basis_state_id": "state{}{}".format(self.stat_name_delimiter, area_idx),
@@ -236,17 +1077,18 @@ class SummaryStatsCalculator(object):
             area_assemblage_descriptions.append(regime)
         subresults = self._calc_community_ecology_stats(
             phylogenetic_distance_matrix=symbiont_pdm,
-            assemblage_memberships=symbiont_phylogeny_leaf_sets_by_area,
+            assemblage_memberships=calculation["symbiont_phylogeny_leaf_sets_by_area"],
             assemblage_descriptions=area_assemblage_descriptions,
             report_character_state_specific_results=False,
             report_character_class_wide_results=True,
+            rng=calculation["rng"],
             )
         if len(subresults) < 24:
             raise error.IncompleteAreaOccupancyException("Incomplete area occupancy")
         results.update(subresults)
 
         host_assemblage_descriptions = []
-        for host_idx, hosts in enumerate(symbiont_phylogeny_leaf_sets_by_host):
+        for host_idx, hosts in enumerate(calculation["symbiont_phylogeny_leaf_sets_by_host"]):
             regime = {
                 "assemblage_basis_class_id": "host",
                 "assemblage_basis_state_id": "state{}{}".format(self.stat_name_delimiter, host_idx),
@@ -254,16 +1096,16 @@ class SummaryStatsCalculator(object):
             host_assemblage_descriptions.append(regime)
         subresults = self._calc_community_ecology_stats(
             phylogenetic_distance_matrix=symbiont_pdm,
-            assemblage_memberships=symbiont_phylogeny_leaf_sets_by_host,
+            assemblage_memberships=calculation["symbiont_phylogeny_leaf_sets_by_host"],
             assemblage_descriptions=host_assemblage_descriptions,
             report_character_state_specific_results=False,
             report_character_class_wide_results=True,
+            rng=calculation["rng"],
             )
         if len(subresults) < 24:
             raise error.IncompleteAreaOccupancyException("Incomplete host occupancy")
         results.update(subresults)
 
-        self.restore_tree(symbiont_phylogeny, old_taxon_namespace)
         return results
 
     def _calc_community_ecology_stats(self,
@@ -272,6 +1114,7 @@ class SummaryStatsCalculator(object):
             assemblage_descriptions,
             report_character_state_specific_results=True,
             report_character_class_wide_results=True,
+            rng=None,
             ):
 
         assert len(assemblage_descriptions) == len(assemblage_memberships)
@@ -282,29 +1125,37 @@ class SummaryStatsCalculator(object):
         for sstbh in stat_scores_to_be_harvested:
             results_by_character_class[sstbh] = collections.defaultdict(list)
 
+        # all four statistic/weighting variants are evaluated on the same
+        # set of randomization replicates
+        try:
+            variant_results = phylogenetic_distance_matrix.standardized_effect_sizes(
+                assemblage_memberships=assemblage_memberships,
+                is_normalize_by_tree_size=True,
+                num_randomization_replicates=self.num_randomization_replicates,
+                randomization_tolerance=self.randomization_tolerance,
+                max_randomization_replicates=self.max_randomization_replicates,
+                randomization_block_size=self.randomization_block_size,
+                rng=rng,
+                )
+        except error.SingleTaxonAssemblageException as e:
+            if not report_character_state_specific_results:
+                variant_results = {}
+            else:
+                raise
+        # The "unweighted" columns are calculated on edge counts. Earlier
+        # versions tested ``if edge_weighted_desc:``, which is always true,
+        # so their "unweighted" columns actually repeated the edge-length
+        # (weighted) values; results from those versions are not comparable.
         for edge_weighted_desc in ("unweighted", "weighted"):
-            if edge_weighted_desc:
+            if edge_weighted_desc == "weighted":
                 is_weighted_edge_distances = True
             else:
                 is_weighted_edge_distances = False
             for underlying_statistic_type_desc in ("mpd", "mntd"):
-                if underlying_statistic_type_desc == "mpd":
-                    stat_fn_name = "standardized_effect_size_mean_pairwise_distance"
-                else:
-                    stat_fn_name = "standardized_effect_size_mean_nearest_taxon_distance"
-                stat_fn = getattr(phylogenetic_distance_matrix, stat_fn_name)
                 try:
-                    results_group = stat_fn(
-                        assemblage_memberships=assemblage_memberships,
-                        is_weighted_edge_distances=is_weighted_edge_distances,
-                        is_normalize_by_tree_size=True,
-                        num_randomization_replicates=self.num_randomization_replicates,
-                        )
-                except dendropy.utility.error.SingleTaxonAssemblageException as e:
-                    if not report_character_state_specific_results:
-                        continue
-                    else:
-                        raise
+                    results_group = variant_results[(is_weighted_edge_distances, underlying_statistic_type_desc)]
+                except KeyError:
+                    continue
                 if not report_character_state_specific_results:
                     assert len(results_group) == len(assemblage_memberships)
                 if len(results_group) == 0:
@@ -357,77 +1208,62 @@ class SummaryStatsCalculator(object):
         return summary_statistics_suite
 
 
-    def calculate2(self, symbiont_phylogeny, host_system, simulation_elapsed_time):
-        old_taxon_namespace = self.preprocess_tree(symbiont_phylogeny)
-
-        current_host_leaf_lineages = list(host_system.extant_host_lineages_at_current_time(simulation_elapsed_time))
-        symbiont_phylogeny_leaf_sets_by_area = [set() for i in range(host_system.num_areas)]
-        symbiont_phylogeny_leaf_sets_by_host = [set() for i in current_host_leaf_lineages]
-        for leaf_idx, symbiont_lineage in enumerate(symbiont_phylogeny.leaf_node_iter()):
-            for area in symbiont_lineage.area_iter():
-                symbiont_phylogeny_leaf_sets_by_area[area.area_idx].add(symbiont_lineage)
-            for host_idx, host_lineage in enumerate(current_host_leaf_lineages):
-                # if symbiont_lineage.has_host(host_system.host_lineages_by_id[host.lineage_definition.lineage_id]):
-                if symbiont_lineage.has_host(host_lineage):
-                    symbiont_phylogeny_leaf_sets_by_host[host_idx].add(symbiont_lineage)
-        if leaf_idx <= 2:
-            raise error.InsufficientLineagesGenerated("Generated tree has too few lineages ({})".format(leaf_idx+1))
-        if not self.ignore_incomplete_host_occupancies:
-            if set() in symbiont_phylogeny_leaf_sets_by_host:
-                raise error.IncompleteHostOccupancyException("incomplete host occupancy")
-        if not self.ignore_incomplete_area_occupancies:
-            if set() in symbiont_phylogeny_leaf_sets_by_area:
-                raise error.IncompleteAreaOccupancyException("incomplete area occupancy")
+    def _get_symbiont_assemblage_trees(self, calculation):
+        # induced trees are shared by the tree-based statistic groups
+        if "symbiont_area_assemblage_trees" not in calculation:
+            calculation["symbiont_area_assemblage_trees"] = self.generate_induced_trees(
+                    tree=calculation["symbiont_phylogeny"],
+                    assemblage_leaf_sets=calculation["symbiont_phylogeny_leaf_sets_by_area"],
+                    skip_null_assemblages=False)
+            calculation["symbiont_host_assemblage_trees"] = self.generate_induced_trees(
+                    tree=calculation["symbiont_phylogeny"],
+                    assemblage_leaf_sets=calculation["symbiont_phylogeny_leaf_sets_by_host"],
+                    skip_null_assemblages=False)
+        return calculation["symbiont_area_assemblage_trees"], calculation["symbiont_host_assemblage_trees"]
 
-        symbiont_area_assemblage_trees = self.generate_induced_trees(
-                tree=symbiont_phylogeny,
-                assemblage_leaf_sets=symbiont_phylogeny_leaf_sets_by_area,
-                skip_null_assemblages=False)
-        symbiont_host_assemblage_trees = self.generate_induced_trees(
-                tree=symbiont_phylogeny,
-                assemblage_leaf_sets=symbiont_phylogeny_leaf_sets_by_host,
-                skip_null_assemblages=False)
+    def calc_tree_shape_kernel_statistics(self, calculation):
+        symbiont_phylogeny = calculation["symbiont_phylogeny"]
+        symbiont_area_assemblage_trees, symbiont_host_assemblage_trees = self._get_symbiont_assemblage_trees(calculation)
 
+        self.host_references.update_tree_shape_kernel_cache()
         results = collections.OrderedDict()
         expected_num_sum_stats = 0
+        num_cache_hits = self.tree_shape_kernel.num_cache_hits
+        num_cache_misses = self.tree_shape_kernel.num_cache_misses
 
         ## main trees kernel trick
         expected_num_sum_stats += 1
         results["predictor.primary.tree.tsktd"] = self.tree_shape_kernel(
-                tree1=self.host_tree,
+                tree1=self.host_references.host_tree,
                 tree2=symbiont_phylogeny)
         self.check_successful_subcalculation(expected_num_sum_stats, results, "predictor.primary.tree.tsktd")
 
         ## area trees kernel trick
-        expected_num_sum_stats += ( min(len(self.host_area_assemblage_trees), len(symbiont_area_assemblage_trees)) )
+        expected_num_sum_stats += ( min(len(self.host_references.host_area_assemblage_trees), len(symbiont_area_assemblage_trees)) )
         results.update(self.tree_shape_kernel_compare_trees(
-            trees1=self.host_area_assemblage_trees,
+            trees1=self.host_references.host_area_assemblage_trees,
             trees2=symbiont_area_assemblage_trees,
             fieldname_prefix="predictor.area.assemblage.tsktd",
             fieldname_suffix="",
             is_exchangeable_assemblage_classifications=True,
             default_value_for_missing_comparisons=False,
             ))
-        for induced_tree in symbiont_area_assemblage_trees:
-            self.tree_shape_kernel.remove_from_cache(induced_tree)
         self.check_successful_subcalculation(expected_num_sum_stats, results, "predictor.area.assemblage.tsktd")
 
         ## host trees kernel trick
-        expected_num_sum_stats += ( min(len(self.host_area_assemblage_trees), len(symbiont_host_assemblage_trees)) )
+        expected_num_sum_stats += ( min(len(self.host_references.host_area_assemblage_trees), len(symbiont_host_assemblage_trees)) )
         results.update(self.tree_shape_kernel_compare_trees(
-            trees1=self.host_area_assemblage_trees,
+            trees1=self.host_references.host_area_assemblage_trees,
             trees2=symbiont_host_assemblage_trees,
             fieldname_prefix="predictor.host.assemblage.tsktd.",
             fieldname_suffix="",
             is_exchangeable_assemblage_classifications=True,
             default_value_for_missing_comparisons=False,
             ))
-        for induced_tree in symbiont_host_assemblage_trees:
-            self.tree_shape_kernel.remove_from_cache(induced_tree)
         self.check_successful_subcalculation(expected_num_sum_stats, results, "predictor.host.assemblage.tsktd.")
 
         ## host trees vs. area trees kernel trick
-        expected_num_sum_stats += ( min(len(self.host_area_assemblage_trees), len(symbiont_host_assemblage_trees)) )
+        expected_num_sum_stats += ( min(len(symbiont_area_assemblage_trees), len(symbiont_host_assemblage_trees)) )
         results.update(self.tree_shape_kernel_compare_trees(
             trees1=symbiont_area_assemblage_trees,
             trees2=symbiont_host_assemblage_trees,
@@ -436,22 +1272,32 @@ class SummaryStatsCalculator(object):
             is_exchangeable_assemblage_classifications=True,
             default_value_for_missing_comparisons=False,
             ))
-        for induced_tree in symbiont_host_assemblage_trees:
-            self.tree_shape_kernel.remove_from_cache(induced_tree)
         self.check_successful_subcalculation(expected_num_sum_stats, results, "predictor.host.vs.area.assemblage.tsktd")
 
+        group_cost = self.statistic_group_costs["tree_shape_kernel"]
+        group_cost["num_cache_hits"] += self.tree_shape_kernel.num_cache_hits - num_cache_hits
+        group_cost["num_cache_misses"] += self.tree_shape_kernel.num_cache_misses - num_cache_misses
+        return results
+
+    def calc_profile_distance_statistics(self, calculation):
+        symbiont_phylogeny = calculation["symbiont_phylogeny"]
+        symbiont_area_assemblage_trees, symbiont_host_assemblage_trees = self._get_symbiont_assemblage_trees(calculation)
+
+        results = collections.OrderedDict()
+        expected_num_sum_stats = 0
+
         ## main tree profile distance
         expected_num_sum_stats += self.num_profile_measurements
         symbiont_tree_profile = self.get_profile_for_tree(tree=symbiont_phylogeny)
         self.compare_profiles(
-                profile1=self.host_tree_profile,
+                profile1=self.host_references.host_tree_profile,
                 profile2=symbiont_tree_profile,
                 fieldname_prefix="predictor.profiledist.main.trees.",
                 fieldname_suffix="",
                 results=results)
         self.check_successful_subcalculation(expected_num_sum_stats, results, "predictor.profiledist.main.trees.")
 
-        host_area_assemblage_profiles = [self.get_profile_for_tree(t) for t in self.host_area_assemblage_trees]
+        host_area_assemblage_profiles = self.host_references.host_area_assemblage_tree_profiles
         symbiont_host_assemblage_profiles = [self.get_profile_for_tree(t) for t in symbiont_host_assemblage_trees]
         symbiont_area_assemblage_profiles = [self.get_profile_for_tree(t) for t in symbiont_area_assemblage_trees]
 
@@ -473,16 +1319,15 @@ class SummaryStatsCalculator(object):
                 results=results)
         self.check_successful_subcalculation(expected_num_sum_stats, results, "predictor.profiledist.host.assemblage.")
 
-        expected_num_sum_stats += min( len(host_area_assemblage_profiles), len(symbiont_area_assemblage_profiles) ) * self.num_profile_measurements
+        expected_num_sum_stats += min( len(symbiont_area_assemblage_profiles), len(symbiont_host_assemblage_profiles) ) * self.num_profile_measurements
         self.compare_multi_profiles(
-                profiles1=host_area_assemblage_profiles,
-                profiles2=symbiont_area_assemblage_profiles,
+                profiles1=symbiont_area_assemblage_profiles,
+                profiles2=symbiont_host_assemblage_profiles,
                 fieldname_prefix="predictor.profiledist.host.vs.area.assemblage.",
                 fieldname_suffix="",
                 results=results)
         self.check_successful_subcalculation(expected_num_sum_stats, results, "predictor.profiledist.host.vs.area.assemblage.")
 
-        self.restore_tree(symbiont_phylogeny, old_taxon_namespace)
         return results
 
     def check_successful_subcalculation(self, expected_num_sum_stats, results, message):
@@ -500,6 +1345,85 @@ class SummaryStatsCalculator(object):
             results["{}{}{}".format(fieldname_prefix, key, fieldname_suffix)] = d[key]
         return results
 
+    @staticmethod
+    def match_exchangeable_assemblages(distance_table):
+        """
+        Finds the one-to-one matching of the rows of ``distance_table`` (one
+        per assemblage of the first, smaller, set of assemblages) to its
+        columns (one per assemblage of the second set) that minimizes the
+        Euclidean norm of the vector of matched distances, each weighted by
+        the number of pairs matched that could be measured (see
+        :meth:`_euclidean_distance`), as in the original enumeration of all
+        permutations of the columns.
+
+        Distances that could not be measured are given as |None|; such pairs
+        are left out of the vector of matched distances, and matchings in
+        which no pair at all could be measured are not considered. If all
+        pairs could be measured, the weight is the same for every matching,
+        and the matching is found by solving a linear assignment problem (on
+        the squared distances), though ties between equally good matchings
+        may be resolved differently from the enumeration. If not, the weight
+        depends on the matching, and the matching is found by an exact search
+        (see :meth:`_search_exchangeable_assemblage_matchings`).
+
+        Returns the vector of matched distances, in row order.
+        """
+        if any(d is None for row in distance_table for d in row):
+            return SummaryStatsCalculator._search_exchangeable_assemblage_matchings(distance_table)
+        costs = [[d * d for d in row] for row in distance_table]
+        assignment = utility.solve_assignment(costs)
+        return [distance_table[row_idx][col_idx] for row_idx, col_idx in enumerate(assignment)]
+
+    @staticmethod
+    def _search_exchangeable_assemblage_matchings(distance_table):
+        """
+        Searches all matchings of the rows of ``distance_table`` to its
+        columns, in the order of ``itertools.permutations`` (so that ties are
+        resolved as in the original enumeration), for the one that minimizes
+        the weighted Euclidean norm of the vector of matched distances (see
+        :meth:`match_exchangeable_assemblages`), skipping partial matchings
+        that cannot improve on the best found so far.
+
+        Returns the vector of matched distances, in row order (empty if no
+        pair could be measured).
+        """
+        num_rows = len(distance_table)
+        num_cols = len(distance_table[0]) if num_rows else 0
+        comparison_vector = [0.0] * num_rows
+        is_col_matched = [False] * num_cols
+        matched_distances = []
+        best = {"distance": None, "matched_distances": []}
+        def search(row_idx, sum_of_squares):
+            if row_idx == num_rows:
+                if matched_distances:
+                    ed = SummaryStatsCalculator._euclidean_distance(matched_distances, comparison_vector)
+                    if best["distance"] is None or ed < best["distance"]:
+                        best["distance"] = ed
+                        best["matched_distances"] = list(matched_distances)
+                return
+            if best["distance"] is not None:
+                # the remaining rows add nothing negative to the sum of
+                # squares, and at most one measured pair each to the weight;
+                # the margin allows for rounding, as the enumeration only
+                # replaces the best matching by a strictly better one
+                bound = math.sqrt(sum_of_squares) / (len(matched_distances) + num_rows - row_idx)
+                if bound > best["distance"] * (1.0 + 1e-9):
+                    return
+            for col_idx in range(num_cols):
+                if is_col_matched[col_idx]:
+                    continue
+                d = distance_table[row_idx][col_idx]
+                is_col_matched[col_idx] = True
+                if d is None:
+                    search(row_idx + 1, sum_of_squares)
+                else:
+                    matched_distances.append(d)
+                    search(row_idx + 1, sum_of_squares + d * d)
+                    matched_distances.pop()
+                is_col_matched[col_idx] = False
+        search(0, 0.0)
+        return best["matched_distances"]
+
     def compare_multi_profiles(self,
             profiles1,
             profiles2,
@@ -510,42 +1434,27 @@ class SummaryStatsCalculator(object):
             ):
         if len(profiles1) > len(profiles2):
             profiles2, profiles1 = profiles1, profiles2
-        comparison_vectors = {}
-        current_minimum_distances = {}
-        current_joint_minimum_vectors = {}
         measurement_names = profiles1[0].measurement_names
-        for name in measurement_names:
-            comparison_vectors[name] = [0.0] * len(profiles1)
-            current_minimum_distances[name] = None
-            current_joint_minimum_vectors[name] = None
-        for profile_permutation in itertools.permutations(profiles2, len(profiles1)):
-            distances = {}
-            for p2, p1 in zip(profile_permutation, profiles1):
+        # each pair of profiles is measured exactly once
+        pair_distances = [[None] * len(profiles2) for p1 in profiles1]
+        is_any_measured = False
+        for idx1, p1 in enumerate(profiles1):
+            for idx2, p2 in enumerate(profiles2):
                 try:
-                    pd = p1.measure_distances(p2)
+                    pair_distances[idx1][idx2] = p1.measure_distances(p2)
                 except ValueError:
                     ### TODO: better handling here: (1) specialized error raised by profiledistance + option of quitting or continuing
                     continue
-                for name in measurement_names:
-                    try:
-                        distances[name].append(pd[name])
-                    except KeyError:
-                        distances[name] = [pd[name]]
-            if not distances:
-                ### TODO: ditto re: better handling
-                continue
-            for name in measurement_names:
-                ed = self._euclidean_distance(distances[name], comparison_vectors[name])
-                if current_minimum_distances[name] is None or ed < current_minimum_distances[name]:
-                    current_minimum_distances[name] = ed
-                    current_joint_minimum_vectors[name] = distances[name]
-        if  not current_joint_minimum_vectors:
+                is_any_measured = True
+        if not is_any_measured:
             raise error.InsufficientLineagesGenerated("Insufficient symbiont lineages in one or more hosts or areas")
         for name in measurement_names:
-            for didx, d in enumerate(current_joint_minimum_vectors[name]):
+            distance_table = [[None if pd is None else pd[name] for pd in row] for row in pair_distances]
+            matched_distances = self.match_exchangeable_assemblages(distance_table)
+            for didx, d in enumerate(matched_distances):
                 results["{}{}{}{}".format(fieldname_prefix, name, didx+1, fieldname_suffix, )] = d
             if default_value_for_missing_comparisons is not False:
-                for didx in range(didx+1, len(profiles2)):
+                for didx in range(len(matched_distances), len(profiles2)):
                     results["{}{}{}{}".format(fieldname_prefix, name, didx+1, fieldname_suffix, )] = default_value_for_missing_comparisons
 
     def tree_shape_kernel_compare_trees(self,
@@ -558,6 +1467,8 @@ class SummaryStatsCalculator(object):
             **kwargs
             ):
         score_table = collections.OrderedDict()
+        is_tree1_cache_updated = kwargs.pop("is_tree1_cache_updated", True)
+        is_tree2_cache_updated = kwargs.pop("is_tree2_cache_updated", True)
         if not is_exchangeable_assemblage_classifications:
             if len(trees1) != len(trees2):
                 raise TypeError("Different numbers of induced trees not supported for non-exchangeable classifications: {} vs. {}".format(len(trees1), len(trees2)))
@@ -565,34 +1476,28 @@ class SummaryStatsCalculator(object):
                 s = self.tree_shape_kernel(
                                 tree1=induced_tree1,
                                 tree2=induced_tree2,
-                                is_tree1_cache_updated=kwargs.pop("is_tree1_cache_updated", True),
-                                is_tree2_cache_updated=kwargs.pop("is_tree1_cache_updated", True),
+                                is_tree1_cache_updated=is_tree1_cache_updated,
+                                is_tree2_cache_updated=is_tree2_cache_updated,
                                 )
                 score_table["{}{}{}".format(fieldname_prefix, idx+1, fieldname_suffix, )] = s
         else:
             # ensure trees1 has the smaller number of elements
             if len(trees1) > len(trees2):
                 trees2, trees1 = trees1, trees2
-            comparison_vector = [0.0] * len(trees1)
-            current_minimum_distance = None
-            current_joint_minimum_vector = None
-            for trees_permutation in itertools.permutations(trees2, len(trees1)):
-                distances = []
-                for t2, t1 in zip(trees_permutation, trees1):
-                    distances.append(self.tree_shape_kernel(
-                            tree1=t1,
-                            tree2=t2,
-                            is_tree1_cache_updated=kwargs.pop("is_tree1_cache_updated", True),
-                            is_tree2_cache_updated=kwargs.pop("is_tree1_cache_updated", True),
-                            ))
-                euclidean_distance = self._euclidean_distance(distances, comparison_vector)
-                if current_minimum_distance is None or euclidean_distance < current_minimum_distance:
-                    current_minimum_distance = euclidean_distance
-                    current_joint_minimum_vector = distances
-            for didx, d in enumerate(current_joint_minimum_vector):
+            # each pair of trees is compared exactly once
+            distance_table = []
+            for t1 in trees1:
+                distance_table.append([self.tree_shape_kernel(
+                        tree1=t1,
+                        tree2=t2,
+                        is_tree1_cache_updated=is_tree1_cache_updated,
+                        is_tree2_cache_updated=is_tree2_cache_updated,
+                        ) for t2 in trees2])
+            matched_distances = self.match_exchangeable_assemblages(distance_table)
+            for didx, d in enumerate(matched_distances):
                 score_table["{}{}{}".format(fieldname_prefix, didx+1, fieldname_suffix, )] = d
             if default_value_for_missing_comparisons is not False:
-                for didx in range(didx+1, len(trees2)):
+                for didx in range(len(matched_distances), len(trees2)):
                     score_table["{}{}{}".format(fieldname_prefix, didx+1, fieldname_suffix, )] = default_value_for_missing_comparisons
         return score_table
 
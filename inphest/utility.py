@@ -14,9 +14,12 @@
 import decimal
 import sys
 import os
+import io
+import time
 import logging
 import inspect
 import collections
+import re
 import dendropy
 import json
 
@@ -36,6 +39,103 @@ def open_output_file_for_csv_writer(filepath, append=False):
         out = open(filepath, "ab" if append else "wb")
     return out
 
+# Compression of output (and input) files is selected by the extension of
+# their paths; the modules are only imported when needed, as not all Python
+# builds provide all of them.
+COMPRESSION_EXTENSIONS = collections.OrderedDict([
+    ("gzip", ".gz"),
+    ("bz2", ".bz2"),
+    ("xz", ".xz"),
+    ])
+_COMPRESSION_MAGIC_NUMBERS = (
+    ("gzip", b"\x1f\x8b"),
+    ("bz2", b"BZh"),
+    ("xz", b"\xfd7zXZ\x00"),
+    )
+
+class _CompressedTextFile(io.TextIOWrapper):
+    """
+    Text stream over a compressed binary stream, reporting the path of the
+    file as its name (as with plain files) whether or not the compressed
+    stream does.
+    """
+
+    def __init__(self, buffer, filepath):
+        io.TextIOWrapper.__init__(self, buffer)
+        self._filepath = filepath
+
+    @property
+    def name(self):
+        return self._filepath
+
+def _get_compression_module(compression):
+    if compression == "gzip":
+        import gzip
+        return gzip
+    elif compression == "bz2":
+        import bz2
+        return bz2
+    elif compression == "xz":
+        import lzma
+        return lzma
+    else:
+        raise ValueError("Unrecognized compression: '{}' (must be one of: {})".format(compression, ", ".join("'{}'".format(c) for c in COMPRESSION_EXTENSIONS)))
+
+def diagnose_compression(filepath):
+    """
+    Returns the compression ('gzip', 'bz2' or 'xz') implied by the extension
+    of ``filepath``, or `None` if it has none of the corresponding
+    extensions.
+    """
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if filepath.endswith(extension):
+            return compression
+    return None
+
+def compose_compressed_filepath(filepath, compression=None):
+    """
+    Returns ``filepath`` with the extension corresponding to ``compression``
+    appended (unless already present); if ``compression`` is `None` or
+    'none', ``filepath`` is returned as is.
+    """
+    if compression is None or compression == "none":
+        return filepath
+    _get_compression_module(compression)
+    extension = COMPRESSION_EXTENSIONS[compression]
+    if filepath.endswith(extension):
+        return filepath
+    return filepath + extension
+
+def open_output_file(filepath, compression=None, append=False):
+    """
+    Opens ``filepath`` for writing (or, if ``append`` is `True`, appending)
+    text, compressed as it is written if ``compression`` is given or, if
+    not, if implied by the extension of ``filepath`` (see
+    :func:`diagnose_compression`). Compressed output is appended as a new
+    compressed stream.
+    """
+    if compression is None:
+        compression = diagnose_compression(filepath)
+    if compression is None or compression == "none":
+        return open(filepath, "a" if append else "w")
+    return _CompressedTextFile(_get_compression_module(compression).open(filepath, "ab" if append else "wb"), filepath)
+
+def open_input_file(filepath, is_binary=False):
+    """
+    Opens ``filepath`` for reading text (or, if ``is_binary`` is `True`,
+    bytes), decompressing it as it is read if it is compressed (by gzip, bz2
+    or xz, as identified by its contents rather than its extension).
+    """
+    with open(filepath, "rb") as src:
+        magic = src.read(6)
+    for compression, magic_number in _COMPRESSION_MAGIC_NUMBERS:
+        if magic.startswith(magic_number):
+            src = _get_compression_module(compression).open(filepath, "rb")
+            if is_binary:
+                return src
+            return _CompressedTextFile(src, filepath)
+    return open(filepath, "rb" if is_binary else "r")
+
 def is_almost_equal(x, y, ndigits=7):
     return round(x-y, ndigits) == 0
 
@@ -74,6 +174,387 @@ def is_in_range(x, a, b):
     b = decimal.Decimal("{:0.8f}".format(b))
     return a <= x <= b
 
+def solve_assignment(cost_matrix):
+    """
+    Solves the (rectangular) linear assignment problem using the Hungarian
+    algorithm (shortest augmenting path formulation, O(n^2 m)).
+
+    Parameters
+    ----------
+    cost_matrix : list of lists
+        An ``n`` x ``m`` matrix of costs, with ``n <= m``: ``cost_matrix[i][j]``
+        is the cost of assigning row ``i`` to column ``j``.
+
+    Returns
+    -------
+    assignment : list
+        A list of ``n`` distinct column indexes, where ``assignment[i]`` is the
+        column assigned to row ``i``, such that the total cost is minimized.
+    """
+    num_rows = len(cost_matrix)
+    if num_rows == 0:
+        return []
+    num_cols = len(cost_matrix[0])
+    if num_rows > num_cols:
+        raise ValueError("Assignment requires no more rows than columns: {} > {}".format(num_rows, num_cols))
+    infinity = float("inf")
+    # 1-based indexing, with row/column 0 as sentinels
+    row_potentials = [0.0] * (num_rows + 1)
+    col_potentials = [0.0] * (num_cols + 1)
+    col_assignments = [0] * (num_cols + 1)
+    col_predecessors = [0] * (num_cols + 1)
+    for row in range(1, num_rows + 1):
+        col_assignments[0] = row
+        col0 = 0
+        min_slacks = [infinity] * (num_cols + 1)
+        is_visited = [False] * (num_cols + 1)
+        while True:
+            is_visited[col0] = True
+            row0 = col_assignments[col0]
+            row0_costs = cost_matrix[row0 - 1]
+            row0_potential = row_potentials[row0]
+            delta = infinity
+            col1 = None
+            for col in range(1, num_cols + 1):
+                if is_visited[col]:
+                    continue
+                slack = row0_costs[col - 1] - row0_potential - col_potentials[col]
+                if slack < min_slacks[col]:
+                    min_slacks[col] = slack
+                    col_predecessors[col] = col0
+                if min_slacks[col] < delta:
+                    delta = min_slacks[col]
+                    col1 = col
+            for col in range(num_cols + 1):
+                if is_visited[col]:
+                    row_potentials[col_assignments[col]] += delta
+                    col_potentials[col] -= delta
+                else:
+                    min_slacks[col] -= delta
+            col0 = col1
+            if col_assignments[col0] == 0:
+                break
+        while col0 != 0:
+            col1 = col_predecessors[col0]
+            col_assignments[col0] = col_assignments[col1]
+            col0 = col1
+    assignment = [None] * num_rows
+    for col in range(1, num_cols + 1):
+        if col_assignments[col] != 0:
+            assignment[col_assignments[col] - 1] = col - 1
+    return assignment
+
+class JsonArrayStreamReader(object):
+    """
+    Incrementally decodes a JSON document consisting of a single top-level
+    array, read from a file-like object, yielding each element of the array
+    in turn. Only the element being decoded (plus a read buffer) is held in
+    memory at any one time, irrespective of the size of the document.
+    """
+
+    _WHITESPACE = " \t\n\r"
+    _SCALAR_TERMINATOR_PATTERN = re.compile(r"[,\]\s]")
+
+    def __init__(self, src, chunk_size=1 << 16):
+        self.src = src
+        self.chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._is_eof = False
+
+    def __iter__(self):
+        if self._next_token() != "[":
+            raise ValueError("Expecting JSON array")
+        self._pos += 1
+        if self._next_token() == "]":
+            return
+        while True:
+            yield self._decode_element()
+            token = self._next_token()
+            if token == ",":
+                self._pos += 1
+                if self._next_token() is None:
+                    raise ValueError("Unterminated JSON array")
+            elif token == "]":
+                return
+            elif token is None:
+                raise ValueError("Unterminated JSON array")
+            else:
+                raise ValueError("Expecting ',' or ']' in JSON array but found: '{}'".format(token))
+
+    def _read(self, size):
+        if self._is_eof:
+            return False
+        chunk = self.src.read(size)
+        if not chunk:
+            self._is_eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _next_token(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in JsonArrayStreamReader._WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read(self.chunk_size):
+                return None
+
+    def _decode_element(self):
+        read_size = self.chunk_size
+        if self._buffer[self._pos] not in "{[\"":
+            # scalars (numbers, literals) are not self-delimiting, and so could
+            # be truncated by the buffer boundary: ensure that the terminating
+            # delimiter is in the buffer before decoding
+            while JsonArrayStreamReader._SCALAR_TERMINATOR_PATTERN.search(self._buffer, self._pos) is None:
+                if not self._read(read_size):
+                    break
+        while True:
+            try:
+                element, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._read(read_size):
+                    raise
+                # grow reads geometrically so that very large elements do not
+                # result in quadratic re-decoding
+                read_size *= 2
+                continue
+            self._pos = end
+            return element
+
+class BufferedOutputSink(object):
+    """
+    Buffers output to one or more files as a sequence of records (e.g., the
+    summary statistics row and the tree of a replicate), each of which may
+    span several files and several writes, and writes them out in batches:
+    once ``max_buffered_records`` records have been completed, or once
+    ``max_buffer_time`` seconds have passed since the last batch was written
+    when a record is completed (and whenever explicitly flushed or closed).
+
+    Records in progress are never written out, and are discarded if the sink
+    is closed before they are completed. Completed records are written out
+    in the order in which they were completed, with the buffered output to
+    each file written in a single call, so that correspondences between the
+    files (e.g., rows and trees) are preserved.
+
+    Each batch is written out to all the files or to none: if writing it out
+    raises an exception (e.g., the disk is full, or the run is interrupted
+    by the user), the files already written to are truncated back to their
+    sizes before the batch, and the batch is kept, to be written out again
+    by the next flush (e.g., when the sink is closed). Files that cannot be
+    truncated (e.g., compressed files, or the standard output) are left as
+    they are. This cannot protect against the process being killed outright
+    or the system crashing while writing out, which can leave the last batch
+    partially written to one file, or written to some files but not to
+    others. Recovering from this requires a journal of the sizes of the
+    files after each batch, written as the last destination (see
+    |manifest.RunManifestWriter|), to which the files can be truncated. With
+    ``is_sync``, each file is synchronized to disk before the next is
+    written, so that the journal never records output that has not reached
+    the disk.
+
+    Destinations are written the buffered output joined as text, except for
+    those with a true ``is_batch_destination`` attribute (e.g.,
+    |columnar.SummaryStatsColumnWriter|), which are given it as a list of
+    items by their ``write_batch`` method, and truncated back to their
+    ``num_records`` by their ``truncate`` method, if they have one.
+    Destinations are synchronized to disk by their ``sync`` method, if they
+    have one, and by ``os.fsync`` on their file descriptor otherwise.
+    """
+
+    def __init__(self, max_buffered_records=1, max_buffer_time=None, is_sync=False):
+        """
+        Parameters
+        ----------
+        max_buffered_records : int
+            Maximum number of completed records held before writing out.
+        max_buffer_time : float or None
+            If given, maximum number of seconds for which completed records
+            are held before writing out (checked when records are completed).
+        is_sync : bool
+            If `True`, each file is also synchronized to disk (see
+            ``os.fsync``) as it is written out, before the next one is
+            written.
+        """
+        if max_buffered_records < 1:
+            raise ValueError("Maximum number of buffered records must be at least 1")
+        if max_buffer_time is not None and max_buffer_time < 0:
+            raise ValueError("Maximum buffer time cannot be negative")
+        self.max_buffered_records = max_buffered_records
+        self.max_buffer_time = max_buffer_time
+        self.is_sync = is_sync
+        self._destinations = []
+        self._buffered = {}
+        self._current = {}
+        self.num_buffered_records = 0
+        self.num_records_written = 0
+        self.num_batches_written = 0
+        self._last_write_time = time.time()
+
+    def add_destination(self, dest):
+        """
+        Adds ``dest`` to the destinations, if not already added.
+        Destinations are written to in the order in which they are added
+        (explicitly, or when first written to).
+        """
+        if id(dest) not in self._buffered:
+            self._destinations.append(dest)
+            self._buffered[id(dest)] = []
+            self._current[id(dest)] = []
+
+    def write(self, dest, s):
+        """
+        Adds ``s`` (text or, for batch destinations, any item) to the output
+        to ``dest`` of the current record.
+        """
+        self.add_destination(dest)
+        self._current[id(dest)].append(s)
+
+    def end_record(self):
+        """
+        Completes the current record, writing out the buffered records if
+        either limit is reached.
+        """
+        for dest in self._destinations:
+            current = self._current[id(dest)]
+            if current:
+                self._buffered[id(dest)].extend(current)
+                del current[:]
+        self.num_buffered_records += 1
+        if (self.num_buffered_records >= self.max_buffered_records
+                or (self.max_buffer_time is not None and time.time() - self._last_write_time >= self.max_buffer_time)):
+            self.flush()
+
+    def discard_record(self):
+        """
+        Discards the output of the current record.
+        """
+        for dest in self._destinations:
+            del self._current[id(dest)][:]
+
+    def flush(self):
+        """
+        Writes out all completed records, to all the files or (if an
+        exception is raised) to none.
+        """
+        if self.num_buffered_records:
+            dest_sizes = []
+            try:
+                for dest in self._destinations:
+                    buffered = self._buffered[id(dest)]
+                    if not buffered:
+                        continue
+                    dest_sizes.append((dest, self._compose_dest_size(dest)))
+                    if getattr(dest, "is_batch_destination", False):
+                        dest.write_batch(list(buffered))
+                    else:
+                        dest.write("".join(buffered))
+                    dest.flush()
+                    if self.is_sync:
+                        sync = getattr(dest, "sync", None)
+                        if sync is not None:
+                            sync()
+                        else:
+                            try:
+                                os.fsync(dest.fileno())
+                            except (AttributeError, OSError, ValueError):
+                                pass
+            except BaseException:
+                for dest, size in reversed(dest_sizes):
+                    self._truncate_dest(dest, size)
+                raise
+            for dest in self._destinations:
+                del self._buffered[id(dest)][:]
+            self.num_records_written += self.num_buffered_records
+            self.num_batches_written += 1
+            self.num_buffered_records = 0
+        self._last_write_time = time.time()
+
+    def close(self):
+        """
+        Writes out all completed records, discarding any record in progress.
+        The files themselves are not closed.
+        """
+        self.discard_record()
+        self.flush()
+
+    def _compose_dest_size(self, dest):
+        # number of records for batch destinations (that can be truncated),
+        # position in the file for others (that can be truncated), or `None`
+        if getattr(dest, "is_batch_destination", False):
+            if getattr(dest, "truncate", None) is None:
+                return None
+            return dest.num_records
+        try:
+            if not dest.seekable():
+                return None
+            return dest.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def _truncate_dest(self, dest, size):
+        if size is None:
+            return
+        try:
+            if getattr(dest, "is_batch_destination", False):
+                dest.truncate(size)
+            else:
+                dest.seek(size)
+                dest.truncate()
+        except (OSError, ValueError):
+            # e.g., compressed files, which cannot be truncated
+            pass
+
+class OrderedSet(dict):
+    """
+    A set that iterates over its elements in the order in which they were
+    (first) added, rather than in an order that depends on their hash
+    values -- i.e., for objects hashed by identity, on where they happen to
+    be allocated in memory. Used for collections of lineages and areas that
+    are iterated over when scheduling events, so that a simulation (and its
+    consumption of random numbers) is fully determined by its random seed,
+    and can be checkpointed and restored.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, elements=None):
+        dict.__init__(self)
+        if elements is not None:
+            self.update(elements)
+
+    def add(self, element):
+        self[element] = None
+
+    def remove(self, element):
+        del self[element]
+
+    def discard(self, element):
+        self.pop(element, None)
+
+    def update(self, elements):
+        for element in elements:
+            self[element] = None
+
+    def __eq__(self, other):
+        if isinstance(other, (set, frozenset, dict)):
+            return len(self) == len(other) and all(element in other for element in self)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "OrderedSet([{}])".format(", ".join(repr(element) for element in self))
+
 class IndexGenerator(object):
 
     def __init__(self, start=0):
@@ -98,6 +579,7 @@ class RunLogger(object):
         self._log = logging.getLogger(self.name)
         self._log.setLevel(logging.DEBUG)
         self.handlers = []
+        self._opened_streams = []
         if kwargs.get("log_to_stderr", True):
             handler1 = logging.StreamHandler()
             stderr_logging_level = self.get_logging_level(kwargs.get("stderr_logging_level", logging.INFO))
@@ -109,7 +591,8 @@ class RunLogger(object):
             if "log_stream" in kwargs:
                 log_stream = kwargs.get("log_stream")
             else:
-                log_stream = open(kwargs.get("log_path", self.name + ".log"), "w")
+                log_stream = open_output_file(kwargs.get("log_path", self.name + ".log"), append=kwargs.get("log_append", False))
+                self._opened_streams.append(log_stream)
             handler2 = logging.StreamHandler(log_stream)
             file_logging_level = self.get_logging_level(kwargs.get("file_logging_level", logging.DEBUG))
             handler2.setLevel(file_logging_level)
@@ -118,6 +601,19 @@ class RunLogger(object):
             self.handlers.append(handler2)
         self._system = None
 
+    def close(self):
+        """
+        Detaches the handlers and closes the log file opened by this logger
+        (which, if compressed, is only complete once closed).
+        """
+        for handler in self.handlers:
+            handler.flush()
+            self._log.removeHandler(handler)
+        self.handlers = []
+        for log_stream in self._opened_streams:
+            log_stream.close()
+        self._opened_streams = []
+
     def _get_system(self):
         return self._system
 
@@ -32,12 +32,15 @@ setup(
     #         "bin/inphest-classify.py",
     #         "bin/inphest-profile-trees.py",
             "bin/inphest-simulate.py",
-    #         "bin/inphest-summarize.py",
+            "bin/inphest-summarize.py",
     #         "bin/inphest-generate-data-files-from-tip-labels.py",
             ],
     url="http://pypi.python.org/pypi/inphest/",
     license="LICENSE.txt",
     description="A Project",
     long_description=open("README.md").read(),
-    # install_requires=[ ],
+    install_requires=[
+        "dendropy",
+        "numpy",
+        ],
 )
@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of checkpointing simulations, and of restoring them from checkpoints.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from inphest import checkpoint
+from inphest import hostcache
+from inphest import model
+from inphest import simulate
+from inphest import utility
+
+HOST_HISTORY_SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "data", "revbayes", "bg_large.events.txt")
+
+class SimulationInterrupted(BaseException):
+    """
+    Raised to interrupt a simulation, as a kill would: not an `Exception`,
+    so that nothing in the simulation handles it.
+    """
+    pass
+
+class CheckpointTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        host_history_samples = hostcache.load_host_history_samples(
+                HOST_HISTORY_SAMPLES_PATH,
+                "revbayes",
+                is_use_cache=False)
+        cls.host_history = host_history_samples.host_histories[0]
+        # the RevBayes parser gives geographical anagenesis events the type
+        # 'anagenesis', but the simulator only processes them as
+        # 'geography_anagenesis'; without this, areas are never gained or
+        # lost, and the restored host system state is not exercised
+        cls.host_history.events[:] = [
+                host_event._replace(event_type="geography_anagenesis") if host_event.event_type == "anagenesis" else host_event
+                for host_event in cls.host_history.events]
+        cls.run_logger = utility.RunLogger(name="inphest-test", log_to_stderr=False, log_to_file=False)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint_path = checkpoint.compose_checkpoint_filepath(os.path.join(self.tmp_dir, "results.R0001.H0001"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_simulator(self, random_seed, **kwargs):
+        inphest_model = model.InphestModel.create(
+                model_definition_source={},
+                model_definition_type="python-dict",
+                interpolate_missing_model_values=True)
+        config_d = {
+            "random_seed": random_seed,
+            "run_logger": self.run_logger,
+            "trees_file": io.StringIO(),
+            "store_summary_stats": False,
+            "store_model_description": False,
+            "encode_nodes": False,
+            "replicate_idx": 0,
+            "host_history_idx": 0,
+            }
+        config_d.update(kwargs)
+        return simulate.InphestSimulator(
+                inphest_model=inphest_model,
+                host_history=self.host_history,
+                config_d=config_d,
+                is_verbose_setup=False,
+                summary_stats_calculator=None)
+
+    def run_simulation(self, simulator):
+        simulator.run()
+        return simulator.trees_file.getvalue(), simulator.elapsed_time
+
+    def run_checkpointed_simulation(self, random_seed, num_checkpoints_before_interruption=None):
+        """
+        Runs the simulation with a checkpoint taken before every event,
+        interrupted (if ``num_checkpoints_before_interruption`` is given) once
+        that number of checkpoints have been written. Returns the number of
+        checkpoints written.
+        """
+        write_checkpoint = checkpoint.write_checkpoint
+        checkpoint_filepaths = []
+        def interrupting_write_checkpoint(simulator, filepath):
+            write_checkpoint(simulator, filepath)
+            checkpoint_filepaths.append(filepath)
+            if len(checkpoint_filepaths) == num_checkpoints_before_interruption:
+                raise SimulationInterrupted()
+        simulator = self.create_simulator(
+                random_seed,
+                checkpoint_path=self.checkpoint_path,
+                checkpoint_interval=0)
+        with mock.patch.object(checkpoint, "write_checkpoint", interrupting_write_checkpoint):
+            if num_checkpoints_before_interruption is None:
+                result = self.run_simulation(simulator)
+            else:
+                self.assertRaises(SimulationInterrupted, simulator.run)
+                result = None
+        return result, len(checkpoint_filepaths)
+
+    def test_restore_gives_identical_output(self):
+        for random_seed in (1, 2, 3):
+            expected = self.run_simulation(self.create_simulator(random_seed))
+            self.assertEqual(self.run_simulation(self.create_simulator(random_seed)), expected)
+            # checkpointing itself does not change the simulation
+            result, num_checkpoints = self.run_checkpointed_simulation(random_seed)
+            self.assertEqual(result, expected)
+            self.assertGreater(num_checkpoints, 3)
+            for num_checkpoints_before_interruption in sorted(set([1, 2, num_checkpoints // 2, num_checkpoints - 1])):
+                self.run_checkpointed_simulation(random_seed, num_checkpoints_before_interruption)
+                header = checkpoint.read_checkpoint_header(self.checkpoint_path)
+                self.assertEqual(header["random_seed"], random_seed)
+                self.assertEqual(header["num_host_events"], len(self.host_history.events))
+                simulator = self.create_simulator(
+                        random_seed,
+                        checkpoint_path=self.checkpoint_path,
+                        restore_checkpoint=True)
+                self.assertEqual(self.run_simulation(simulator), expected,
+                        "random seed {}, interrupted after {} of {} checkpoints".format(
+                            random_seed, num_checkpoints_before_interruption, num_checkpoints))
+
+    def test_no_checkpoint_to_restore(self):
+        expected = self.run_simulation(self.create_simulator(1))
+        simulator = self.create_simulator(
+                1,
+                checkpoint_path=self.checkpoint_path,
+                restore_checkpoint=True)
+        self.assertEqual(self.run_simulation(simulator), expected)
+
+    def test_checkpoint_from_different_simulation(self):
+        self.run_checkpointed_simulation(1, 2)
+        simulator = self.create_simulator(
+                2,
+                checkpoint_path=self.checkpoint_path,
+                restore_checkpoint=True)
+        with self.assertRaises(ValueError):
+            simulator.run()
+
+    def test_interrupted_checkpoint_write(self):
+        # an interruption while writing a checkpoint leaves the previous one,
+        # from which the simulation is restored as usual
+        expected = self.run_simulation(self.create_simulator(1))
+        savez_compressed = checkpoint.numpy.savez_compressed
+        num_writes = [0]
+        def interrupting_savez_compressed(filepath, **arrays):
+            num_writes[0] += 1
+            if num_writes[0] < 3:
+                return savez_compressed(filepath, **arrays)
+            with open(filepath, "wb") as dest:
+                dest.write(b"PK\x03\x04")
+            raise SimulationInterrupted()
+        simulator = self.create_simulator(
+                1,
+                checkpoint_path=self.checkpoint_path,
+                checkpoint_interval=0)
+        with mock.patch.object(checkpoint.numpy, "savez_compressed", interrupting_savez_compressed):
+            self.assertRaises(SimulationInterrupted, simulator.run)
+        self.assertEqual(checkpoint.read_checkpoint_header(self.checkpoint_path)["random_seed"], 1)
+        simulator = self.create_simulator(
+                1,
+                checkpoint_path=self.checkpoint_path,
+                restore_checkpoint=True)
+        self.assertEqual(self.run_simulation(simulator), expected)
+
+    def test_discard_checkpoint(self):
+        self.run_checkpointed_simulation(1, 2)
+        simulator = self.create_simulator(1, checkpoint_path=self.checkpoint_path)
+        simulator.discard_checkpoint()
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+if __name__ == "__main__":
+    unittest.main()
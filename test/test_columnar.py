@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of the columnar summary statistics store.
+"""
+
+import collections
+import json
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from inphest import columnar
+from inphest import utility
+
+
+def compose_row(row_idx):
+    return collections.OrderedDict([
+        ("stat.a", float(row_idx)),
+        ("stat.b", row_idx * 0.5),
+        ("stat.c", None if row_idx % 3 == 0 else -row_idx),
+        ])
+
+class SummaryStatsColumnWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "results." + columnar.SUMMARY_STATS_COLUMNS_EXTENSION)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_header(self):
+        with open(os.path.join(self.path, "header.json")) as src:
+            return json.load(src)
+
+    def check_rows(self, data, row_idxs, model_ids):
+        self.assertEqual(list(data["model.id"]), model_ids)
+        self.assertEqual(list(data["stat.a"]), [float(row_idx) for row_idx in row_idxs])
+        self.assertEqual(list(data["stat.b"]), [row_idx * 0.5 for row_idx in row_idxs])
+        for value, row_idx in zip(data["stat.c"], row_idxs):
+            if row_idx % 3 == 0:
+                self.assertTrue(math.isnan(value))
+            else:
+                self.assertEqual(value, -row_idx)
+
+    def test_empty_store(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        header = self.read_header()
+        self.assertEqual(header["num_rows"], 0)
+        self.assertEqual(header["columns"], [])
+        self.assertEqual(columnar.load_summary_stats(self.path), collections.OrderedDict())
+        self.assertEqual(writer.num_records, 0)
+
+    def test_write_and_load(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        writer.write_batch([("m1", compose_row(0)), ("m2", compose_row(1))])
+        header = self.read_header()
+        self.assertEqual(header["num_rows"], 2)
+        self.assertEqual(header["model_ids"], ["m1", "m2"])
+        self.assertEqual([column["name"] for column in header["columns"]], ["model.id", "stat.a", "stat.b", "stat.c"])
+        writer.write_batch([("m1", compose_row(2)), ("m3", compose_row(3))])
+        self.assertEqual(self.read_header()["num_rows"], 4)
+        self.assertEqual(writer.num_records, 4)
+        self.assertEqual(columnar.read_summary_stats_columns(self.path), ["model.id", "stat.a", "stat.b", "stat.c"])
+        for is_memory_mapped in (True, False):
+            data = columnar.load_summary_stats(self.path, is_memory_mapped=is_memory_mapped)
+            self.assertEqual(list(data.keys()), ["model.id", "stat.a", "stat.b", "stat.c"])
+            self.check_rows(data, [0, 1, 2, 3], ["m1", "m2", "m1", "m3"])
+
+    def test_load_column_subset(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        writer.write_batch([("m1", compose_row(row_idx)) for row_idx in range(5)])
+        data = columnar.load_summary_stats(self.path, columns=["stat.b", "stat.a"])
+        self.assertEqual(list(data.keys()), ["stat.b", "stat.a"])
+        self.assertEqual(list(data["stat.a"]), [0.0, 1.0, 2.0, 3.0, 4.0])
+        with self.assertRaises(KeyError):
+            columnar.load_summary_stats(self.path, columns=["stat.x"])
+
+    def test_mismatched_row(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        writer.write_batch([("m1", compose_row(0))])
+        row = compose_row(1)
+        del row["stat.b"]
+        with self.assertRaises(ValueError):
+            writer.write_batch([("m1", row)])
+        row["stat.x"] = 1.0
+        with self.assertRaises(ValueError):
+            writer.write_batch([("m1", row)])
+
+    def test_rows_beyond_header_ignored(self):
+        # as left by a write interrupted before the header was updated
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        writer.write_batch([("m1", compose_row(row_idx)) for row_idx in range(3)])
+        header = self.read_header()
+        header["num_rows"] = 2
+        with open(os.path.join(self.path, "header.json"), "w") as dest:
+            json.dump(header, dest)
+        data = columnar.load_summary_stats(self.path)
+        self.check_rows(data, [0, 1], ["m1", "m1"])
+
+    def test_reopen_truncates_and_appends(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        writer.write_batch([("m1", compose_row(row_idx)) for row_idx in range(4)])
+        writer = columnar.SummaryStatsColumnWriter(self.path, num_rows=2)
+        self.assertEqual(writer.num_records, 2)
+        self.assertEqual(self.read_header()["num_rows"], 2)
+        writer.write_batch([("m2", compose_row(row_idx)) for row_idx in range(10, 12)])
+        data = columnar.load_summary_stats(self.path)
+        self.check_rows(data, [0, 1, 10, 11], ["m1", "m1", "m2", "m2"])
+        self.assertEqual(len(numpy.load(os.path.join(self.path, "c0001.npy"))), 4)
+        with self.assertRaises(ValueError):
+            columnar.SummaryStatsColumnWriter(self.path, num_rows=5)
+
+    def test_truncate(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        writer.truncate(0)
+        writer.write_batch([("m1", compose_row(row_idx)) for row_idx in range(3)])
+        writer.truncate(1)
+        self.assertEqual(self.read_header()["num_rows"], 1)
+        writer.write_batch([("m2", compose_row(5))])
+        self.check_rows(columnar.load_summary_stats(self.path), [0, 5], ["m1", "m2"])
+        with self.assertRaises(ValueError):
+            writer.truncate(3)
+
+    def test_new_store_replaces_existing(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        writer.write_batch([("m1", compose_row(0))])
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        self.assertEqual(self.read_header()["num_rows"], 0)
+        self.assertFalse(os.path.exists(os.path.join(self.path, "c0000.npy")))
+
+    def test_through_output_sink(self):
+        writer = columnar.SummaryStatsColumnWriter(self.path)
+        sink = utility.BufferedOutputSink(max_buffered_records=2, is_sync=True)
+        for row_idx in range(3):
+            sink.write(writer, ("m1", compose_row(row_idx)))
+            sink.end_record()
+        self.assertEqual(self.read_header()["num_rows"], 2)
+        sink.close()
+        self.check_rows(columnar.load_summary_stats(self.path), [0, 1, 2], ["m1"] * 3)
+
+class AppendableArrayFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "values.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_append(self):
+        array_file = columnar.AppendableArrayFile(self.path, "<f8")
+        self.assertEqual(len(numpy.load(self.path)), 0)
+        array_file.append([1.0, 2.0])
+        array_file.append(numpy.arange(3))
+        self.assertEqual(list(numpy.load(self.path)), [1.0, 2.0, 0.0, 1.0, 2.0])
+        self.assertEqual(list(numpy.load(self.path, mmap_mode="r")), [1.0, 2.0, 0.0, 1.0, 2.0])
+
+    def test_truncate(self):
+        array_file = columnar.AppendableArrayFile(self.path, "<i4")
+        array_file.append([1, 2, 3])
+        array_file.truncate(2)
+        self.assertEqual(list(numpy.load(self.path)), [1, 2])
+        array_file.append([4])
+        self.assertEqual(list(numpy.load(self.path)), [1, 2, 4])
+        with self.assertRaises(ValueError):
+            array_file.truncate(4)
+
+    def test_reopen(self):
+        array_file = columnar.AppendableArrayFile(self.path, "<i4")
+        array_file.append([1, 2, 3])
+        array_file = columnar.AppendableArrayFile(self.path, "<i4", num_values=1)
+        self.assertEqual(list(numpy.load(self.path)), [1])
+        array_file.append([4])
+        self.assertEqual(list(numpy.load(self.path)), [1, 4])
+        with self.assertRaises(ValueError):
+            columnar.AppendableArrayFile(self.path, "<f8", num_values=1)
+        with self.assertRaises(ValueError):
+            columnar.AppendableArrayFile(self.path, "<i4", num_values=3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of the on-disk cache of compiled host histories.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import numpy
+
+from inphest import hostcache
+from inphest import model
+
+HOST_HISTORY_SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "data", "revbayes", "bg_large.events.txt")
+SCHEMA = "revbayes"
+
+class HostHistoryCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.tmp_dir, os.path.basename(HOST_HISTORY_SAMPLES_PATH))
+        shutil.copyfile(HOST_HISTORY_SAMPLES_PATH, self.source_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def parse(self, sample_selection=None):
+        return hostcache.load_host_history_samples(
+                self.source_path,
+                SCHEMA,
+                sample_selection=sample_selection,
+                is_use_cache=False)
+
+    def write(self, host_history_samples, sample_selection=None):
+        return hostcache.write_host_history_cache(
+                host_history_samples=host_history_samples,
+                source_path=self.source_path,
+                schema=SCHEMA,
+                is_validated=True,
+                sample_selection=sample_selection)
+
+    def read(self, schema=SCHEMA, sample_selection=None, is_memory_mapped=True):
+        return hostcache.read_host_history_cache(
+                source_path=self.source_path,
+                schema=schema,
+                sample_selection=sample_selection,
+                is_memory_mapped=is_memory_mapped)
+
+    def cache_filenames(self):
+        return sorted(filename for filename in os.listdir(self.tmp_dir) if filename != os.path.basename(self.source_path))
+
+    def check_host_history_samples(self, host_history_samples, expected):
+        self.assertEqual(len(host_history_samples.host_histories), len(expected.host_histories))
+        for host_history, expected_host_history in zip(host_history_samples.host_histories, expected.host_histories):
+            self.assertEqual(host_history.sample_idx, expected_host_history.sample_idx)
+            self.assertEqual(host_history.start_time, expected_host_history.start_time)
+            self.assertEqual(host_history.end_time, expected_host_history.end_time)
+            self.assertEqual(list(host_history.lineages.items()), list(expected_host_history.lineages.items()))
+            self.assertEqual(host_history.events, expected_host_history.events)
+            self.assertEqual(
+                    host_history.tree.as_string(schema="newick"),
+                    expected_host_history.tree.as_string(schema="newick"))
+            self.assertEqual(
+                    host_history.lineage_distance_matrix.lineage_ids,
+                    expected_host_history.lineage_distance_matrix.lineage_ids)
+            self.assertTrue(numpy.array_equal(
+                    numpy.asarray(host_history.lineage_distance_matrix.distances),
+                    numpy.asarray(expected_host_history.lineage_distance_matrix.distances)))
+
+    def test_round_trip(self):
+        host_history_samples = self.parse()
+        stem = self.write(host_history_samples)
+        self.assertEqual(self.cache_filenames(), sorted([os.path.basename(stem) + ".json", os.path.basename(stem) + ".npy"]))
+        for is_memory_mapped in (True, False):
+            self.check_host_history_samples(self.read(is_memory_mapped=is_memory_mapped), host_history_samples)
+
+    def test_round_trip_selection(self):
+        sample_selection = model.HostHistorySampleSelection(sample_indexes=[1])
+        host_history_samples = self.parse(sample_selection=sample_selection)
+        self.write(host_history_samples, sample_selection=sample_selection)
+        self.check_host_history_samples(self.read(sample_selection=sample_selection), host_history_samples)
+        # entries for other selections are distinct
+        self.assertIsNone(self.read())
+        self.assertIsNone(self.read(sample_selection=model.HostHistorySampleSelection(sample_indexes=[0])))
+
+    def test_load(self):
+        expected = self.parse()
+        self.check_host_history_samples(hostcache.load_host_history_samples(self.source_path, SCHEMA), expected)
+        self.assertIsNotNone(self.read())
+        self.check_host_history_samples(hostcache.load_host_history_samples(self.source_path, SCHEMA), expected)
+
+    def test_invalidated_by_source_change(self):
+        self.write(self.parse())
+        old_filenames = self.cache_filenames()
+        with open(self.source_path, "a") as dest:
+            dest.write("\n")
+        self.assertIsNone(self.read())
+        self.assertIsNone(self.read(schema="other"))
+        hostcache.load_host_history_samples(self.source_path, SCHEMA)
+        # the stale entry is replaced
+        new_filenames = self.cache_filenames()
+        self.assertEqual(len(new_filenames), 2)
+        self.assertFalse(set(old_filenames) & set(new_filenames))
+        self.assertIsNotNone(self.read())
+
+    def test_truncated_header(self):
+        stem = self.write(self.parse())
+        with open(stem + ".json", "r+b") as dest:
+            dest.truncate(os.path.getsize(stem + ".json") // 2)
+        self.assertIsNone(self.read())
+        # treated as a miss: reparsed and rewritten
+        self.check_host_history_samples(hostcache.load_host_history_samples(self.source_path, SCHEMA), self.parse())
+        self.assertIsNotNone(self.read())
+
+    def test_truncated_data(self):
+        stem = self.write(self.parse())
+        for size in (os.path.getsize(stem + ".npy") - 8, 10):
+            with open(stem + ".npy", "r+b") as dest:
+                dest.truncate(size)
+            for is_memory_mapped in (True, False):
+                self.assertIsNone(self.read(is_memory_mapped=is_memory_mapped))
+        os.remove(stem + ".npy")
+        self.assertIsNone(self.read())
+
+    def test_interrupted_write(self):
+        host_history_samples = self.parse()
+        self.write(host_history_samples)
+        filenames = self.cache_filenames()
+        def failing_dump(*args, **kwargs):
+            raise OSError("No space left on device")
+        with mock.patch.object(hostcache.json, "dump", failing_dump):
+            self.assertRaises(OSError, self.write, host_history_samples)
+        # no temporaries are left, and the previous entry is intact
+        self.assertEqual(self.cache_filenames(), filenames)
+        self.check_host_history_samples(self.read(), host_history_samples)
+
+    def test_concurrent_writes(self):
+        # another process writing the same entry while this one is writing
+        # it uses different temporary files
+        host_history_samples = self.parse()
+        save = numpy.save
+        calls = []
+        def interleaved_save(dest, values):
+            calls.append(dest.name)
+            save(dest, values)
+            if len(calls) == 1:
+                self.write(host_history_samples)
+        with mock.patch.object(hostcache.numpy, "save", interleaved_save):
+            stem = self.write(host_history_samples)
+        self.assertEqual(len(calls), 2)
+        self.assertNotEqual(calls[0], calls[1])
+        self.assertEqual(self.cache_filenames(), sorted([os.path.basename(stem) + ".json", os.path.basename(stem) + ".npy"]))
+        self.check_host_history_samples(self.read(), host_history_samples)
+
+class HostReferenceCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, "host.refs")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        self.assertEqual(hostcache.read_host_reference_cache(self.filepath), {})
+        definitions = {"key1": {"a": [1, 2]}, "key2": {"b": None}}
+        hostcache.write_host_reference_cache(definitions, self.filepath)
+        self.assertEqual(hostcache.read_host_reference_cache(self.filepath), definitions)
+        self.assertEqual(os.listdir(self.tmp_dir), ["host.refs"])
+
+    def test_unreadable(self):
+        hostcache.write_host_reference_cache({"key1": {"a": [1, 2]}}, self.filepath)
+        with open(self.filepath, "r+b") as dest:
+            dest.truncate(10)
+        self.assertEqual(hostcache.read_host_reference_cache(self.filepath), {})
+        with open(self.filepath, "w") as dest:
+            dest.write('{"format": "something-else"}')
+        self.assertEqual(hostcache.read_host_reference_cache(self.filepath), {})
+
+if __name__ == "__main__":
+    unittest.main()
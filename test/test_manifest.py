@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of run manifests, and of resuming interrupted runs from them.
+"""
+
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+from inphest import columnar
+from inphest import manifest
+from inphest import utility
+
+RUN_SETTINGS = collections.OrderedDict([
+    ("random_seed", 12345),
+    ("nreps", 6),
+    ("summary_stats_config", {"num_randomization_replicates": 10}),
+    ])
+
+def compose_replicate(rep_idx):
+    tree_str = "[&R] ((a{0}:1,b{0}:1):{0},c{0}:{0});\n".format(rep_idx)
+    summary_stats = collections.OrderedDict([("stat.a", float(rep_idx)), ("stat.b", rep_idx * 2.0)])
+    return tree_str, summary_stats, 100 + rep_idx
+
+class RunManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_prefix = os.path.join(self.tmp_dir, "results")
+        self.trees_filepath = self.output_prefix + ".trees"
+        self.summary_stats_path = self.output_prefix + "." + columnar.SUMMARY_STATS_COLUMNS_EXTENSION
+        self.manifest_filepath = manifest.compose_run_manifest_filepath(self.output_prefix)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def open_run(self, run_manifest=None):
+        # as in |simulate.repeat_run|: the output files opened (or, if
+        # resuming, truncated and reopened) and added to the sink before the
+        # manifest
+        outputs = collections.OrderedDict()
+        if run_manifest is None:
+            outputs["trees"] = open(self.trees_filepath, "w")
+            outputs["trees_index"] = columnar.TreesIndexWriter(self.trees_filepath)
+            outputs["summary_stats"] = columnar.SummaryStatsColumnWriter(self.summary_stats_path)
+        else:
+            output_sizes = run_manifest.output_sizes
+            manifest.truncate_output_file(self.trees_filepath, output_sizes["trees"])
+            outputs["trees"] = open(self.trees_filepath, "a")
+            outputs["trees_index"] = columnar.TreesIndexWriter(
+                    self.trees_filepath,
+                    offset=output_sizes["trees"],
+                    num_records=output_sizes["trees_index"])
+            outputs["summary_stats"] = columnar.SummaryStatsColumnWriter(self.summary_stats_path, num_rows=output_sizes["summary_stats"])
+        sink = utility.BufferedOutputSink(max_buffered_records=2)
+        for output in outputs.values():
+            sink.add_destination(output)
+        run_manifest_writer = manifest.RunManifestWriter(
+                self.manifest_filepath,
+                settings=RUN_SETTINGS,
+                outputs=outputs,
+                is_append=run_manifest is not None)
+        sink.add_destination(run_manifest_writer)
+        return sink, outputs, run_manifest_writer
+
+    def write_replicates(self, sink, outputs, run_manifest_writer, rep_idxs):
+        for rep_idx in rep_idxs:
+            tree_str, summary_stats, random_seed = compose_replicate(rep_idx)
+            sink.write(outputs["trees"], tree_str)
+            sink.write(outputs["trees_index"], (tree_str, rep_idx, 0, 0, random_seed))
+            sink.write(outputs["summary_stats"], ("m", summary_stats))
+            sink.write(run_manifest_writer, (rep_idx, 0, random_seed))
+            sink.end_record()
+
+    def close_run(self, sink, outputs, run_manifest_writer):
+        sink.close()
+        outputs["trees"].close()
+        run_manifest_writer.close()
+
+    def check_outputs(self, rep_idxs):
+        with open(self.trees_filepath) as src:
+            self.assertEqual(src.read(), "".join(compose_replicate(rep_idx)[0] for rep_idx in rep_idxs))
+        trees_index = columnar.load_trees_index(self.trees_filepath)
+        self.assertEqual(list(trees_index["replicate_idx"]), rep_idxs)
+        self.assertEqual(
+                list(columnar.read_indexed_tree_strings(self.trees_filepath, range(len(rep_idxs)), trees_index)),
+                [compose_replicate(rep_idx)[0] for rep_idx in rep_idxs])
+        summary_stats = columnar.load_summary_stats(self.summary_stats_path)
+        self.assertEqual(list(summary_stats["stat.a"]), [float(rep_idx) for rep_idx in rep_idxs])
+
+    def test_read(self):
+        sink, outputs, run_manifest_writer = self.open_run()
+        self.write_replicates(sink, outputs, run_manifest_writer, range(3))
+        self.close_run(sink, outputs, run_manifest_writer)
+        run_manifest = manifest.RunManifest(self.manifest_filepath)
+        self.assertEqual(run_manifest.settings, RUN_SETTINGS)
+        self.assertEqual(run_manifest.completed, [(0, 0, 100), (1, 0, 101), (2, 0, 102)])
+        self.assertEqual(run_manifest.output_sizes["trees"], os.path.getsize(self.trees_filepath))
+        self.assertEqual(run_manifest.output_sizes["trees_index"], 3)
+        self.assertEqual(run_manifest.output_sizes["summary_stats"], 3)
+
+    def test_no_completed_replicates(self):
+        sink, outputs, run_manifest_writer = self.open_run()
+        self.close_run(sink, outputs, run_manifest_writer)
+        run_manifest = manifest.RunManifest(self.manifest_filepath)
+        self.assertEqual(run_manifest.completed, [])
+        self.assertIsNone(run_manifest.output_sizes)
+
+    def test_resume(self):
+        sink, outputs, run_manifest_writer = self.open_run()
+        self.write_replicates(sink, outputs, run_manifest_writer, range(4))
+        sink.flush()
+        # interruption while writing out the next batch: partial output
+        # written to some of the files but not recorded in the manifest,
+        # whose last line is itself partial
+        outputs["trees"].write(compose_replicate(4)[0] + "[&R] (partial")
+        outputs["trees"].flush()
+        outputs["trees_index"].write_batch([(compose_replicate(4)[0], 4, 0, 0, 104)])
+        with open(self.manifest_filepath, "a") as dest:
+            dest.write('{"completed": [[4, 0, 104]], "output_siz')
+        outputs["trees"].close()
+        run_manifest = manifest.RunManifest(self.manifest_filepath)
+        self.assertEqual([entry[0] for entry in run_manifest.completed], [0, 1, 2, 3])
+        # the partial manifest line is removed on reopening the manifest
+        sink, outputs, run_manifest_writer = self.open_run(run_manifest)
+        completed = set(entry[0] for entry in run_manifest.completed)
+        self.write_replicates(sink, outputs, run_manifest_writer, [rep_idx for rep_idx in range(6) if rep_idx not in completed])
+        self.close_run(sink, outputs, run_manifest_writer)
+        self.check_outputs(list(range(6)))
+        run_manifest = manifest.RunManifest(self.manifest_filepath)
+        self.assertEqual([entry[0] for entry in run_manifest.completed], list(range(6)))
+        self.assertEqual(run_manifest.output_sizes["trees"], os.path.getsize(self.trees_filepath))
+
+    def test_partial_last_line_ignored(self):
+        sink, outputs, run_manifest_writer = self.open_run()
+        self.write_replicates(sink, outputs, run_manifest_writer, range(2))
+        self.close_run(sink, outputs, run_manifest_writer)
+        output_sizes = manifest.RunManifest(self.manifest_filepath).output_sizes
+        with open(self.manifest_filepath, "a") as dest:
+            dest.write('{"completed": [[2, 0, 102]]')
+        run_manifest = manifest.RunManifest(self.manifest_filepath)
+        self.assertEqual(len(run_manifest.completed), 2)
+        self.assertEqual(run_manifest.output_sizes, output_sizes)
+
+    def test_not_a_manifest(self):
+        with open(self.manifest_filepath, "w") as dest:
+            dest.write('{"format": "something-else", "version": 1}\n')
+        with self.assertRaises(ValueError):
+            manifest.RunManifest(self.manifest_filepath)
+        with open(self.manifest_filepath, "w") as dest:
+            dest.write('{"format": "inphest-run-manifest"')
+        with self.assertRaises(ValueError):
+            manifest.RunManifest(self.manifest_filepath)
+
+    def test_check_settings(self):
+        sink, outputs, run_manifest_writer = self.open_run()
+        self.close_run(sink, outputs, run_manifest_writer)
+        run_manifest = manifest.RunManifest(self.manifest_filepath)
+        run_manifest.check_settings(collections.OrderedDict(RUN_SETTINGS))
+        settings = collections.OrderedDict(RUN_SETTINGS)
+        settings["random_seed"] = 54321
+        with self.assertRaises(ValueError):
+            run_manifest.check_settings(settings)
+        settings = collections.OrderedDict(RUN_SETTINGS)
+        settings["summary_stats_config"] = {"num_randomization_replicates": 20}
+        with self.assertRaises(ValueError):
+            run_manifest.check_settings(settings)
+        settings = collections.OrderedDict(RUN_SETTINGS)
+        settings["is_index_trees"] = True
+        with self.assertRaises(ValueError):
+            run_manifest.check_settings(settings)
+
+    def test_truncate_output_file(self):
+        filepath = os.path.join(self.tmp_dir, "output.txt")
+        with open(filepath, "w") as dest:
+            dest.write("0123456789")
+        manifest.truncate_output_file(filepath, 4)
+        with open(filepath) as src:
+            self.assertEqual(src.read(), "0123")
+        with self.assertRaises(ValueError):
+            manifest.truncate_output_file(filepath, 5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of |utility.OrderedSet|.
+"""
+
+import unittest
+
+from inphest import utility
+
+
+class Element(object):
+    """
+    Hashed by identity, as are lineages and areas.
+    """
+
+    def __init__(self, label):
+        self.label = label
+
+class OrderedSetTestCase(unittest.TestCase):
+
+    def test_insertion_order(self):
+        elements = [Element(idx) for idx in range(50)]
+        s = utility.OrderedSet()
+        for element in reversed(elements):
+            s.add(element)
+        s.add(elements[-1])
+        self.assertEqual(list(s), list(reversed(elements)))
+        s.remove(elements[10])
+        s.discard(elements[20])
+        s.discard(elements[20])
+        s.add(elements[10])
+        expected = [element for element in reversed(elements) if element not in (elements[10], elements[20])] + [elements[10]]
+        self.assertEqual(list(s), expected)
+
+    def test_construction_and_update(self):
+        s = utility.OrderedSet([3, 1, 2, 1])
+        self.assertEqual(list(s), [3, 1, 2])
+        s.update([5, 3, 4])
+        self.assertEqual(list(s), [3, 1, 2, 5, 4])
+        self.assertEqual(len(s), 5)
+        self.assertIn(5, s)
+        self.assertNotIn(6, s)
+        with self.assertRaises(KeyError):
+            s.remove(6)
+
+    def test_comparison(self):
+        s = utility.OrderedSet([1, 2, 3])
+        self.assertEqual(s, set([3, 2, 1]))
+        self.assertEqual(s, frozenset([1, 2, 3]))
+        self.assertEqual(s, utility.OrderedSet([3, 2, 1]))
+        self.assertNotEqual(s, set([1, 2]))
+        self.assertNotEqual(s, set([1, 2, 4]))
+        self.assertFalse(s != set([1, 2, 3]))
+        self.assertNotEqual(s, [1, 2, 3])
+        with self.assertRaises(TypeError):
+            hash(s)
+
+    def test_repr(self):
+        self.assertEqual(repr(utility.OrderedSet(["a", "b"])), "OrderedSet(['a', 'b'])")
+
+if __name__ == "__main__":
+    unittest.main()
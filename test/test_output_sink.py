@@ -0,0 +1,303 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of |utility.BufferedOutputSink|.
+"""
+
+import collections
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from inphest import columnar
+from inphest import manifest
+from inphest import utility
+
+
+class RecordingTextFile(io.StringIO):
+    """
+    Text destination recording each call to ``write`` and ``flush``.
+    """
+
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.writes = []
+        self.num_flushes = 0
+
+    def write(self, s):
+        self.writes.append(s)
+        return io.StringIO.write(self, s)
+
+    def flush(self):
+        self.num_flushes += 1
+        io.StringIO.flush(self)
+
+
+class RecordingBatchDestination(object):
+    """
+    Batch destination recording each batch written and each sync.
+    """
+
+    is_batch_destination = True
+
+    def __init__(self):
+        self.batches = []
+        self.num_syncs = 0
+
+    def write_batch(self, items):
+        self.batches.append(items)
+
+    @property
+    def num_records(self):
+        return sum(len(batch) for batch in self.batches)
+
+    def truncate(self, num_records):
+        items = [item for batch in self.batches for item in batch][:num_records]
+        self.batches = [items] if items else []
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        self.num_syncs += 1
+
+class FailingDestination(RecordingTextFile):
+    """
+    Text destination failing (after writing part of the output) while
+    ``failure`` is set.
+    """
+
+    def __init__(self, failure):
+        RecordingTextFile.__init__(self)
+        self.failure = failure
+
+    def write(self, s):
+        if self.failure is not None:
+            RecordingTextFile.write(self, s[:len(s) // 2])
+            raise self.failure
+        return RecordingTextFile.write(self, s)
+
+
+class BufferedOutputSinkTestCase(unittest.TestCase):
+
+    def test_records_held_until_limit(self):
+        dest = RecordingTextFile()
+        sink = utility.BufferedOutputSink(max_buffered_records=3)
+        for idx in range(2):
+            sink.write(dest, "a{}".format(idx))
+            sink.write(dest, "b{}\n".format(idx))
+            sink.end_record()
+        self.assertEqual(dest.getvalue(), "")
+        sink.write(dest, "a2b2\n")
+        sink.end_record()
+        self.assertEqual(dest.writes, ["a0b0\na1b1\na2b2\n"])
+        self.assertEqual(sink.num_records_written, 3)
+        self.assertEqual(sink.num_batches_written, 1)
+
+    def test_record_in_progress_discarded_on_close(self):
+        dest = RecordingTextFile()
+        sink = utility.BufferedOutputSink(max_buffered_records=10)
+        sink.write(dest, "complete\n")
+        sink.end_record()
+        sink.write(dest, "partial")
+        sink.close()
+        self.assertEqual(dest.getvalue(), "complete\n")
+        self.assertEqual(sink.num_records_written, 1)
+
+    def test_discard_record(self):
+        dest = RecordingTextFile()
+        sink = utility.BufferedOutputSink()
+        sink.write(dest, "discarded\n")
+        sink.discard_record()
+        sink.write(dest, "kept\n")
+        sink.end_record()
+        self.assertEqual(dest.getvalue(), "kept\n")
+
+    def test_destinations_written_in_order_added(self):
+        first = RecordingTextFile()
+        second = RecordingTextFile()
+        order = []
+        first.write = lambda s, f=first.write: (order.append("first"), f(s))[1]
+        second.write = lambda s, f=second.write: (order.append("second"), f(s))[1]
+        sink = utility.BufferedOutputSink(max_buffered_records=2)
+        sink.add_destination(first)
+        for idx in range(2):
+            # written to second first within the record, but first was
+            # added before
+            sink.write(second, "s{}\n".format(idx))
+            sink.write(first, "f{}\n".format(idx))
+            sink.end_record()
+        self.assertEqual(order, ["first", "second"])
+        self.assertEqual(first.getvalue(), "f0\nf1\n")
+        self.assertEqual(second.getvalue(), "s0\ns1\n")
+
+    def test_batch_destination(self):
+        text_dest = RecordingTextFile()
+        batch_dest = RecordingBatchDestination()
+        sink = utility.BufferedOutputSink(max_buffered_records=2)
+        for idx in range(4):
+            sink.write(text_dest, "{}\n".format(idx))
+            sink.write(batch_dest, (idx, "item"))
+            sink.end_record()
+        self.assertEqual(batch_dest.batches, [[(0, "item"), (1, "item")], [(2, "item"), (3, "item")]])
+        self.assertEqual(text_dest.writes, ["0\n1\n", "2\n3\n"])
+
+    def test_sync(self):
+        batch_dest = RecordingBatchDestination()
+        sink = utility.BufferedOutputSink(is_sync=False)
+        sink.write(batch_dest, 0)
+        sink.end_record()
+        self.assertEqual(batch_dest.num_syncs, 0)
+        sink = utility.BufferedOutputSink(is_sync=True)
+        sink.write(batch_dest, 1)
+        sink.end_record()
+        self.assertEqual(batch_dest.num_syncs, 1)
+        # destinations without a file descriptor are skipped
+        text_dest = RecordingTextFile()
+        sink.write(text_dest, "x\n")
+        sink.end_record()
+        self.assertEqual(text_dest.getvalue(), "x\n")
+
+    def test_buffer_time(self):
+        dest = RecordingTextFile()
+        sink = utility.BufferedOutputSink(max_buffered_records=100, max_buffer_time=0)
+        sink.write(dest, "x\n")
+        sink.end_record()
+        self.assertEqual(dest.getvalue(), "x\n")
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            utility.BufferedOutputSink(max_buffered_records=0)
+        with self.assertRaises(ValueError):
+            utility.BufferedOutputSink(max_buffer_time=-1)
+
+    def test_failed_flush_rolled_back(self):
+        for failure in (OSError("No space left on device"), KeyboardInterrupt()):
+            text_dest = RecordingTextFile()
+            batch_dest = RecordingBatchDestination()
+            failing_dest = FailingDestination(failure)
+            sink = utility.BufferedOutputSink(max_buffered_records=2)
+            for idx in range(2):
+                sink.write(text_dest, "{}\n".format(idx))
+                sink.write(batch_dest, idx)
+                sink.write(failing_dest, "f{}\n".format(idx))
+                if idx == 0:
+                    sink.end_record()
+            self.assertRaises(type(failure), sink.end_record)
+            # the destinations written before the failure are truncated back
+            self.assertEqual(text_dest.getvalue(), "")
+            self.assertEqual(batch_dest.num_records, 0)
+            self.assertEqual(failing_dest.getvalue(), "")
+            self.assertEqual(sink.num_records_written, 0)
+            # and the batch is kept, to be written out once by the next flush
+            failing_dest.failure = None
+            sink.close()
+            self.assertEqual(text_dest.getvalue(), "0\n1\n")
+            self.assertEqual(batch_dest.batches, [[0, 1]])
+            self.assertEqual(failing_dest.getvalue(), "f0\nf1\n")
+            self.assertEqual(sink.num_records_written, 2)
+
+    def test_failed_flush_after_earlier_batches(self):
+        text_dest = RecordingTextFile()
+        batch_dest = RecordingBatchDestination()
+        failing_dest = FailingDestination(None)
+        sink = utility.BufferedOutputSink()
+        sink.write(text_dest, "0\n")
+        sink.write(batch_dest, 0)
+        sink.write(failing_dest, "f0\n")
+        sink.end_record()
+        failing_dest.failure = OSError()
+        sink.write(text_dest, "1\n")
+        sink.write(batch_dest, 1)
+        sink.write(failing_dest, "f1\n")
+        self.assertRaises(OSError, sink.end_record)
+        self.assertEqual(text_dest.getvalue(), "0\n")
+        self.assertEqual(batch_dest.batches, [[0]])
+        self.assertEqual(failing_dest.getvalue(), "f0\n")
+        # output that cannot be truncated is left as it is
+        unseekable_dest = RecordingTextFile()
+        unseekable_dest.seekable = lambda: False
+        sink = utility.BufferedOutputSink()
+        sink.write(unseekable_dest, "0\n")
+        sink.write(FailingDestination(OSError()), "f0\n")
+        self.assertRaises(OSError, sink.end_record)
+        self.assertEqual(unseekable_dest.getvalue(), "0\n")
+
+class BufferedOutputSinkFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_prefix = os.path.join(self.tmp_dir, "results")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_interrupted_flush_rolled_back(self):
+        # the output files of a run, with the run manifest interrupted
+        # while writing its line for the second batch
+        trees_filepath = self.output_prefix + ".trees"
+        summary_stats_path = self.output_prefix + "." + columnar.SUMMARY_STATS_COLUMNS_EXTENSION
+        outputs = collections.OrderedDict()
+        outputs["trees"] = open(trees_filepath, "w")
+        outputs["trees_index"] = columnar.TreesIndexWriter(trees_filepath)
+        outputs["summary_stats"] = columnar.SummaryStatsColumnWriter(summary_stats_path)
+        run_manifest_writer = manifest.RunManifestWriter(
+                manifest.compose_run_manifest_filepath(self.output_prefix),
+                settings={},
+                outputs=outputs)
+        sink = utility.BufferedOutputSink(max_buffered_records=2)
+        for output in outputs.values():
+            sink.add_destination(output)
+        sink.add_destination(run_manifest_writer)
+        def write_replicate(rep_idx):
+            tree_str = "(a{0},b{0});\n".format(rep_idx)
+            sink.write(outputs["trees"], tree_str)
+            sink.write(outputs["trees_index"], (tree_str, rep_idx, 0, 0, rep_idx))
+            sink.write(outputs["summary_stats"], ("m", collections.OrderedDict([("stat", float(rep_idx))])))
+            sink.write(run_manifest_writer, (rep_idx, 0, rep_idx))
+            sink.end_record()
+        for rep_idx in range(2):
+            write_replicate(rep_idx)
+        write_line = run_manifest_writer._write_line
+        def interrupted_write_line(d):
+            run_manifest_writer._dest.write('{"completed": ')
+            raise KeyboardInterrupt()
+        run_manifest_writer._write_line = interrupted_write_line
+        write_replicate(2)
+        self.assertRaises(KeyboardInterrupt, write_replicate, 3)
+        outputs["trees"].flush()
+        run_manifest_writer.flush()
+        def check_outputs(rep_idxs):
+            with open(trees_filepath) as src:
+                self.assertEqual(src.read(), "".join("(a{0},b{0});\n".format(rep_idx) for rep_idx in rep_idxs))
+            self.assertEqual(list(columnar.load_trees_index(trees_filepath)["replicate_idx"]), rep_idxs)
+            self.assertEqual(list(columnar.load_summary_stats(summary_stats_path)["stat"]), [float(rep_idx) for rep_idx in rep_idxs])
+            run_manifest = manifest.RunManifest(run_manifest_writer.name)
+            self.assertEqual([entry[0] for entry in run_manifest.completed], rep_idxs)
+            self.assertEqual(run_manifest.output_sizes["trees"], os.path.getsize(trees_filepath))
+            self.assertEqual(run_manifest.output_sizes["trees_index"], len(rep_idxs))
+            self.assertEqual(run_manifest.output_sizes["summary_stats"], len(rep_idxs))
+        check_outputs([0, 1])
+        with open(run_manifest_writer.name) as src:
+            self.assertTrue(src.read().endswith("\n"))
+        # closing the sink writes out the batch again
+        run_manifest_writer._write_line = write_line
+        sink.close()
+        outputs["trees"].close()
+        run_manifest_writer.close()
+        check_outputs([0, 1, 2, 3])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of the summary statistic group names.
+"""
+
+import unittest
+
+from inphest import statisticgroups
+from inphest import summarize
+
+
+class ValidateStatisticGroupsTestCase(unittest.TestCase):
+
+    def test_calculation_order(self):
+        self.assertEqual(
+                statisticgroups.validate_statistic_groups(["profile_distance", "community", "community"]),
+                ("community", "profile_distance"))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            statisticgroups.validate_statistic_groups(["community", "x"])
+        with self.assertRaises(ValueError):
+            statisticgroups.validate_statistic_groups([])
+
+    def test_calculated(self):
+        calculator = summarize.SummaryStatsCalculator
+        self.assertEqual(tuple(calculator.STATISTIC_GROUPS), statisticgroups.STATISTIC_GROUPS)
+        for method_name in calculator.STATISTIC_GROUPS.values():
+            self.assertTrue(callable(getattr(calculator, method_name)))
+        self.assertEqual(statisticgroups.validate_statistic_groups(statisticgroups.DEFAULT_STATISTIC_GROUPS),
+                statisticgroups.DEFAULT_STATISTIC_GROUPS)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of summary statistics calculations.
+"""
+
+import itertools
+import random
+import unittest
+
+import dendropy
+from dendropy.calculate import treecompare
+
+from inphest import summarize
+
+def search_permutations(distance_table):
+    # the original enumeration of all permutations of the columns
+    comparison_vector = [0.0] * len(distance_table)
+    current_minimum_distance = None
+    current_joint_minimum_vector = []
+    for col_idxs in itertools.permutations(range(len(distance_table[0])), len(distance_table)):
+        distances = [distance_table[row_idx][col_idx] for row_idx, col_idx in enumerate(col_idxs) if distance_table[row_idx][col_idx] is not None]
+        if not distances:
+            continue
+        ed = summarize.SummaryStatsCalculator._euclidean_distance(distances, comparison_vector)
+        if current_minimum_distance is None or ed < current_minimum_distance:
+            current_minimum_distance = ed
+            current_joint_minimum_vector = distances
+    return current_joint_minimum_vector
+
+def compose_distance_table(rng, num_rows, num_cols, proportion_unmeasured):
+    return [[None if rng.random() < proportion_unmeasured else rng.uniform(0.0, 2.0) for col_idx in range(num_cols)]
+            for row_idx in range(num_rows)]
+
+class MatchExchangeableAssemblagesTestCase(unittest.TestCase):
+
+    def check_matching(self, distance_table):
+        matched_distances = summarize.SummaryStatsCalculator.match_exchangeable_assemblages(distance_table)
+        expected = search_permutations(distance_table)
+        if any(d is None for row in distance_table for d in row):
+            self.assertEqual(matched_distances, expected, distance_table)
+        else:
+            # ties may be resolved differently
+            comparison_vector = [0.0] * len(distance_table)
+            self.assertEqual(len(matched_distances), len(expected))
+            self.assertAlmostEqual(
+                    summarize.SummaryStatsCalculator._euclidean_distance(matched_distances, comparison_vector),
+                    summarize.SummaryStatsCalculator._euclidean_distance(expected, comparison_vector))
+
+    def test_unmeasured_pairs(self):
+        # the matching measuring both pairs is better than the one measuring
+        # only one, once weighted by the number of pairs measured
+        self.assertEqual(summarize.SummaryStatsCalculator.match_exchangeable_assemblages([[1.0, 1.0], [None, 1.0]]), [1.0, 1.0])
+        self.assertEqual(summarize.SummaryStatsCalculator.match_exchangeable_assemblages([[None, None], [None, 1.0]]), [1.0])
+        self.assertEqual(summarize.SummaryStatsCalculator.match_exchangeable_assemblages([[None, None], [None, None]]), [])
+
+    def test_against_permutations(self):
+        rng = random.Random(1)
+        for num_rows in range(1, 5):
+            for num_cols in range(num_rows, 6):
+                for proportion_unmeasured in (0.0, 0.2, 0.5, 0.8):
+                    for rep in range(20):
+                        self.check_matching(compose_distance_table(rng, num_rows, num_cols, proportion_unmeasured))
+
+    def test_ties(self):
+        rng = random.Random(2)
+        for rep in range(200):
+            distance_table = [[rng.choice([None, 0.0, 1.0, 2.0]) for col_idx in range(4)] for row_idx in range(3)]
+            self.check_matching(distance_table)
+
+class EstimateTreeFromAssemblageLeafsetsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.taxon_namespace = dendropy.TaxonNamespace(["A", "B", "C", "D", "E", "F"])
+        self.taxa = dict((taxon.label, taxon) for taxon in self.taxon_namespace)
+
+    def compose_assemblages(self, labels_list):
+        return [set(self.taxa[label] for label in labels) for labels in labels_list]
+
+    def check_tree(self, tree, newick):
+        expected_tree = dendropy.Tree.get(data=newick, schema="newick", taxon_namespace=self.taxon_namespace, rooting="force-unrooted")
+        tree.encode_bipartitions()
+        expected_tree.encode_bipartitions()
+        self.assertEqual(treecompare.symmetric_difference(tree, expected_tree), 0, tree.as_string("newick"))
+
+    def compose_path_lengths(self, tree):
+        pdm = tree.phylogenetic_distance_matrix()
+        taxa = [nd.taxon for nd in tree.leaf_node_iter()]
+        return dict(((t1.label, t2.label), pdm.distance(t1, t2)) for t1 in taxa for t2 in taxa if t1 is not t2)
+
+    def test_known_case(self):
+        # A and B, and D and E, occur in the same assemblages; C is shared
+        # by one assemblage of each
+        assemblages = self.compose_assemblages(["AB", "ABC", "CDE", "DE"])
+        tree = summarize.estimate_tree_from_assemblage_leafsets(
+                taxon_namespace=self.taxon_namespace,
+                assemblage_memberships=assemblages,
+                only_include_taxa=set(self.taxa[label] for label in "ABCDE"))
+        self.assertFalse(tree.is_rooted)
+        self.assertEqual(sorted(nd.taxon.label for nd in tree.leaf_node_iter()), ["A", "B", "C", "D", "E"])
+        self.check_tree(tree, "((A,B),C,(D,E));")
+        # Jaccard distances between the sets of assemblages of each taxon
+        # are additive here, and so recovered exactly
+        path_lengths = self.compose_path_lengths(tree)
+        for (label1, label2), d in (
+                (("A", "B"), 0.0),
+                (("A", "C"), 2.0 / 3.0),
+                (("A", "D"), 1.0),
+                (("C", "E"), 2.0 / 3.0),
+                (("D", "E"), 0.0)):
+            self.assertAlmostEqual(path_lengths[(label1, label2)], d)
+
+    def test_node_memberships(self):
+        tree = dendropy.Tree.get(data="((A,B),(C,(D,E)));", schema="newick", taxon_namespace=self.taxon_namespace)
+        nodes = dict((nd.taxon.label, nd) for nd in tree.leaf_node_iter())
+        assemblages = [set(nodes[label] for label in labels) for labels in ["AB", "ABC", "CDE", "DE"]]
+        estimated_tree = summarize.estimate_tree_from_assemblage_leafsets(
+                taxon_namespace=self.taxon_namespace,
+                assemblage_memberships=assemblages,
+                membership_element_type=dendropy.Node,
+                only_include_taxa=set(self.taxa[label] for label in "ABCDE"))
+        self.check_tree(estimated_tree, "((A,B),C,(D,E));")
+
+    def test_taxa_in_no_assemblage(self):
+        # F belongs to no assemblage: at distance 1 from all other taxa
+        assemblages = self.compose_assemblages(["AB", "ABC", "CDE", "DE"])
+        tree = summarize.estimate_tree_from_assemblage_leafsets(
+                taxon_namespace=self.taxon_namespace,
+                assemblage_memberships=assemblages)
+        path_lengths = self.compose_path_lengths(tree)
+        self.assertEqual(len(list(tree.leaf_node_iter())), 6)
+        for label in "ABCDE":
+            self.assertAlmostEqual(path_lengths[("F", label)], 1.0, delta=0.5)
+
+    def test_small_cases(self):
+        for labels in ("A", "AB", "ABC"):
+            tree = summarize.estimate_tree_from_assemblage_leafsets(
+                    taxon_namespace=self.taxon_namespace,
+                    assemblage_memberships=self.compose_assemblages(["AB", "BC"]),
+                    only_include_taxa=set(self.taxa[label] for label in labels))
+            self.assertEqual(sorted(nd.taxon.label for nd in tree.leaf_node_iter()), list(labels))
+
+class NeighborJoiningTreeTestCase(unittest.TestCase):
+
+    def test_additive_distances(self):
+        # distances along a known tree are recovered, with its topology
+        taxon_namespace = dendropy.TaxonNamespace()
+        true_tree = dendropy.Tree.get(
+                data="((A:1,B:2):0.5,(C:1.5,(D:0.25,E:3):1):2,F:0.75);",
+                schema="newick",
+                taxon_namespace=taxon_namespace,
+                rooting="force-unrooted")
+        pdm = true_tree.phylogenetic_distance_matrix()
+        taxa = list(taxon_namespace)
+        distances = [[pdm.distance(t1, t2) if t1 is not t2 else 0.0 for t2 in taxa] for t1 in taxa]
+        tree = summarize.neighbor_joining_tree(taxa=taxa, distances=distances, taxon_namespace=taxon_namespace)
+        true_tree.encode_bipartitions()
+        tree.encode_bipartitions()
+        self.assertEqual(treecompare.symmetric_difference(tree, true_tree), 0)
+        estimated_pdm = tree.phylogenetic_distance_matrix()
+        for t1 in taxa:
+            for t2 in taxa:
+                if t1 is not t2:
+                    self.assertAlmostEqual(estimated_pdm.distance(t1, t2), pdm.distance(t1, t2))
+
+if __name__ == "__main__":
+    unittest.main()
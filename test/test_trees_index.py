@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+##
+##  Copyright 2015 Jeet Sukumaran and Mark T. Holder.
+##  All rights reserved.
+##
+##  See "LICENSE.txt" for terms and conditions of usage.
+##
+##############################################################################
+
+"""
+Tests of the index of trees files.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from inphest import columnar
+from inphest import utility
+
+TREES_FILE_HEADER = "#NEXUS\n\nBEGIN TREES;\n"
+
+def compose_tree_str(tree_idx):
+    # non-ASCII labels, so that offsets and lengths are checked to be in
+    # bytes rather than characters
+    return "    TREE t{0} = [&R] ((s{0}_é:1.0,s{0}_b:1.0):0.5,s{0}_c:1.5);\n".format(tree_idx)
+
+class TreesIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_trees(self, trees_filepath, tree_idxs, offset=None, num_records=None, is_append=False):
+        trees_file = utility.open_output_file(trees_filepath, append=is_append)
+        if offset is None:
+            trees_file.write(TREES_FILE_HEADER)
+            offset = len(TREES_FILE_HEADER.encode("utf-8"))
+        trees_index = columnar.TreesIndexWriter(trees_filepath, offset=offset, num_records=num_records)
+        sink = utility.BufferedOutputSink(max_buffered_records=2)
+        for tree_idx in tree_idxs:
+            tree_str = compose_tree_str(tree_idx)
+            sink.write(trees_file, tree_str)
+            sink.write(trees_index, (tree_str, tree_idx, tree_idx % 2, 0, 1000 + tree_idx))
+            sink.end_record()
+        sink.close()
+        trees_file.close()
+        return trees_index
+
+    def check_read_back(self, trees_filepath, tree_idxs):
+        trees_index = columnar.load_trees_index(trees_filepath)
+        self.assertEqual(len(trees_index), len(tree_idxs))
+        self.assertEqual(list(trees_index["replicate_idx"]), tree_idxs)
+        self.assertEqual(list(trees_index["host_history_idx"]), [tree_idx % 2 for tree_idx in tree_idxs])
+        self.assertEqual(list(trees_index["random_seed"]), [1000 + tree_idx for tree_idx in tree_idxs])
+        # random access, in any order
+        positions = list(reversed(range(len(tree_idxs))))
+        tree_strs = list(columnar.read_indexed_tree_strings(trees_filepath, positions))
+        self.assertEqual(tree_strs, [compose_tree_str(tree_idxs[position]) for position in positions])
+        with utility.open_input_file(trees_filepath) as src:
+            self.assertEqual(src.read(), TREES_FILE_HEADER + "".join(compose_tree_str(tree_idx) for tree_idx in tree_idxs))
+
+    def test_read_back(self):
+        trees_filepath = os.path.join(self.tmp_dir, "results.trees")
+        trees_index = self.write_trees(trees_filepath, list(range(5)))
+        self.assertEqual(trees_index.num_records, 5)
+        self.check_read_back(trees_filepath, list(range(5)))
+
+    def test_read_back_compressed(self):
+        trees_filepath = os.path.join(self.tmp_dir, "results.trees.gz")
+        self.write_trees(trees_filepath, list(range(5)))
+        self.check_read_back(trees_filepath, list(range(5)))
+
+    def test_unknown_values(self):
+        trees_filepath = os.path.join(self.tmp_dir, "results.trees")
+        trees_index = columnar.TreesIndexWriter(trees_filepath)
+        trees_index.write_batch([("(a,b);\n", None, None, None, None)])
+        record = columnar.load_trees_index(trees_filepath)[0]
+        self.assertEqual(record["offset"], 0)
+        self.assertEqual(record["length"], 7)
+        for field in ("replicate_idx", "host_history_idx", "host_history_sample_idx", "random_seed"):
+            self.assertEqual(record[field], -1)
+
+    def test_reopen_and_append(self):
+        trees_filepath = os.path.join(self.tmp_dir, "results.trees")
+        self.write_trees(trees_filepath, list(range(4)))
+        # truncate the trees file and the index to the first two trees, as
+        # when resuming a run, and append further trees
+        trees_index = columnar.load_trees_index(trees_filepath, is_memory_mapped=False)
+        size = int(trees_index[1]["offset"] + trees_index[1]["length"])
+        with open(trees_filepath, "r+b") as dest:
+            dest.truncate(size)
+        self.write_trees(trees_filepath, [10, 11], offset=size, num_records=2, is_append=True)
+        self.check_read_back(trees_filepath, [0, 1, 10, 11])
+
+    def test_truncate(self):
+        trees_filepath = os.path.join(self.tmp_dir, "results.trees")
+        trees_index = self.write_trees(trees_filepath, list(range(4)))
+        trees_index.truncate(2)
+        size = trees_index.offset
+        self.assertEqual(size, len(TREES_FILE_HEADER.encode("utf-8")) + len(compose_tree_str(0).encode("utf-8")) * 2)
+        with open(trees_filepath, "r+b") as dest:
+            dest.truncate(size)
+        with open(trees_filepath, "a") as dest:
+            for tree_idx in (10, 11):
+                dest.write(compose_tree_str(tree_idx))
+        trees_index.write_batch([(compose_tree_str(tree_idx), tree_idx, tree_idx % 2, 0, 1000 + tree_idx) for tree_idx in (10, 11)])
+        self.check_read_back(trees_filepath, [0, 1, 10, 11])
+        # to no further back than the index was reopened with
+        trees_index = columnar.TreesIndexWriter(trees_filepath, offset=size, num_records=2)
+        trees_index.truncate(2)
+        self.assertEqual(trees_index.offset, size)
+        with self.assertRaises(ValueError):
+            trees_index.truncate(1)
+
+    def test_not_a_trees_index(self):
+        trees_filepath = os.path.join(self.tmp_dir, "results.trees")
+        columnar.AppendableArrayFile(columnar.compose_trees_index_filepath(trees_filepath), "<f8")
+        with self.assertRaises(ValueError):
+            columnar.load_trees_index(trees_filepath)
+
+if __name__ == "__main__":
+    unittest.main()